@@ -0,0 +1,172 @@
+import math
+import logging
+import threading
+from .config import Config
+from .job_queue import PRIORITY_CLASSES
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Задача не принята: бюджет мощности исчерпан"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Контроль приема задач по объему аудио в работе.
+
+    Нагрузка - секунды аудио и оценка секунд обработки задач в очереди и в
+    работе (берется у диспетчера). У каждого класса приоритета свой бюджет и
+    своя нагрузка: пакетная (bulk) работа обслуживается после интерактивной
+    и не расходует бюджет interactive, поэтому большой ночной пакет не
+    закрывает прием /recognize. Задача принимается, если после нее нагрузка
+    ее класса не превысит бюджет; иначе клиенту предлагается повторить
+    запрос через время, за которое обработчики освободят нужный объем.
+    Пока в классе нет задач, одна задача принимается всегда, чтобы запись
+    длиннее бюджета не отклонялась бесконечно.
+    """
+
+    def __init__(self, dispatcher, max_audio_seconds=None, max_cpu_seconds=None,
+                 max_bulk_audio_seconds=None, max_bulk_cpu_seconds=None):
+        self.dispatcher = dispatcher
+        self.max_audio_seconds = Config.ADMISSION_MAX_AUDIO_SECONDS \
+            if max_audio_seconds is None else max_audio_seconds
+        self.max_cpu_seconds = Config.ADMISSION_MAX_CPU_SECONDS \
+            if max_cpu_seconds is None else max_cpu_seconds
+        # Бюджеты классов приоритета: (секунды аудио, секунды обработки), 0 - без ограничения
+        self.budgets = {
+            'interactive': (self.max_audio_seconds, self.max_cpu_seconds),
+            'bulk': (
+                Config.ADMISSION_MAX_BULK_AUDIO_SECONDS if max_bulk_audio_seconds is None else max_bulk_audio_seconds,
+                Config.ADMISSION_MAX_BULK_CPU_SECONDS if max_bulk_cpu_seconds is None else max_bulk_cpu_seconds
+            )
+        }
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _priority(job):
+        return job.get('priority') or PRIORITY_CLASSES[0]
+
+    def _class_capacity(self, priority):
+        """Нагрузка и бюджет одного класса"""
+        load = self.dispatcher.load(priority)
+        max_audio, max_cpu = self.budgets[priority]
+        free = []
+        if max_audio:
+            free.append(1.0 - load['audio_seconds'] / max_audio)
+        if max_cpu:
+            free.append(1.0 - load['cpu_seconds'] / max_cpu)
+        available = max(0.0, min(free)) if free else 1.0
+        return {
+            'queued_jobs': load['queued_jobs'],
+            'running_jobs': load['running_jobs'],
+            'audio_seconds_in_flight': round(load['audio_seconds'], 1),
+            'audio_seconds_budget': max_audio or None,
+            'cpu_seconds_in_flight': round(load['cpu_seconds'], 1),
+            'cpu_seconds_budget': max_cpu or None,
+            'available': round(available, 3),
+            'accepting': available > 0.0
+        }
+
+    def capacity(self):
+        """
+        Текущий бюджет и нагрузка (для балансировщика): поля верхнего уровня
+        относятся к интерактивному классу, bulk - к пакетному
+        """
+        capacity = self._class_capacity('interactive')
+        load = self.dispatcher.load()
+        capacity.update({
+            'total_queued_jobs': load['queued_jobs'],
+            'total_running_jobs': load['running_jobs'],
+            'realtime_factor': round(self.dispatcher.realtime_factor, 3),
+            'bulk': self._class_capacity('bulk')
+        })
+        return capacity
+
+    def _over_budget(self, load, audio_seconds, priority):
+        max_audio, max_cpu = self.budgets[priority]
+        over_audio = max_audio and load['audio_seconds'] + audio_seconds > max_audio
+        over_cpu = max_cpu and \
+            load['cpu_seconds'] + audio_seconds * self.dispatcher.realtime_factor > max_cpu
+        return bool(over_audio or over_cpu)
+
+    def _retry_after(self, load, audio_seconds, priority='interactive'):
+        """Через сколько секунд освободится место под задачу"""
+        max_audio, max_cpu = self.budgets[priority]
+        factor = self.dispatcher.realtime_factor
+        excess = 0.0
+        if max_audio:
+            excess = max(excess, (load['audio_seconds'] + audio_seconds - max_audio) * factor)
+        if max_cpu:
+            excess = max(excess, load['cpu_seconds'] + audio_seconds * factor - max_cpu)
+        workers = max(1, self.dispatcher.workers)
+        return int(min(3600, max(1, math.ceil(excess / workers))))
+
+    def retry_after(self, audio_seconds, priority='interactive'):
+        """Через сколько секунд освободится место под audio_seconds аудио класса priority"""
+        return self._retry_after(self.dispatcher.load(priority), audio_seconds, priority)
+
+    def _reject(self, load, audio_seconds, priority):
+        retry_after = self._retry_after(load, audio_seconds, priority)
+        logger.warning(f'Admission rejected: {audio_seconds:.0f}s of {priority} audio, '
+                       f'{load["audio_seconds"]:.0f}s in flight, retry after {retry_after}s')
+        raise AdmissionRejected('Сервер перегружен, повторите запрос позже', retry_after)
+
+    def check(self, audio_seconds=0.0, priority='interactive'):
+        """Проверяет, есть ли место под задачу класса priority; иначе AdmissionRejected"""
+        load = self.dispatcher.load(priority)
+        if not load['queued_jobs'] and not load['running_jobs']:
+            return
+        if self._over_budget(load, audio_seconds, priority):
+            self._reject(load, audio_seconds, priority)
+
+    def _admit_prefix(self, jobs):
+        """Самый длинный префикс jobs, который помещается в бюджеты классов"""
+        loads = {}
+        added = {}
+        accepted = []
+        for task_id, job in jobs:
+            priority = self._priority(job)
+            if priority not in loads:
+                loads[priority] = self.dispatcher.load(priority)
+                added[priority] = 0.0
+            load = loads[priority]
+            seconds = job.get('audio_seconds') or 0.0
+            idle = not load['queued_jobs'] and not load['running_jobs'] and not added[priority]
+            if not idle and self._over_budget(load, added[priority] + seconds, priority):
+                if not accepted:
+                    self._reject(load, added[priority] + seconds, priority)
+                break
+            added[priority] += seconds
+            accepted.append((task_id, job))
+        return accepted
+
+    def submit(self, jobs, on_accept=None, partial=False):
+        """
+        Атомарно проверяет бюджет и ставит задачи [(task_id, job)] в очередь
+        диспетчера. По умолчанию задачи принимаются все или ни одной; при
+        partial=True принимается начало списка, помещающееся в бюджет (хотя
+        бы одна задача, иначе AdmissionRejected), остальное клиент
+        отправляет позже. on_accept(принятые задачи) вызывается после
+        проверки, до постановки в очередь. Возвращает принятые задачи.
+        """
+        with self._lock:
+            if partial:
+                accepted = self._admit_prefix(jobs)
+            else:
+                totals = {}
+                for _, job in jobs:
+                    priority = self._priority(job)
+                    totals[priority] = totals.get(priority, 0.0) + (job.get('audio_seconds') or 0.0)
+                for priority, audio_seconds in totals.items():
+                    self.check(audio_seconds, priority)
+                accepted = list(jobs)
+            if on_accept is not None:
+                on_accept(accepted)
+            for task_id, job in accepted:
+                self.dispatcher.submit(task_id, job)
+            return accepted
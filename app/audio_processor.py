@@ -1,63 +1,137 @@
 import os
+import logging
 import subprocess
 import soundfile as sf
 import numpy as np
 
+try:
+    import av
+except ImportError:  # PyAV необязателен: без него используется ffmpeg
+    av = None
+
+logger = logging.getLogger(__name__)
+
+# Частота дискретизации, с которой работают Whisper и pyannote
+SAMPLE_RATE = 16000
+
 class AudioProcessor:
+    def load_audio(self, input_path, sample_rate=SAMPLE_RATE):
+        """
+        Декодирует аудио/видео файл в моно float32 массив с заданной частотой
+
+        WAV/FLAC/OGG с нужной частотой читаются напрямую через soundfile,
+        остальные форматы декодируются и передискретизируются в процессе через
+        PyAV. Если PyAV не установлен или не справился, используется ffmpeg.
+        """
+        try:
+            # Частота берется из заголовка: файл с другой частотой не читается
+            # целиком впустую перед декодированием через PyAV
+            if sf.info(input_path).samplerate == sample_rate:
+                audio, _ = sf.read(input_path, dtype='float32', always_2d=True)
+                return audio.mean(axis=1) if audio.shape[1] > 1 else audio[:, 0]
+        except RuntimeError:
+            # Формат не поддерживается libsndfile
+            pass
+
+        if av is not None:
+            try:
+                return self._decode_with_av(input_path, sample_rate)
+            except Exception as e:
+                logger.warning(f"PyAV failed to decode {input_path}, falling back to ffmpeg: {str(e)}")
+
+        return self._decode_with_ffmpeg(input_path, sample_rate)
+
+    @staticmethod
+    def duration(input_path):
+        """
+        Длительность файла в секундах по заголовку (без декодирования).
+        Для форматов, которые не читает libsndfile, возвращает 0.
+        """
+        try:
+            return sf.info(input_path).duration
+        except RuntimeError:
+            return 0.0
+
+    @staticmethod
+    def _decode_with_av(input_path, sample_rate):
+        """Декодирует первую аудиодорожку файла средствами PyAV"""
+        resampler = av.AudioResampler(format='flt', layout='mono', rate=sample_rate)
+        chunks = []
+        with av.open(input_path) as container:
+            stream = container.streams.audio[0]
+            for frame in container.decode(stream):
+                for resampled in resampler.resample(frame):
+                    chunks.append(resampled.to_ndarray().reshape(-1))
+            # Забираем остаток из буфера передискретизации
+            for resampled in resampler.resample(None):
+                chunks.append(resampled.to_ndarray().reshape(-1))
+
+        if not chunks:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(chunks).astype(np.float32, copy=False)
+
+    @staticmethod
+    def _decode_with_ffmpeg(input_path, sample_rate):
+        """Декодирует файл процессом ffmpeg, получая PCM через pipe без временных файлов"""
+        command = [
+            'ffmpeg', '-nostdin',
+            '-i', input_path,
+            '-f', 's16le',
+            '-acodec', 'pcm_s16le',
+            '-ar', str(sample_rate),
+            '-ac', '1',
+            '-'
+        ]
+
+        try:
+            output = subprocess.run(command, check=True, capture_output=True).stdout
+        except subprocess.CalledProcessError as e:
+            raise Exception(f"Ошибка декодирования файла: {e.stderr.decode()}")
+        return np.frombuffer(output, np.int16).astype(np.float32) / 32768.0
+
+    @staticmethod
+    def write_wav(audio, output_path, sample_rate=SAMPLE_RATE):
+        """Сохраняет моно float32 массив в WAV (PCM 16 бит)"""
+        sf.write(output_path, audio, sample_rate, subtype='PCM_16')
+        return output_path
+
     def convert_to_wav(self, input_path):
         """Конвертирует аудио/видео файл в WAV формат"""
         filename = os.path.splitext(os.path.basename(input_path))[0]
         output_path = os.path.join(os.path.dirname(input_path), f"{filename}.wav")
-        
+
         if input_path.endswith('.wav'):
             return input_path
-            
-        command = [
-            'ffmpeg', '-i', input_path,
-            '-acodec', 'pcm_s16le',
-            '-ar', '16000',
-            '-ac', '1',
-            '-y', output_path
-        ]
-        
+
         try:
-            subprocess.run(command, check=True, capture_output=True)
-            return output_path
-        except subprocess.CalledProcessError as e:
-            raise Exception(f"Ошибка конвертации файла: {e.stderr.decode()}")
+            return self.write_wav(self.load_audio(input_path), output_path)
+        except Exception as e:
+            raise Exception(f"Ошибка конвертации файла: {str(e)}")
+
+    def merge_audio(self, input_files):
+        """Декодирует и объединяет несколько файлов в один массив без записи на диск"""
+        try:
+            return np.concatenate([self.load_audio(file) for file in input_files])
+        except Exception as e:
+            raise Exception(f"Ошибка при объединении файлов: {str(e)}")
 
     def merge_wav_files(self, input_files, output_path):
         """Объединяет несколько WAV файлов в один"""
         try:
-            # Создаем временный файл со списком файлов для ffmpeg
-            temp_list = output_path + '.txt'
-            with open(temp_list, 'w', encoding='utf-8') as f:
+            # Файлы дописываются по одному, в памяти хранится только текущий
+            with sf.SoundFile(output_path, 'w', samplerate=SAMPLE_RATE,
+                              channels=1, subtype='PCM_16') as output:
                 for file in input_files:
-                    f.write(f"file '{file}'\n")
-
-            # Используем ffmpeg для объединения файлов
-            command = [
-                'ffmpeg', '-f', 'concat', '-safe', '0',
-                '-i', temp_list,
-                '-c', 'copy',
-                '-y', output_path
-            ]
-
-            subprocess.run(command, check=True, capture_output=True)
-            
-            # Удаляем временный файл
-            os.remove(temp_list)
-            
+                    output.write(self.load_audio(file))
+
             return output_path
-        except subprocess.CalledProcessError as e:
-            raise Exception(f"Ошибка объединения файлов: {e.stderr.decode()}")
         except Exception as e:
             raise Exception(f"Ошибка при объединении файлов: {str(e)}")
 
     def extract_segment(self, input_path, output_path, start_time, duration):
         """
         Извлекает сегмент аудио из основного файла
-        
+
         Args:
             input_path: путь к входному аудио файлу
             output_path: путь для сохранения сегмента
@@ -65,20 +139,20 @@ class AudioProcessor:
             duration: длительность сегмента в секундах
         """
         try:
-            command = [
-                'ffmpeg', '-i', input_path,
-                '-ss', str(start_time),
-                '-t', str(duration),
-                '-acodec', 'pcm_s16le',
-                '-ar', '16000',
-                '-ac', '1',
-                '-y', output_path
-            ]
-            
-            subprocess.run(command, check=True, capture_output=True)
-            return output_path
-            
-        except subprocess.CalledProcessError as e:
-            raise Exception(f"Ошибка извлечения сегмента: {e.stderr.decode()}")
+            start = int(start_time * SAMPLE_RATE)
+            frames = int(duration * SAMPLE_RATE)
+
+            # Для WAV с нужной частотой читаем только сам сегмент
+            try:
+                info = sf.info(input_path)
+            except RuntimeError:
+                info = None
+            if info and info.samplerate == SAMPLE_RATE and info.channels == 1:
+                segment, _ = sf.read(input_path, start=start, frames=frames, dtype='float32')
+            else:
+                segment = self.load_audio(input_path)[start:start + frames]
+
+            return self.write_wav(segment, output_path)
+
         except Exception as e:
-            raise Exception(f"Ошибка при извлечении сегмента: {str(e)}") 
\ No newline at end of file
+            raise Exception(f"Ошибка при извлечении сегмента: {str(e)}")
@@ -0,0 +1,208 @@
+import io
+import os
+import time
+import zipfile
+import logging
+import threading
+from collections import OrderedDict
+from .config import Config
+from .task_registry import TERMINAL_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# Поля статуса задачи, которые нужны сводке пакета
+TASK_SUMMARY_FIELDS = ('status', 'progress', 'result_file', 'error')
+# Задача удалена из хранилища по TTL - для сводки она тоже завершена
+FINISHED_STATUSES = TERMINAL_STATUSES + ('expired',)
+
+
+class BatchRegistry:
+    """
+    Пакеты независимых задач: каждый файл пакета распознается отдельной
+    задачей в общей очереди, пакет хранит только их список.
+
+    Сводка строится по реестру задач; последний известный статус каждой
+    задачи пакета запоминается из обновлений, поэтому результат не
+    теряется, даже если реестр уже вытеснил завершенную задачу. С общим
+    хранилищем (job_store) состав пакета сохраняется и в нем, и сводка
+    доступна на любом узле.
+    """
+
+    def __init__(self, tasks, ttl=None):
+        self.tasks = tasks
+        self.ttl = Config.TASK_TTL if ttl is None else ttl
+        self._batches = OrderedDict()
+        self._task_batches = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, batch_id):
+        with self._lock:
+            return batch_id in self._batches
+
+    def create(self, batch_id, task_ids, files):
+        """Регистрирует пакет из уже созданных задач (по одной на файл)"""
+        self.cleanup()
+        with self._lock:
+            self._batches[batch_id] = {
+                'created_at': time.time(),
+                'tasks': OrderedDict(
+                    (task_id, {'file': filename, 'status': 'queued', 'progress': 0})
+                    for task_id, filename in zip(task_ids, files)
+                )
+            }
+            for task_id in task_ids:
+                self._task_batches[task_id] = batch_id
+        if self.tasks.shared:
+            self.tasks.put_record('batch', batch_id, {
+                'created_at': self._batches[batch_id]['created_at'],
+                'task_ids': list(task_ids),
+                'files': list(files)
+            })
+
+    def task_updated(self, task_id, fields):
+        """Запоминает обновление статуса задачи, если она входит в пакет"""
+        with self._lock:
+            batch_id = self._task_batches.get(task_id)
+            if batch_id is None:
+                return
+            task = self._batches[batch_id]['tasks'][task_id]
+            if task['status'] in TERMINAL_STATUSES:
+                return
+            task.update({key: value for key, value in fields.items() if key in TASK_SUMMARY_FIELDS})
+
+    def _snapshot(self, batch_id):
+        """Актуальные статусы задач пакета {task_id: поля}"""
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if batch is not None:
+                tasks = OrderedDict((task_id, dict(task)) for task_id, task in batch['tasks'].items())
+                created_at = batch['created_at']
+        if batch is None:
+            # Пакет создан на другом узле
+            record = self.tasks.get_record('batch', batch_id) if self.tasks.shared else None
+            if record is None:
+                return None
+            created_at = record['created_at']
+            tasks = OrderedDict(
+                (task_id, {'file': filename, 'status': 'expired', 'progress': 0})
+                for task_id, filename in zip(record['task_ids'], record['files'])
+            )
+
+        for task_id, task in tasks.items():
+            status = self.tasks.get(task_id)
+            if status is not None:
+                task.update({key: status[key] for key in TASK_SUMMARY_FIELDS if key in status})
+        return created_at, tasks
+
+    def get(self, batch_id):
+        """Возвращает сводку пакета или None"""
+        snapshot = self._snapshot(batch_id)
+        if snapshot is None:
+            return None
+        created_at, tasks = snapshot
+
+        counts = {}
+        for task in tasks.values():
+            counts[task['status']] = counts.get(task['status'], 0) + 1
+        finished = sum(counts.get(status, 0) for status in FINISHED_STATUSES)
+        if finished == len(tasks):
+            status = 'completed'
+        elif counts.get('queued', 0) == len(tasks):
+            status = 'queued'
+        else:
+            status = 'processing'
+
+        # Завершенные задачи (в том числе с ошибкой) считаются выполненными на 100%
+        progress = sum(100 if task['status'] in FINISHED_STATUSES else task.get('progress', 0)
+                       for task in tasks.values())
+        return {
+            'batch_id': batch_id,
+            'status': status,
+            'progress': int(progress / len(tasks)) if tasks else 100,
+            'total_files': len(tasks),
+            'finished_files': finished,
+            'counts': counts,
+            'created_at': created_at,
+            'tasks': [dict(task, task_id=task_id) for task_id, task in tasks.items()]
+        }
+
+    def results(self, batch_id):
+        """Список (имя в архиве, путь) готовых результатов пакета"""
+        snapshot = self._snapshot(batch_id)
+        if snapshot is None:
+            return None
+        entries = []
+        for index, task in enumerate(snapshot[1].values(), start=1):
+            if task['status'] != 'completed' or not task.get('result_file'):
+                continue
+            path = os.path.join(Config.RESULT_FOLDER, task['result_file'])
+            if not os.path.exists(path):
+                continue
+            # Загруженные файлы имеют вид "<uuid>_<имя>", в архив идет исходное имя
+            original = os.path.splitext(task['file'])[0].split('_', 1)[-1]
+            entries.append((f'{index:05d}_{original}.txt', path))
+        return entries
+
+    def cleanup(self):
+        """Удаляет пакеты, все задачи которых завершены дольше TTL назад"""
+        now = time.time()
+        expired = []
+        for batch_id in list(self._batches):
+            summary = self.get(batch_id)
+            if summary is not None and summary['status'] == 'completed' \
+                    and now - summary['created_at'] > self.ttl:
+                expired.append(batch_id)
+        with self._lock:
+            for batch_id in expired:
+                batch = self._batches.pop(batch_id, None)
+                for task_id in (batch or {}).get('tasks', ()):
+                    self._task_batches.pop(task_id, None)
+        if expired:
+            logger.info(f'Batch cleanup: {len(expired)} removed')
+        return len(expired)
+
+
+class _ZipSink(io.RawIOBase):
+    """Приемник записей ZipFile: байты накапливаются до выдачи клиенту"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(entries, chunk_size=1024 * 1024):
+    """
+    Генератор zip-архива из файлов [(имя в архиве, путь)].
+
+    Архив пишется в несмещаемый поток (zipfile использует дескрипторы
+    данных), части отдаются по мере чтения файлов, поэтому архив целиком
+    в памяти не собирается.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for arcname, path in entries:
+            with open(path, 'rb') as source, archive.open(arcname, 'w') as target:
+                while True:
+                    chunk = source.read(chunk_size)
+                    if not chunk:
+                        break
+                    target.write(chunk)
+                    data = sink.pop()
+                    if data:
+                        yield data
+            data = sink.pop()
+            if data:
+                yield data
+    yield sink.pop()
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from werkzeug.utils import secure_filename
+
+logger = logging.getLogger(__name__)
+
+
+class ChunkedUploadError(Exception):
+    """Ошибка загрузки по частям с HTTP-кодом для ответа клиенту"""
+
+    def __init__(self, message, status_code=400, offset=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.offset = offset
+
+
+class ChunkedUploadManager:
+    """
+    Возобновляемая загрузка файлов по частям.
+
+    Части дописываются прямо в файл <upload_id>.part в каталоге загрузок,
+    а смещение берется из его размера на диске, поэтому после обрыва
+    соединения (и даже перезапуска сервера) клиент продолжает с места
+    остановки.
+    """
+
+    BLOCK_SIZE = 1024 * 1024  # Размер блока при записи потока на диск
+
+    def __init__(self, upload_folder):
+        self.upload_folder = upload_folder
+        self.sessions_folder = os.path.join(upload_folder, '.chunked')
+        os.makedirs(self.sessions_folder, exist_ok=True)
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock(self, upload_id):
+        """Блокировка сессии; создается только для существующей сессии"""
+        with self._locks_guard:
+            lock = self._locks.get(upload_id)
+            if lock is None:
+                if not os.path.exists(self._paths(upload_id)[0]):
+                    raise ChunkedUploadError('Сессия загрузки не найдена', 404)
+                lock = self._locks[upload_id] = threading.Lock()
+            return lock
+
+    def _forget(self, upload_id):
+        with self._locks_guard:
+            self._locks.pop(upload_id, None)
+
+    def _prune_locks(self):
+        """Удаляет блокировки сессий, удаленных очисткой диска по истечении срока"""
+        with self._locks_guard:
+            for upload_id, lock in list(self._locks.items()):
+                if not lock.locked() and not os.path.exists(self._paths(upload_id)[0]):
+                    del self._locks[upload_id]
+
+    def _paths(self, upload_id):
+        upload_id = secure_filename(upload_id)
+        base = os.path.join(self.sessions_folder, upload_id)
+        return base + '.json', base + '.part'
+
+    def _load_meta(self, upload_id):
+        meta_path, part_path = self._paths(upload_id)
+        if not os.path.exists(meta_path):
+            raise ChunkedUploadError('Сессия загрузки не найдена', 404)
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        meta['offset'] = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        return meta
+
+    def init(self, filename, size):
+        """Создает сессию загрузки и возвращает ее описание"""
+        self._prune_locks()
+        upload_id = str(uuid.uuid4())
+        meta_path, part_path = self._paths(upload_id)
+        meta = {
+            'upload_id': upload_id,
+            'filename': secure_filename(filename),
+            'size': size,
+            'created_at': time.time()
+        }
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        open(part_path, 'wb').close()
+
+        logger.info(f'Created chunked upload {upload_id} for {filename} ({size} bytes)')
+        meta['offset'] = 0
+        return meta
+
+    def status(self, upload_id):
+        """Возвращает описание сессии с текущим смещением"""
+        return self._load_meta(upload_id)
+
+    def append(self, upload_id, offset, stream):
+        """
+        Дописывает часть, начинающуюся с offset, потоково копируя ее на диск.
+
+        Если offset не совпадает с серверным смещением, возвращается 409 с
+        актуальным смещением, чтобы клиент мог продолжить с него.
+        """
+        with self._lock(upload_id):
+            meta = self._load_meta(upload_id)
+            if offset != meta['offset']:
+                raise ChunkedUploadError('Неверное смещение части', 409, meta['offset'])
+
+            _, part_path = self._paths(upload_id)
+            written = meta['offset']
+            with open(part_path, 'ab') as f:
+                while True:
+                    block = stream.read(self.BLOCK_SIZE)
+                    if not block:
+                        break
+                    if written + len(block) > meta['size']:
+                        f.truncate(meta['offset'])
+                        raise ChunkedUploadError('Размер данных превышает заявленный', 413, meta['offset'])
+                    f.write(block)
+                    written += len(block)
+
+            meta['offset'] = written
+            return meta
+
+    def finalize(self, upload_id):
+        """
+        Завершает загрузку: переименовывает собранный файл в каталог загрузок
+        без копирования и возвращает (путь, имя файла).
+        """
+        with self._lock(upload_id):
+            meta = self._load_meta(upload_id)
+            if meta['offset'] != meta['size']:
+                raise ChunkedUploadError('Файл загружен не полностью', 409, meta['offset'])
+
+            meta_path, part_path = self._paths(upload_id)
+            filename = f"{meta['upload_id']}_{meta['filename']}"
+            filepath = os.path.join(self.upload_folder, filename)
+            os.replace(part_path, filepath)
+            os.remove(meta_path)
+
+        self._forget(upload_id)
+        logger.info(f'Chunked upload {upload_id} finalized as {filename}')
+        return filepath, filename
+
+    def abort(self, upload_id):
+        """Отменяет загрузку и удаляет принятые данные"""
+        with self._lock(upload_id):
+            self._load_meta(upload_id)
+            for path in self._paths(upload_id):
+                if os.path.exists(path):
+                    os.remove(path)
+        self._forget(upload_id)
+        logger.info(f'Chunked upload {upload_id} aborted')
@@ -8,7 +8,165 @@ class Config:
     RESULT_FOLDER = os.getenv('RESULT_FOLDER', '/data/results')
     ALLOWED_EXTENSIONS = {'wav', 'mp3', 'mp4'}
     MAX_CONTENT_LENGTH = 1024 * 1024 * 1024  # 1GB
+    # Рекомендуемый размер части при загрузке по частям
+    UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', str(8 * 1024 * 1024)))  # 8MB
+
+    # Передача хвоста предыдущего сегмента в Whisper как initial_prompt
+    WHISPER_CONTEXT_CARRYOVER = os.getenv('WHISPER_CONTEXT_CARRYOVER', 'true').lower() == 'true'
+    # Максимальная длина хвоста (в символах), передаваемого как подсказка
+    WHISPER_PROMPT_CHARS = int(os.getenv('WHISPER_PROMPT_CHARS', '200'))
+
+    # Профиль декодирования Whisper (accurate, balanced, fast - см. DECODE_PROFILES):
+    # по умолчанию и для каждого класса приоритета очереди; задача может
+    # указать свой профиль в поле profile
+    WHISPER_PROFILE = os.getenv('WHISPER_PROFILE', 'accurate')
+    WHISPER_QUEUE_PROFILES = {
+        'interactive': os.getenv('WHISPER_PROFILE_INTERACTIVE') or WHISPER_PROFILE,
+        'bulk': os.getenv('WHISPER_PROFILE_BULK') or WHISPER_PROFILE,
+    }
+
+    # Фильтр галлюцинаций после распознавания: drop - удалять сегменты-тишину,
+    # зацикленный и повторяющийся текст и титры, flag - только отмечать их в
+    # структурированном результате, off - не проверять
+    HALLUCINATION_FILTER = os.getenv('HALLUCINATION_FILTER', 'drop').lower()
+    # Пороги: avg_logprob ниже - низкая уверенность, no_speech_prob выше (при
+    # низкой уверенности) - тишина, степень сжатия текста выше - зацикливание
+    HALLUCINATION_MIN_LOGPROB = float(os.getenv('HALLUCINATION_MIN_LOGPROB', '-1.0'))
+    HALLUCINATION_NO_SPEECH_PROB = float(os.getenv('HALLUCINATION_NO_SPEECH_PROB', '0.6'))
+    HALLUCINATION_MAX_COMPRESSION_RATIO = float(os.getenv('HALLUCINATION_MAX_COMPRESSION_RATIO', '2.8'))
+    # Сколько раз подряд может повторяться фраза из 1-4 слов
+    HALLUCINATION_MAX_REPEATS = int(os.getenv('HALLUCINATION_MAX_REPEATS', '3'))
+    # Дополнительные фразы-галлюцинации через '|'
+    HALLUCINATION_PHRASES = os.getenv('HALLUCINATION_PHRASES', '')
+
+    # Язык распознавания по умолчанию ('auto' - автоопределение один раз на задачу)
+    WHISPER_LANGUAGE = os.getenv('WHISPER_LANGUAGE', 'ru')
+    # Сколько секунд речи с начала записи используется для определения языка
+    LANGUAGE_DETECTION_SECONDS = float(os.getenv('LANGUAGE_DETECTION_SECONDS', '30'))
+
+    # Хранилище центроидов эмбеддингов известных спикеров
+    SPEAKER_STORE_PATH = os.getenv('SPEAKER_STORE_PATH', '/data/speakers/speakers.npz')
+    # Минимальное косинусное сходство для присвоения имени известного спикера
+    SPEAKER_MATCH_THRESHOLD = float(os.getenv('SPEAKER_MATCH_THRESHOLD', '0.5'))
+
+    # Подсказки о числе спикеров по умолчанию (пусто - не ограничивать)
+    DEFAULT_NUM_SPEAKERS = int(os.getenv('DEFAULT_NUM_SPEAKERS') or 0) or None
+    DEFAULT_MIN_SPEAKERS = int(os.getenv('DEFAULT_MIN_SPEAKERS') or 0) or None
+    DEFAULT_MAX_SPEAKERS = int(os.getenv('DEFAULT_MAX_SPEAKERS') or 0) or None
+
+    # Режим выполнения задач: 'inline' - потоки API-процесса,
+    # 'process' - отдельные процессы-обработчики со своими моделями,
+    # 'queue' - общая очередь в JOB_STORE_URL, задачи выполняют процессы app.worker
+    SERVING_MODE = os.getenv('SERVING_MODE', 'inline')
+    # Число одновременно выполняемых задач распознавания
+    INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', '1'))
+
+    # Хранилище статусов задач и очереди: memory:// (один процесс),
+    # sqlite:////data/jobs.db (один узел), redis://redis:6379/0 (несколько узлов).
+    # Для нескольких узлов UPLOAD_FOLDER и RESULT_FOLDER должны быть общим томом
+    JOB_STORE_URL = os.getenv('JOB_STORE_URL', 'memory://')
+    # Префикс ключей в Redis (несколько инсталляций на одном сервере)
+    JOB_STORE_PREFIX = os.getenv('JOB_STORE_PREFIX', 'vr:')
+
+    # Внутри класса приоритета первыми выбирать самые короткие записи клиента
+    SCHEDULER_SHORTEST_FIRST = os.getenv('SCHEDULER_SHORTEST_FIRST', 'false').lower() == 'true'
+    # Начальная оценка времени обработки секунды аудио (уточняется по выполненным задачам)
+    SCHEDULER_REALTIME_FACTOR = float(os.getenv('SCHEDULER_REALTIME_FACTOR', '0.5'))
+
+    # Бюджет приема задач на узел: секунды аудио в очереди и в работе и оценка
+    # секунд обработки (0 - без ограничения). Сверх бюджета ответ 429 с Retry-After
+    ADMISSION_MAX_AUDIO_SECONDS = float(os.getenv('ADMISSION_MAX_AUDIO_SECONDS', str(12 * 3600 * INFERENCE_WORKERS)))
+    ADMISSION_MAX_CPU_SECONDS = float(os.getenv('ADMISSION_MAX_CPU_SECONDS', str(4 * 3600 * INFERENCE_WORKERS)))
+    # Отдельный бюджет пакетного класса (bulk): он не расходует бюджет
+    # интерактивных задач, а пакет сверх бюджета принимается частично
+    ADMISSION_MAX_BULK_AUDIO_SECONDS = float(os.getenv('ADMISSION_MAX_BULK_AUDIO_SECONDS',
+                                                       str(7 * 24 * 3600 * INFERENCE_WORKERS)))
+    ADMISSION_MAX_BULK_CPU_SECONDS = float(os.getenv('ADMISSION_MAX_BULK_CPU_SECONDS', '0'))
+
+    # Долгие запросы статуса (SSE и long-poll): предел одновременных ожиданий
+    # (каждое занимает поток сервера), максимальное ожидание long-poll и
+    # длительность одного SSE-соединения, после которой браузер переподключается
+    STATUS_MAX_WAITERS = int(os.getenv('STATUS_MAX_WAITERS', '32'))
+    STATUS_WAIT_SECONDS = float(os.getenv('STATUS_WAIT_SECONDS', '30'))
+    STATUS_STREAM_SECONDS = float(os.getenv('STATUS_STREAM_SECONDS', '300'))
+
+    # Время хранения завершенных задач в реестре (секунды)
+    TASK_TTL = int(os.getenv('TASK_TTL', str(24 * 3600)))
+    # Максимальное число задач в реестре
+    MAX_TASKS = int(os.getenv('MAX_TASKS', '1000'))
+    # Задача без обновлений дольше этого времени считается зависшей (секунды, 0 - не проверять)
+    TASK_STUCK_TIMEOUT = int(os.getenv('TASK_STUCK_TIMEOUT', str(30 * 60)))
+    # Интервал фоновой очистки реестра задач (секунды)
+    TASK_CLEANUP_INTERVAL = int(os.getenv('TASK_CLEANUP_INTERVAL', '60'))
+
+    # Время хранения файлов (секунды, 0 - не удалять по возрасту)
+    UPLOAD_TTL = int(os.getenv('UPLOAD_TTL', str(24 * 3600)))
+    RESULT_TTL = int(os.getenv('RESULT_TTL', str(7 * 24 * 3600)))
+    # Сжатые варианты результатов (.gz и .zst при установленном zstandard),
+    # создаются один раз по завершении задачи для файлов не меньше порога
+    RESULT_COMPRESSION = os.getenv('RESULT_COMPRESSION', 'true').lower() == 'true'
+    RESULT_COMPRESSION_MIN_BYTES = int(os.getenv('RESULT_COMPRESSION_MIN_BYTES', '1024'))
+    # Время кэширования скачанных результатов клиентом и CDN (секунды)
+    RESULT_CACHE_MAX_AGE = int(os.getenv('RESULT_CACHE_MAX_AGE', str(24 * 3600)))
+    # Квоты на каталоги загрузок и результатов (байты, 0 - без ограничения)
+    UPLOAD_QUOTA_BYTES = int(os.getenv('UPLOAD_QUOTA_BYTES', '0'))
+    RESULT_QUOTA_BYTES = int(os.getenv('RESULT_QUOTA_BYTES', '0'))
+    # Минимальный запас свободного места: новые загрузки отклоняются раньше, чем диск заполнится
+    MIN_FREE_DISK_BYTES = int(os.getenv('MIN_FREE_DISK_BYTES', str(2 * 1024 * 1024 * 1024)))
+    # Интервал фоновой очистки диска (секунды)
+    STORAGE_CLEANUP_INTERVAL = int(os.getenv('STORAGE_CLEANUP_INTERVAL', '300'))
+
+    # Число потоков, параллельно транскрибирующих сегменты одной задачи. Каждый
+    # поток использует свою копию модели Whisper (~1.5GB для medium на поток)
+    ASR_PARALLEL_WORKERS = int(os.getenv('ASR_PARALLEL_WORKERS', '1'))
+    # Сколько непрерывных серий сегментов приходится на поток (для балансировки)
+    ASR_RUNS_PER_WORKER = int(os.getenv('ASR_RUNS_PER_WORKER', '4'))
+    # Вычислять log-mel спектрограмму один раз на задачу и декодировать сегменты
+    # до 30 секунд по ее срезам (более длинные сегменты транскрибируются как раньше)
+    WHISPER_SHARED_MEL = os.getenv('WHISPER_SHARED_MEL', 'true').lower() == 'true'
+
+    # Потоковое распознавание по WebSocket (/ws/stream) на модели Vosk
+    STREAMING_ENABLED = os.getenv('STREAMING_ENABLED', 'true').lower() == 'true'
+    # Максимум одновременных потоковых сессий (по умолчанию - число ядер)
+    STREAM_MAX_SESSIONS = int(os.getenv('STREAM_MAX_SESSIONS') or os.cpu_count() or 1)
+    # Частота PCM по умолчанию, если клиент не передал sample_rate
+    STREAM_SAMPLE_RATE = int(os.getenv('STREAM_SAMPLE_RATE', '16000'))
+
+    # Онлайн-диаризация: окно для эмбеддинга и шаг выдачи предварительных меток (секунды)
+    ONLINE_DIARIZATION_WINDOW = float(os.getenv('ONLINE_DIARIZATION_WINDOW', '3.0'))
+    ONLINE_DIARIZATION_STEP = float(os.getenv('ONLINE_DIARIZATION_STEP', '1.0'))
+    # Минимальное косинусное сходство окна с центроидом текущего спикера
+    ONLINE_DIARIZATION_THRESHOLD = float(os.getenv('ONLINE_DIARIZATION_THRESHOLD', '0.5'))
+    ONLINE_DIARIZATION_MAX_SPEAKERS = int(os.getenv('ONLINE_DIARIZATION_MAX_SPEAKERS', '10'))
+    # Окна с RMS ниже порога считаются паузой
+    ONLINE_DIARIZATION_MIN_RMS = float(os.getenv('ONLINE_DIARIZATION_MIN_RMS', '0.005'))
+    # Публиковать предварительную разметку спикеров в статусе задачи до окончания
+    # полной диаризации (отдельный поток, дополнительная нагрузка на CPU)
+    ONLINE_DIARIZATION_PREVIEW = os.getenv('ONLINE_DIARIZATION_PREVIEW', 'false').lower() == 'true'
+
+    # Локальный кэш артефактов моделей (Vosk, Whisper, pyannote) и манифест с SHA256
+    MODELS_DIR = os.getenv('MODELS_DIR', '/app/models')
+    MODEL_CACHE_DIR = os.path.join(MODELS_DIR, 'huggingface')
+    # Офлайн-режим: модели берутся только из MODELS_DIR, сеть не используется
+    MODEL_OFFLINE = (os.getenv('MODEL_OFFLINE') or os.getenv('HF_HUB_OFFLINE') or '').lower() in ('1', 'true', 'yes')
+    WHISPER_MODEL = os.getenv('WHISPER_MODEL', 'medium')
+    # Загружать веса Whisper через mmap из сконвертированного float32 чекпоинта:
+    # процессы-обработчики разделяют одни страницы памяти, старт почти мгновенный.
+    # Включается явно: первая конвертация временно требует около 3x размера модели в памяти
+    WHISPER_MMAP = os.getenv('WHISPER_MMAP', 'false').lower() == 'true'
+    VOSK_MODEL_URL = os.getenv('VOSK_MODEL_URL')
+    # Ожидаемый SHA256 архива Vosk (если не задан, сумма фиксируется при первой загрузке)
+    VOSK_MODEL_SHA256 = os.getenv('VOSK_MODEL_SHA256')
+
+    # Кэши Hugging Face и pyannote читаются при импорте библиотек, поэтому
+    # задаются здесь, до загрузки моделей
+    os.environ.setdefault('HF_HUB_CACHE', MODEL_CACHE_DIR)
+    os.environ.setdefault('PYANNOTE_CACHE', MODEL_CACHE_DIR)
+    if MODEL_OFFLINE:
+        os.environ['HF_HUB_OFFLINE'] = '1'
+        os.environ['TRANSFORMERS_OFFLINE'] = '1'
 
     # Создаем необходимые директории при запуске
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-    os.makedirs(RESULT_FOLDER, exist_ok=True) 
\ No newline at end of file
+    os.makedirs(RESULT_FOLDER, exist_ok=True)
+    os.makedirs(os.path.dirname(SPEAKER_STORE_PATH), exist_ok=True)
\ No newline at end of file
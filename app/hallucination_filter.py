@@ -0,0 +1,95 @@
+import re
+from .config import Config
+
+# Типичные "галлюцинации" Whisper на тишине и шуме: титры и подписи из
+# обучающих субтитров
+KNOWN_PHRASES = (
+    'продолжение следует',
+    'субтитры сделал dimatorzok',
+    'субтитры создавал dimatorzok',
+    'субтитры подогнал симон',
+    'редактор субтитров а семкин корректор а егорова',
+    'спасибо за просмотр',
+    'спасибо за внимание',
+    'подписывайтесь на канал',
+    'ставьте лайки и подписывайтесь на канал',
+    'thank you for watching',
+    'thanks for watching',
+    'subtitles by the amara org community',
+    'please subscribe',
+)
+
+# Признаки по оценкам Whisper, по которым сегмент удаляется сам по себе
+DROP_FLAGS = ('no_speech', 'compression')
+# Признаки по тексту: повтор и фразы титров встречаются и в обычной речи,
+# поэтому такой сегмент удаляется, только если и оценки Whisper плохие
+TEXT_FLAGS = ('repetition', 'known_phrase')
+SCORE_FLAGS = ('no_speech', 'low_confidence', 'compression')
+
+_WORD = re.compile(r'\w+')
+
+
+def _normalize(text):
+    """Текст в нижнем регистре без пунктуации"""
+    return ' '.join(_WORD.findall(text.lower()))
+
+
+def _known_phrases():
+    extra = [_normalize(phrase) for phrase in Config.HALLUCINATION_PHRASES.split('|') if phrase.strip()]
+    return KNOWN_PHRASES + tuple(extra)
+
+
+def has_repetition(words, max_repeats=None):
+    """Фраза из 1-4 слов повторяется подряд больше max_repeats раз"""
+    max_repeats = Config.HALLUCINATION_MAX_REPEATS if max_repeats is None else max_repeats
+    repeats = max_repeats + 1
+    for size in range(1, 5):
+        for i in range(len(words) - size * repeats + 1):
+            gram = words[i:i + size]
+            if all(words[i + k * size:i + (k + 1) * size] == gram for k in range(1, repeats)):
+                return True
+    return False
+
+
+def screen_segment(text, avg_logprob=None, no_speech_prob=None, compression_ratio=None):
+    """
+    Проверяет сегмент распознавания по оценкам Whisper и тексту.
+
+    Возвращает (признаки, удалить ли сегмент). Признаки:
+    no_speech - вероятно, тишина (высокая no_speech_prob при низкой уверенности),
+    low_confidence - низкий avg_logprob (только отметка),
+    compression - текст слишком хорошо сжимается (зацикливание),
+    repetition - фраза повторяется подряд,
+    known_phrase - типичный текст титров.
+    Сегмент удаляется при no_speech или compression, а также при признаке по
+    тексту вместе с любым признаком по оценкам; уверенная речь с повтором
+    или фразой из списка только отмечается.
+    При HALLUCINATION_FILTER=flag сегменты только отмечаются, при off не проверяются.
+    """
+    mode = Config.HALLUCINATION_FILTER
+    if mode == 'off':
+        return [], False
+
+    flags = []
+    low_confidence = avg_logprob is not None and avg_logprob < Config.HALLUCINATION_MIN_LOGPROB
+    if no_speech_prob is not None and no_speech_prob > Config.HALLUCINATION_NO_SPEECH_PROB and low_confidence:
+        flags.append('no_speech')
+    if low_confidence:
+        flags.append('low_confidence')
+    if compression_ratio is not None and compression_ratio > Config.HALLUCINATION_MAX_COMPRESSION_RATIO:
+        flags.append('compression')
+
+    normalized = _normalize(text)
+    if has_repetition(normalized.split()):
+        flags.append('repetition')
+    # Фраза титров, составляющая большую часть текста сегмента
+    if normalized and any(phrase in normalized and len(phrase) >= 0.6 * len(normalized)
+                          for phrase in _known_phrases()):
+        flags.append('known_phrase')
+
+    bad_scores = any(flag in SCORE_FLAGS for flag in flags)
+    drop = mode == 'drop' and (
+        any(flag in DROP_FLAGS for flag in flags)
+        or (bad_scores and any(flag in TEXT_FLAGS for flag in flags))
+    )
+    return flags, drop
@@ -0,0 +1,180 @@
+import logging
+import multiprocessing
+import threading
+from .config import Config
+from .job_runner import run_job
+from .job_queue import FairJobQueue
+from .job_store import SharedJobQueue
+
+logger = logging.getLogger(__name__)
+
+
+def _worker_main(conn):
+    """
+    Точка входа процесса-обработчика: загружает модели один раз и выполняет
+    задачи, получаемые из API-процесса, отправляя обновления статуса обратно.
+    """
+    logging.basicConfig(level=logging.INFO)
+    try:
+        # Прогреваем модели до получения первой задачи
+        from .speaker_first_transcription_manager import SpeakerFirstTranscriptionManager
+        SpeakerFirstTranscriptionManager()
+    except Exception as e:
+        logger.error(f'Worker failed to load models: {str(e)}', exc_info=True)
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+
+        task_id, job = message
+        try:
+            run_job(task_id, job, lambda fields: conn.send(('update', task_id, fields)))
+        finally:
+            conn.send(('done', task_id, None))
+
+
+class JobDispatcher:
+    """
+    Очередь задач распознавания с фиксированным числом обработчиков.
+
+    В режиме 'inline' задачи выполняются потоками API-процесса. В режиме
+    'process' каждый обработчик - отдельный процесс со своими моделями, а
+    API-процесс только пересылает задачи и обновления статуса через Pipe,
+    поэтому запросы статуса и скачивания не конкурируют с распознаванием
+    за GIL. Порядок выдачи задач определяет FairJobQueue (классы приоритета
+    и справедливое разделение между клиентами).
+
+    В режиме 'queue' задачи кладутся в общее хранилище (SQLite или Redis),
+    а выполняют их процессы app.worker, в том числе на других узлах.
+    """
+
+    def __init__(self, on_update, mode=None, workers=None, should_run=None, store=None):
+        self.on_update = on_update
+        # Проверка перед запуском: отмененные в очереди задачи пропускаются
+        self.should_run = should_run or (lambda task_id: True)
+        self.mode = mode or Config.SERVING_MODE
+        self.workers = workers or Config.INFERENCE_WORKERS
+        self._threads = []
+        self._started = False
+        self._start_lock = threading.Lock()
+
+        if self.mode not in ('inline', 'process', 'queue'):
+            raise ValueError(f"Неизвестный режим обработки: {self.mode}")
+        if self.mode == 'queue':
+            if store is None or not getattr(store, 'shared', False):
+                raise ValueError("Режим 'queue' требует общего хранилища задач (JOB_STORE_URL)")
+            self._queue = SharedJobQueue(store, workers=self.workers)
+        else:
+            self._queue = FairJobQueue(workers=self.workers)
+
+    def start(self):
+        """Запускает обработчики (однократно)"""
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+            if self.mode == 'queue':
+                logger.info('Job dispatcher started: mode=queue, jobs are run by app.worker processes')
+                return
+
+            target = self._inline_loop if self.mode == 'inline' else self._process_loop
+            for i in range(self.workers):
+                thread = threading.Thread(target=target, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            logger.info(f'Job dispatcher started: mode={self.mode}, workers={self.workers}')
+
+    def submit(self, task_id, job):
+        """Ставит задачу в очередь"""
+        self.start()
+        self._queue.put(task_id, job)
+        logger.info(f'Task {task_id} queued (queue size: {self._queue.qsize()})')
+
+    def discard(self, task_id):
+        """Убирает ожидающую задачу из очереди"""
+        return self._queue.discard(task_id)
+
+    def position(self, task_id):
+        """Позиция ожидающей задачи в очереди и оценка времени старта (или None)"""
+        return self._queue.position(task_id)
+
+    def load(self, priority=None):
+        """Секунды аудио и оценка секунд обработки в очереди и в работе (priority - одного класса)"""
+        return self._queue.load(priority)
+
+    @property
+    def realtime_factor(self):
+        """Текущая оценка времени обработки секунды аудио"""
+        return self._queue.realtime_factor
+
+    def _next_job(self):
+        """Возвращает следующую задачу, пропуская отмененные"""
+        while True:
+            task_id, job = self._queue.get()
+            if self.should_run(task_id):
+                return task_id, job
+            self._queue.task_done(task_id)
+            logger.info(f'Skipping task {task_id}: no longer active')
+
+    def _finish(self, task_id, job, status):
+        """Освобождает обработчик; оценку скорости уточняют только успешные задачи"""
+        completed = status.get('status') == 'completed'
+        self._queue.task_done(task_id, job.get('audio_seconds') if completed else None)
+
+    def _inline_loop(self):
+        """Обработчик, выполняющий задачи в текущем процессе"""
+        while True:
+            task_id, job = self._next_job()
+            status = {}
+
+            def update_status(fields):
+                status.update(fields)
+                self.on_update(task_id, fields)
+
+            try:
+                run_job(task_id, job, update_status)
+            except Exception as e:
+                logger.error(f'Unexpected error in task {task_id}: {str(e)}', exc_info=True)
+            finally:
+                self._finish(task_id, job, status)
+
+    def _spawn_worker(self):
+        """Создает процесс-обработчик и канал связи с ним"""
+        context = multiprocessing.get_context('spawn')
+        parent_conn, child_conn = context.Pipe()
+        process = context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        process.start()
+        child_conn.close()
+        logger.info(f'Started inference worker process {process.pid}')
+        return process, parent_conn
+
+    def _process_loop(self):
+        """Поток API-процесса, обслуживающий один процесс-обработчик"""
+        process, conn = self._spawn_worker()
+        while True:
+            task_id, job = self._next_job()
+            status = {}
+            try:
+                conn.send((task_id, job))
+                while True:
+                    kind, message_task_id, fields = conn.recv()
+                    if kind == 'done':
+                        break
+                    if message_task_id == task_id:
+                        status.update(fields)
+                    self.on_update(message_task_id, fields)
+                self._finish(task_id, job, status)
+            except (EOFError, OSError) as e:
+                self._finish(task_id, job, {'status': 'error'})
+                logger.error(f'Inference worker {process.pid} died while processing task {task_id}: {str(e)}')
+                self.on_update(task_id, {
+                    'status': 'error',
+                    'error': 'Процесс обработки аварийно завершился'
+                })
+                conn.close()
+                process.join(timeout=5)
+                process, conn = self._spawn_worker()
@@ -0,0 +1,215 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета в порядке обслуживания
+PRIORITY_CLASSES = ('interactive', 'bulk')
+
+
+class FairJobQueue:
+    """
+    Очередь задач с классами приоритета и справедливым разделением между
+    клиентами.
+
+    Задачи класса 'interactive' всегда выбираются раньше 'bulk'. Внутри
+    класса очередной выбирается задача клиента, которому до сих пор
+    досталось меньше всего секунд аудио (клиент, вернувшийся после простоя,
+    не получает накопленного запаса). Задачи одного клиента идут в порядке
+    поступления или, с shortest_first, от коротких к длинным.
+    """
+
+    def __init__(self, shortest_first=None, workers=1):
+        self.shortest_first = Config.SCHEDULER_SHORTEST_FIRST if shortest_first is None else shortest_first
+        self.workers = max(1, workers)
+        # Оценка времени обработки секунды аудио, уточняется по выполненным задачам
+        self.realtime_factor = Config.SCHEDULER_REALTIME_FACTOR
+        self._pending = {name: OrderedDict() for name in PRIORITY_CLASSES}
+        self._served = {name: {} for name in PRIORITY_CLASSES}
+        self._running = {}
+        self._sequence = 0
+        self._order = None
+        self._cond = threading.Condition()
+
+    @staticmethod
+    def normalize_priority(priority):
+        """Проверяет класс приоритета, ошибки - ValueError"""
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"priority должен быть одним из: {', '.join(PRIORITY_CLASSES)}")
+        return priority
+
+    def put(self, task_id, job):
+        """Ставит задачу в очередь; priority, client и audio_seconds берутся из job"""
+        priority = job.get('priority') or PRIORITY_CLASSES[0]
+        client = job.get('client') or 'anonymous'
+        with self._cond:
+            clients = self._pending[priority]
+            if client not in clients:
+                # Клиент после простоя начинает с уровня самого обслуженного из ожидающих
+                served = self._served[priority]
+                floor = min((served.get(other, 0.0) for other in clients), default=0.0)
+                served[client] = max(served.get(client, 0.0), floor)
+                clients[client] = OrderedDict()
+            self._sequence += 1
+            clients[client][task_id] = (self._sequence, job)
+            self._order = None
+            self._cond.notify()
+
+    def _pick(self, pending, served):
+        """Выбирает (класс, клиент, задача) следующей задачи или None"""
+        for priority in PRIORITY_CLASSES:
+            clients = pending[priority]
+            if not clients:
+                continue
+            client = min(clients, key=lambda name: (served[priority].get(name, 0.0),
+                                                    next(iter(clients[name].values()))[0]))
+            jobs = clients[client]
+            if self.shortest_first:
+                task_id = min(jobs, key=lambda tid: (jobs[tid][1].get('audio_seconds') or 0.0,
+                                                     jobs[tid][0]))
+            else:
+                task_id = next(iter(jobs))
+            return priority, client, task_id
+        return None
+
+    @staticmethod
+    def _take(pending, served, priority, client, task_id):
+        """Удаляет выбранную задачу из очереди и учитывает ее аудио за клиентом"""
+        jobs = pending[priority][client]
+        _, job = jobs.pop(task_id)
+        if not jobs:
+            del pending[priority][client]
+        served[priority][client] = served[priority].get(client, 0.0) + \
+            max(job.get('audio_seconds') or 0.0, 1.0)
+        return job
+
+    def _forget_idle_clients(self, priority):
+        """
+        Удаляет учет клиентов без ожидающих задач, обслуженных не больше
+        наименее обслуженного из ожидающих: при возвращении клиент все равно
+        начнет с этого уровня. Когда класс пуст, учет сбрасывается целиком.
+        Так учет не растет с числом когда-либо обращавшихся клиентов.
+        """
+        clients = self._pending[priority]
+        served = self._served[priority]
+        if not clients:
+            served.clear()
+            return
+        floor = min(served.get(client, 0.0) for client in clients)
+        for client in [name for name, value in served.items() if name not in clients and value <= floor]:
+            del served[client]
+
+    def get(self):
+        """Блокирующе выдает следующую задачу (task_id, job)"""
+        with self._cond:
+            while True:
+                choice = self._pick(self._pending, self._served)
+                if choice is not None:
+                    break
+                self._cond.wait()
+            job = self._take(self._pending, self._served, *choice)
+            self._forget_idle_clients(choice[0])
+            task_id = choice[2]
+            self._running[task_id] = (time.time(), self.estimate(job), job.get('audio_seconds') or 0.0,
+                                      choice[0])
+            self._order = None
+            return task_id, job
+
+    def discard(self, task_id):
+        """Убирает задачу из очереди (например, при отмене)"""
+        with self._cond:
+            for clients in self._pending.values():
+                for client, jobs in list(clients.items()):
+                    if task_id in jobs:
+                        del jobs[task_id]
+                        if not jobs:
+                            del clients[client]
+                        self._order = None
+                        return True
+        return False
+
+    def task_done(self, task_id, audio_seconds=None):
+        """Отмечает завершение задачи и уточняет оценку скорости обработки"""
+        with self._cond:
+            started = self._running.pop(task_id, None)
+        if started is None or not audio_seconds:
+            return
+        elapsed = time.time() - started[0]
+        # Экспоненциальное сглаживание, чтобы одна аномальная задача не сбивала оценку
+        self.realtime_factor = 0.8 * self.realtime_factor + 0.2 * (elapsed / audio_seconds)
+
+    def estimate(self, job):
+        """Оценка времени обработки задачи в секундах"""
+        return (job.get('audio_seconds') or 0.0) * self.realtime_factor
+
+    def load(self, priority=None):
+        """
+        Нагрузка: секунды аудио и оценка секунд обработки для ожидающих и
+        выполняемых задач (для выполняемых - оставшееся время); priority -
+        только задачи этого класса
+        """
+        with self._cond:
+            now = time.time()
+            queued = [job for name, clients in self._pending.items() if priority in (None, name)
+                      for jobs in clients.values() for _, job in jobs.values()]
+            running = [entry for entry in self._running.values() if priority in (None, entry[3])]
+            audio_seconds = sum(job.get('audio_seconds') or 0.0 for job in queued)
+            cpu_seconds = sum(self.estimate(job) for job in queued)
+            for started, estimate, audio, _ in running:
+                audio_seconds += audio
+                cpu_seconds += max(0.0, started + estimate - now)
+            return {
+                'queued_jobs': len(queued),
+                'running_jobs': len(running),
+                'audio_seconds': audio_seconds,
+                'cpu_seconds': cpu_seconds
+            }
+
+    def qsize(self):
+        with self._cond:
+            return sum(len(jobs) for clients in self._pending.values() for jobs in clients.values())
+
+    def _schedule(self):
+        """Порядок выдачи ожидающих задач [(task_id, job)] (кэшируется до изменения очереди)"""
+        if self._order is None:
+            pending = {
+                priority: OrderedDict((client, OrderedDict(jobs)) for client, jobs in clients.items())
+                for priority, clients in self._pending.items()
+            }
+            served = {priority: dict(values) for priority, values in self._served.items()}
+            order = []
+            while True:
+                choice = self._pick(pending, served)
+                if choice is None:
+                    break
+                order.append((choice[2], self._take(pending, served, *choice)))
+            self._order = order
+            self._positions = {task_id: index for index, (task_id, _) in enumerate(order)}
+        return self._order
+
+    def position(self, task_id):
+        """
+        Возвращает {'queue_position', 'estimated_start'} для ожидающей задачи
+        или None. Время старта оценивается по оставшемуся времени выполняемых
+        задач и оценкам задач впереди, распределенным между обработчиками.
+        """
+        with self._cond:
+            order = self._schedule()
+            index = self._positions.get(task_id)
+            if index is None:
+                return None
+            now = time.time()
+            # Время освобождения каждого обработчика
+            slots = sorted(max(0.0, started + estimate - now)
+                           for started, estimate, _, _ in self._running.values())
+            slots = (slots + [0.0] * self.workers)[:self.workers]
+            for _, job in order[:index]:
+                slots.sort()
+                slots[0] += self.estimate(job)
+            return {
+                'queue_position': index + 1,
+                'estimated_start': now + min(slots)
+            }
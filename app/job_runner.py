@@ -0,0 +1,191 @@
+import os
+import json
+import uuid
+import logging
+import threading
+from .config import Config
+from .audio_processor import AudioProcessor, SAMPLE_RATE
+from .speaker_store import SpeakerStore, load_job_embeddings
+from .result_files import write_compressed_variants
+
+logger = logging.getLogger(__name__)
+
+
+def embeddings_path(task_id):
+    """Путь к эмбеддингам спикеров задачи"""
+    return os.path.join(Config.RESULT_FOLDER, f'speakers_{task_id}.npz')
+
+
+def _start_diarization_preview(task_id, waveform, job, update_status, stop_event):
+    """
+    Запускает онлайн-диаризацию записи в фоновом потоке и публикует
+    предварительные реплики в поле статуса provisional_speakers, пока
+    полная диаризация еще выполняется.
+    """
+    from .online_diarizer import OnlineDiarizer, diarize_incrementally
+
+    def run():
+        try:
+            diarizer = OnlineDiarizer(speaker_store=SpeakerStore(),
+                                      known_speakers=job.get('known_speakers'))
+            for turns in diarize_incrementally(waveform, diarizer, should_stop=stop_event.is_set):
+                if stop_event.is_set():
+                    return
+                update_status({'provisional_speakers': turns})
+            logger.info(f'Task {task_id}: online diarization preview finished')
+        except Exception as e:
+            logger.warning(f'Task {task_id}: online diarization preview failed: {str(e)}')
+
+    thread = threading.Thread(target=run, name=f'diarization-preview-{task_id}', daemon=True)
+    thread.start()
+    return thread
+
+
+def run_job(task_id, job, update_status):
+    """
+    Выполняет задачу распознавания: объединяет файлы, транскрибирует и
+    сохраняет результат.
+
+    Функция не зависит от Flask и может выполняться как в потоке
+    API-процесса, так и в отдельном процессе-обработчике.
+
+    Args:
+        task_id: идентификатор задачи
+        job: параметры задачи (files, language, known_speakers, speaker_hints, profile)
+        update_status: функция, принимающая словарь обновляемых полей статуса
+    """
+    # Модели загружаются только там, где реально выполняется распознавание
+    from .speaker_first_transcription_manager import SpeakerFirstTranscriptionManager
+    from .speech_recognizer import DecodeStats
+
+    preview_stop = threading.Event()
+    if Config.ONLINE_DIARIZATION_PREVIEW:
+        # Обновления статуса приходят из двух потоков, а Pipe процесса-
+        # обработчика не допускает одновременной отправки
+        status_lock = threading.Lock()
+        send_status = update_status
+
+        def update_status(fields):
+            with status_lock:
+                send_status(fields)
+    try:
+        logger.info(f'Starting background processing for task {task_id}')
+        update_status({'status': 'processing'})
+        audio_processor = AudioProcessor()
+
+        # Собираем полные пути к файлам
+        file_paths = [os.path.join(Config.UPLOAD_FOLDER, filename) for filename in job['files']]
+        logger.info(f'File paths: {file_paths}')
+
+        # Файлы декодируются один раз, дальше диаризация и распознавание
+        # работают с общим массивом в памяти
+        logger.info(f'Merging {len(file_paths)} files in memory')
+        waveform = audio_processor.merge_audio(file_paths)
+        if waveform.size == 0:
+            raise Exception('Ошибка создания объединенного файла')
+
+        logger.info(f'Files merged successfully ({waveform.size / SAMPLE_RATE:.1f} seconds)')
+
+        # Обновляем прогресс
+        update_status({'progress': 20})  # 20% за объединение файлов
+
+        if Config.ONLINE_DIARIZATION_PREVIEW:
+            _start_diarization_preview(task_id, waveform, job, update_status, preview_stop)
+
+        # Распознаем речь
+        logger.info('Starting transcription of merged audio')
+        transcription_manager = SpeakerFirstTranscriptionManager()
+
+        def update_progress(progress):
+            # Корректируем прогресс: 20% за объединение + 80% за распознавание
+            adjusted_progress = 20 + int(progress * 0.8)
+            update_status({'progress': adjusted_progress})
+            logger.info(f'Task {task_id} progress: {adjusted_progress}% (raw: {progress}%)')
+
+        job_embeddings_path = embeddings_path(task_id)
+        decode_stats = DecodeStats()
+        details = []
+        text = transcription_manager.process_audio(
+            waveform,
+            update_progress,
+            language=job.get('language'),
+            known_speakers=job.get('known_speakers'),
+            embeddings_path=job_embeddings_path,
+            speaker_hints=job.get('speaker_hints'),
+            profile=job.get('profile'),
+            stats=decode_stats,
+            details=details
+        )
+
+        # Полная диаризация готова, предварительная разметка больше не нужна
+        preview_stop.set()
+
+        # Сохраняем результат
+        result_filename = f'result_{uuid.uuid4()}.txt'
+        result_path = os.path.join(Config.RESULT_FOLDER, result_filename)
+
+        logger.info(f'Creating result file: {result_path}')
+
+        # Проверяем существование директории результатов
+        if not os.path.exists(Config.RESULT_FOLDER):
+            logger.info(f'Creating results directory: {Config.RESULT_FOLDER}')
+            os.makedirs(Config.RESULT_FOLDER)
+
+        with open(result_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+        # Проверяем, что файл создан
+        if not os.path.exists(result_path):
+            logger.error(f'Failed to create result file: {result_path}')
+            raise Exception('Ошибка создания файла результата')
+
+        logger.info(f'Result file created successfully: {result_path}')
+        write_compressed_variants(result_path)
+
+        # Структурированный результат: сегменты с оценками Whisper и отметками
+        # фильтра галлюцинаций для контроля качества
+        details_filename = result_filename[:-len('.txt')] + '.json'
+        details_path = os.path.join(Config.RESULT_FOLDER, details_filename)
+        with open(details_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'task_id': task_id,
+                # Язык, с которым распознана запись (определенный при 'auto')
+                'language': decode_stats.language or job.get('language'),
+                'profile': job.get('profile') or Config.WHISPER_PROFILE,
+                'segments': details
+            }, f, ensure_ascii=False)
+        write_compressed_variants(details_path)
+
+        # Удаляем исходные файлы (временный каталог удаляется в finally)
+        for file_path in file_paths:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+        # Обновляем статус задачи
+        logger.info(f'Updating task status with result file: {result_filename}')
+        result = {
+            'status': 'completed',
+            'result_file': result_filename,
+            'details_file': details_filename
+        }
+        # Метрики задачи: профиль декодирования и число повторных проходов Whisper
+        asr_segments = [entry for segment in details for entry in segment.get('asr', [])]
+        result['metrics'] = dict(
+            decode_stats.as_dict(),
+            profile=job.get('profile') or Config.WHISPER_PROFILE,
+            dropped_segments=sum(1 for entry in asr_segments if entry['dropped']),
+            flagged_segments=sum(1 for entry in asr_segments if entry['flags'] and not entry['dropped'])
+        )
+        logger.info(f'Task {task_id} decode metrics: {result["metrics"]}')
+        if os.path.exists(job_embeddings_path):
+            result['speakers'] = sorted(load_job_embeddings(job_embeddings_path))
+        update_status(result)
+
+    except Exception as e:
+        logger.error(f'Error in run_job: {str(e)}')
+        update_status({
+            'status': 'error',
+            'error': str(e)
+        })
+    finally:
+        preview_stop.set()
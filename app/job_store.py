@@ -0,0 +1,583 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from .config import Config
+from .task_registry import TaskRegistry, TERMINAL_STATUSES, task_summary
+from .job_queue import PRIORITY_CLASSES
+
+try:
+    import redis
+except ImportError:  # Redis нужен только для JOB_STORE_URL=redis://
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+
+def _priority_rank(job):
+    """Номер класса приоритета задачи (меньше - раньше)"""
+    priority = job.get('priority') or PRIORITY_CLASSES[0]
+    return PRIORITY_CLASSES.index(priority) if priority in PRIORITY_CLASSES else len(PRIORITY_CLASSES)
+
+
+def _stuck_update():
+    return {'status': 'error', 'error': 'Задача зависла и была остановлена'}
+
+
+class _PolledChanges:
+    """Ожидание изменения статуса опросом хранилища (другие процессы не уведомляют нас)"""
+
+    POLL_INTERVAL = 0.5
+
+    def wait_for_change(self, task_id, last_update, timeout):
+        deadline = time.time() + timeout
+        while True:
+            status = self.get(task_id)
+            remaining = deadline - time.time()
+            if status is None or status.get('last_update') != last_update or remaining <= 0:
+                return status
+            time.sleep(min(self.POLL_INTERVAL, remaining))
+
+
+class SQLiteTaskRegistry(_PolledChanges, TaskRegistry):
+    """
+    Реестр задач и очередь в файле SQLite.
+
+    Подходит для одного узла с несколькими процессами (API и обработчики
+    app.worker): состояние переживает перезапуск, изменения выполняются
+    транзакциями, поэтому процессы не мешают друг другу.
+    """
+
+    shared = True
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS tasks (task_id TEXT PRIMARY KEY, status TEXT, '
+        'data TEXT NOT NULL, created_at REAL, last_update REAL, finished_at REAL)',
+        'CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status)',
+        'CREATE TABLE IF NOT EXISTS queue (seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+        'task_id TEXT UNIQUE, rank INTEGER, audio_seconds REAL, job TEXT NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS records (kind TEXT, key TEXT, value TEXT NOT NULL, '
+        'created_at REAL, PRIMARY KEY (kind, key))',
+    )
+
+    def __init__(self, path, ttl=None, max_tasks=None, stuck_timeout=None):
+        super().__init__(ttl=ttl, max_tasks=max_tasks, stuck_timeout=stuck_timeout)
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._transaction() as db:
+            for statement in self.SCHEMA:
+                db.execute(statement)
+
+    def _db(self):
+        """Соединение текущего потока"""
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            self._local.db = db
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        """Транзакция с блокировкой на запись с самого начала"""
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def __contains__(self, task_id):
+        return self.get(task_id) is not None
+
+    def __len__(self):
+        return self._db().execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+
+    @staticmethod
+    def _write(db, task_id, status):
+        db.execute(
+            'INSERT OR REPLACE INTO tasks (task_id, status, data, created_at, last_update, finished_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (task_id, status.get('status'), json.dumps(status, ensure_ascii=False),
+             status.get('created_at'), status.get('last_update'), status.get('finished_at'))
+        )
+
+    @staticmethod
+    def _read(db, task_id):
+        row = db.execute('SELECT data FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def create(self, task_id, fields):
+        now = time.time()
+        status = dict(fields)
+        status.setdefault('created_at', now)
+        status['last_update'] = now
+        with self._transaction() as db:
+            self._write(db, task_id, status)
+            self._evict_oldest_finished(db)
+        return dict(status)
+
+    def _evict_oldest_finished(self, db):
+        """Удаляет самые старые завершенные задачи сверх max_tasks"""
+        excess = db.execute('SELECT COUNT(*) FROM tasks').fetchone()[0] - self.max_tasks
+        if excess <= 0:
+            return 0
+        return db.execute(
+            'DELETE FROM tasks WHERE task_id IN (SELECT task_id FROM tasks '
+            f'WHERE status IN ({",".join("?" * len(TERMINAL_STATUSES))}) ORDER BY created_at, rowid LIMIT ?)',
+            TERMINAL_STATUSES + (excess,)
+        ).rowcount
+
+    def get(self, task_id):
+        return self._read(self._db(), task_id)
+
+    def _update(self, db, task_id, fields):
+        status = self._read(db, task_id)
+        if status is None or status.get('status') in TERMINAL_STATUSES:
+            return False
+        status.update(fields)
+        status['last_update'] = time.time()
+        if status.get('status') in TERMINAL_STATUSES:
+            status['finished_at'] = status['last_update']
+        self._write(db, task_id, status)
+        return True
+
+    def update(self, task_id, fields):
+        with self._transaction() as db:
+            return self._update(db, task_id, fields)
+
+    def cancel(self, task_id, message='Задача отменена пользователем'):
+        with self._transaction() as db:
+            status = self._read(db, task_id)
+            if status is None:
+                return None, False
+            previous = status.get('status')
+            if previous in TERMINAL_STATUSES:
+                return previous, False
+            self._update(db, task_id, {'status': 'cancelled', 'error': message})
+            db.execute('DELETE FROM queue WHERE task_id = ?', (task_id,))
+            return previous, True
+
+    def active_tasks(self):
+        rows = self._db().execute(
+            f'SELECT task_id, data FROM tasks WHERE status NOT IN ({",".join("?" * len(TERMINAL_STATUSES))})',
+            TERMINAL_STATUSES
+        ).fetchall()
+        return {task_id: json.loads(data) for task_id, data in rows}
+
+    def list(self, offset=0, limit=100, status=None):
+        where, args = ('WHERE status = ?', (status,)) if status is not None else ('', ())
+        db = self._db()
+        total = db.execute(f'SELECT COUNT(*) FROM tasks {where}', args).fetchone()[0]
+        rows = db.execute(
+            f'SELECT task_id, data FROM tasks {where} ORDER BY created_at, rowid LIMIT ? OFFSET ?',
+            args + (limit, offset)
+        ).fetchall()
+        return [task_summary(task_id, json.loads(data)) for task_id, data in rows], total
+
+    def cleanup(self):
+        now = time.time()
+        stuck = 0
+        if self.stuck_timeout:
+            rows = self._db().execute(
+                "SELECT task_id FROM tasks WHERE status = 'processing' AND last_update < ?",
+                (now - self.stuck_timeout,)
+            ).fetchall()
+            for (task_id,) in rows:
+                logger.warning(f'Task {task_id} is stuck (no updates for {self.stuck_timeout / 60:.1f} minutes)')
+                if self.update(task_id, _stuck_update()):
+                    stuck += 1
+
+        with self._transaction() as db:
+            removed = db.execute(
+                f'DELETE FROM tasks WHERE status IN ({",".join("?" * len(TERMINAL_STATUSES))}) '
+                'AND COALESCE(finished_at, last_update) < ?',
+                TERMINAL_STATUSES + (now - self.ttl,)
+            ).rowcount
+            removed += self._evict_oldest_finished(db)
+            db.execute('DELETE FROM records WHERE created_at < ?', (now - self.ttl,))
+
+        if stuck or removed:
+            logger.info(f'Task cleanup: {stuck} stuck, {removed} removed, {len(self)} remaining')
+        return stuck, removed
+
+    def put_record(self, kind, key, value):
+        """Сохраняет вспомогательную запись (например, состав пакета)"""
+        with self._transaction() as db:
+            db.execute('INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?)',
+                       (kind, key, json.dumps(value, ensure_ascii=False), time.time()))
+
+    def get_record(self, kind, key):
+        row = self._db().execute('SELECT value FROM records WHERE kind = ? AND key = ?',
+                                 (kind, key)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # Очередь задач
+
+    def enqueue(self, task_id, job):
+        with self._transaction() as db:
+            db.execute('INSERT OR REPLACE INTO queue (task_id, rank, audio_seconds, job) VALUES (?, ?, ?, ?)',
+                       (task_id, _priority_rank(job), job.get('audio_seconds') or 0.0,
+                        json.dumps(job, ensure_ascii=False)))
+
+    def claim(self, timeout=5.0, poll_interval=0.5):
+        """Забирает следующую задачу из очереди (task_id, job) или None по таймауту"""
+        deadline = time.time() + timeout
+        while True:
+            with self._transaction() as db:
+                row = db.execute('SELECT seq, task_id, job FROM queue ORDER BY rank, seq LIMIT 1').fetchone()
+                if row is not None:
+                    db.execute('DELETE FROM queue WHERE seq = ?', (row[0],))
+                    return row[1], json.loads(row[2])
+            if time.time() >= deadline:
+                return None
+            time.sleep(poll_interval)
+
+    def discard(self, task_id):
+        with self._transaction() as db:
+            return db.execute('DELETE FROM queue WHERE task_id = ?', (task_id,)).rowcount > 0
+
+    def queue_position(self, task_id):
+        """(позиция с 1, секунды аудио впереди) или None, если задачи нет в очереди"""
+        db = self._db()
+        row = db.execute('SELECT rank, seq FROM queue WHERE task_id = ?', (task_id,)).fetchone()
+        if row is None:
+            return None
+        ahead, audio = db.execute(
+            'SELECT COUNT(*), COALESCE(SUM(audio_seconds), 0) FROM queue '
+            'WHERE rank < ? OR (rank = ? AND seq < ?)',
+            (row[0], row[0], row[1])
+        ).fetchone()
+        return ahead + 1, audio
+
+    def queued_count(self):
+        return self._db().execute('SELECT COUNT(*) FROM queue').fetchone()[0]
+
+
+class RedisTaskRegistry(_PolledChanges, TaskRegistry):
+    """
+    Реестр задач и очередь в Redis (или совместимом сервере) для нескольких
+    узлов: API-узлы не хранят состояния, обработчики app.worker на любых
+    машинах забирают задачи из общей очереди.
+
+    Статус задачи - JSON в ключе task:<id>, изменения выполняются
+    оптимистичными транзакциями WATCH/MULTI. Завершенные задачи удаляются
+    самим Redis по истечении TTL. Индексы tasks и status:<статус> (sorted
+    set по времени создания) позволяют читать только запрошенную страницу.
+    """
+
+    shared = True
+
+    def __init__(self, client, prefix='vr:', ttl=None, max_tasks=None, stuck_timeout=None):
+        super().__init__(ttl=ttl, max_tasks=max_tasks, stuck_timeout=stuck_timeout)
+        self._redis = client
+        self.prefix = prefix
+        # Позиции в очереди, вычисленные для версии очереди queue_version
+        self._positions = (None, {})
+
+    def _key(self, *parts):
+        return self.prefix + ':'.join(parts)
+
+    def _status_key(self, status):
+        return self._key('status', status or '')
+
+    def __contains__(self, task_id):
+        return bool(self._redis.exists(self._key('task', task_id)))
+
+    def __len__(self):
+        return self._redis.zcard(self._key('tasks'))
+
+    def create(self, task_id, fields):
+        now = time.time()
+        status = dict(fields)
+        status.setdefault('created_at', now)
+        status['last_update'] = now
+        pipe = self._redis.pipeline()
+        pipe.set(self._key('task', task_id), json.dumps(status, ensure_ascii=False))
+        pipe.zadd(self._key('tasks'), {task_id: status['created_at']})
+        pipe.zadd(self._status_key(status.get('status')), {task_id: status['created_at']})
+        pipe.sadd(self._key('active'), task_id)
+        pipe.execute()
+        self._evict_oldest_finished()
+        return dict(status)
+
+    def _evict_oldest_finished(self):
+        """Удаляет самые старые завершенные задачи сверх max_tasks"""
+        excess = self._redis.zcard(self._key('tasks')) - self.max_tasks
+        if excess <= 0:
+            return 0
+        candidates = []
+        for status in TERMINAL_STATUSES:
+            candidates.extend(self._redis.zrange(self._status_key(status), 0, excess - 1, withscores=True))
+        victims = [task_id for task_id, _ in sorted(candidates, key=lambda item: item[1])[:excess]]
+        if not victims:
+            return 0
+        pipe = self._redis.pipeline()
+        pipe.delete(*[self._key('task', task_id) for task_id in victims])
+        pipe.zrem(self._key('tasks'), *victims)
+        pipe.srem(self._key('active'), *victims)
+        for status in TERMINAL_STATUSES:
+            pipe.zrem(self._status_key(status), *victims)
+        pipe.execute()
+        return len(victims)
+
+    def get(self, task_id):
+        data = self._redis.get(self._key('task', task_id))
+        return json.loads(data) if data else None
+
+    def _modify(self, task_id, change):
+        """
+        Транзакционно изменяет статус: change(status) возвращает новые поля
+        или None, если менять ничего не нужно. Возвращает (статус до, изменен ли).
+        """
+        key = self._key('task', task_id)
+        outcome = {}
+
+        def transaction(pipe):
+            data = pipe.get(key)
+            status = json.loads(data) if data else None
+            outcome['previous'] = status
+            fields = change(status) if status is not None else None
+            outcome['changed'] = fields is not None
+            if fields is None:
+                return
+            previous_status = status.get('status')
+            status = dict(status, **fields)
+            status['last_update'] = time.time()
+            pipe.multi()
+            if status.get('status') != previous_status:
+                pipe.zrem(self._status_key(previous_status), task_id)
+                pipe.zadd(self._status_key(status.get('status')), {task_id: status.get('created_at', 0)})
+            if status.get('status') in TERMINAL_STATUSES:
+                status['finished_at'] = status['last_update']
+                pipe.set(key, json.dumps(status, ensure_ascii=False), ex=max(1, int(self.ttl)))
+                pipe.srem(self._key('active'), task_id)
+                pipe.zrem(self._key('queue'), task_id)
+                pipe.incr(self._key('queue_version'))
+            else:
+                pipe.set(key, json.dumps(status, ensure_ascii=False))
+
+        self._redis.transaction(transaction, key)
+        return outcome['previous'], outcome['changed']
+
+    def update(self, task_id, fields):
+        def change(status):
+            return None if status.get('status') in TERMINAL_STATUSES else fields
+        return self._modify(task_id, change)[1]
+
+    def cancel(self, task_id, message='Задача отменена пользователем'):
+        def change(status):
+            if status.get('status') in TERMINAL_STATUSES:
+                return None
+            return {'status': 'cancelled', 'error': message}
+        previous, changed = self._modify(task_id, change)
+        if previous is None:
+            return None, False
+        return previous.get('status'), changed
+
+    def _load(self, task_ids):
+        task_ids = list(task_ids)
+        if not task_ids:
+            return {}
+        values = self._redis.mget([self._key('task', task_id) for task_id in task_ids])
+        return {task_id: json.loads(data) for task_id, data in zip(task_ids, values) if data}
+
+    def active_tasks(self):
+        tasks = self._load(self._redis.smembers(self._key('active')))
+        return {task_id: task for task_id, task in tasks.items()
+                if task.get('status') not in TERMINAL_STATUSES}
+
+    def list(self, offset=0, limit=100, status=None):
+        index = self._key('tasks') if status is None else self._status_key(status)
+        total = self._redis.zcard(index)
+        task_ids = self._redis.zrange(index, offset, offset + limit - 1) if limit > 0 else []
+        # Истекшие задачи, еще не убранные из индекса очисткой, пропускаются
+        tasks = self._load(task_ids)
+        return [task_summary(task_id, tasks[task_id]) for task_id in task_ids if task_id in tasks], total
+
+    def cleanup(self):
+        now = time.time()
+        stuck = 0
+        if self.stuck_timeout:
+            for task_id, task in self.active_tasks().items():
+                if task.get('status') == 'processing' \
+                        and now - task.get('last_update', now) > self.stuck_timeout:
+                    logger.warning(f'Task {task_id} is stuck '
+                                   f'({(now - task["last_update"]) / 60:.1f} minutes without updates)')
+                    if self.update(task_id, _stuck_update()):
+                        stuck += 1
+
+        # Ключи завершенных задач истекают сами, из индексов убираем их идентификаторы
+        task_ids = self._redis.zrange(self._key('tasks'), 0, -1)
+        existing = self._load(task_ids)
+        expired = [task_id for task_id in task_ids if task_id not in existing]
+        if expired:
+            pipe = self._redis.pipeline()
+            pipe.zrem(self._key('tasks'), *expired)
+            pipe.srem(self._key('active'), *expired)
+            for status in TERMINAL_STATUSES:
+                pipe.zrem(self._status_key(status), *expired)
+            pipe.execute()
+        removed = len(expired) + self._evict_oldest_finished()
+
+        if stuck or removed:
+            logger.info(f'Task cleanup: {stuck} stuck, {removed} removed, {len(self)} remaining')
+        return stuck, removed
+
+    def put_record(self, kind, key, value):
+        self._redis.set(self._key('record', kind, key), json.dumps(value, ensure_ascii=False),
+                        ex=max(1, int(self.ttl)))
+
+    def get_record(self, kind, key):
+        data = self._redis.get(self._key('record', kind, key))
+        return json.loads(data) if data else None
+
+    # Очередь задач: sorted set, порядок - класс приоритета, затем номер поступления.
+    # Каждое изменение очереди увеличивает queue_version
+
+    def enqueue(self, task_id, job):
+        sequence = self._redis.incr(self._key('queue_seq'))
+        pipe = self._redis.pipeline()
+        pipe.set(self._key('job', task_id), json.dumps(job, ensure_ascii=False))
+        pipe.zadd(self._key('queue'), {task_id: _priority_rank(job) * 1e12 + sequence})
+        pipe.incr(self._key('queue_version'))
+        pipe.execute()
+
+    def claim(self, timeout=5.0):
+        item = self._redis.bzpopmin(self._key('queue'), timeout=max(1, int(timeout)))
+        if item is None:
+            return None
+        task_id = item[1]
+        pipe = self._redis.pipeline()
+        pipe.get(self._key('job', task_id))
+        pipe.delete(self._key('job', task_id))
+        pipe.incr(self._key('queue_version'))
+        data, _, _ = pipe.execute()
+        if not data:
+            return None
+        return task_id, json.loads(data)
+
+    def discard(self, task_id):
+        pipe = self._redis.pipeline()
+        pipe.zrem(self._key('queue'), task_id)
+        pipe.delete(self._key('job', task_id))
+        pipe.incr(self._key('queue_version'))
+        removed, _, _ = pipe.execute()
+        return bool(removed)
+
+    def queue_position(self, task_id):
+        """
+        Позиции всех задач очереди вычисляются одним проходом и кэшируются
+        до следующего изменения очереди: опросы статуса между постановкой и
+        выборкой задач читают только queue_version.
+        """
+        version = self._redis.get(self._key('queue_version'))
+        cached_version, positions = self._positions
+        if cached_version is None or cached_version != version:
+            task_ids = self._redis.zrange(self._key('queue'), 0, -1)
+            jobs = self._redis.mget([self._key('job', other) for other in task_ids]) if task_ids else []
+            positions, audio = {}, 0.0
+            for index, (other, data) in enumerate(zip(task_ids, jobs)):
+                positions[other] = (index + 1, audio)
+                audio += (json.loads(data).get('audio_seconds') or 0.0) if data else 0.0
+            # Кортеж заменяется целиком - потоки видят согласованную пару
+            self._positions = (version, positions)
+        return positions.get(task_id)
+
+    def queued_count(self):
+        return self._redis.zcard(self._key('queue'))
+
+
+class SharedJobQueue:
+    """
+    Очередь диспетчера поверх общего хранилища (режим SERVING_MODE=queue).
+
+    Интерфейс совпадает с FairJobQueue. Справедливое разделение между
+    клиентами здесь не применяется: порядок - класс приоритета, затем
+    время поступления, а задачи забирают процессы app.worker на любых узлах.
+    """
+
+    def __init__(self, store, workers=1):
+        self.store = store
+        self.workers = max(1, workers)
+        self.realtime_factor = Config.SCHEDULER_REALTIME_FACTOR
+
+    def put(self, task_id, job):
+        self.store.enqueue(task_id, job)
+
+    def get(self):
+        while True:
+            item = self.store.claim()
+            if item is not None:
+                return item
+
+    def discard(self, task_id):
+        return self.store.discard(task_id)
+
+    def task_done(self, task_id, audio_seconds=None):
+        pass
+
+    def estimate(self, job):
+        return (job.get('audio_seconds') or 0.0) * self.realtime_factor
+
+    def load(self, priority=None):
+        """Нагрузка по статусам незавершенных задач в хранилище (priority - только этого класса)"""
+        queued = running = 0
+        audio_seconds = cpu_seconds = 0.0
+        for task in self.store.active_tasks().values():
+            if priority is not None and (task.get('priority') or PRIORITY_CLASSES[0]) != priority:
+                continue
+            audio = task.get('audio_seconds') or 0.0
+            audio_seconds += audio
+            if task.get('status') == 'processing':
+                running += 1
+                cpu_seconds += audio * self.realtime_factor * (1 - task.get('progress', 0) / 100)
+            else:
+                queued += 1
+                cpu_seconds += audio * self.realtime_factor
+        return {
+            'queued_jobs': queued,
+            'running_jobs': running,
+            'audio_seconds': audio_seconds,
+            'cpu_seconds': cpu_seconds
+        }
+
+    def qsize(self):
+        return self.store.queued_count()
+
+    def position(self, task_id):
+        position = self.store.queue_position(task_id)
+        if position is None:
+            return None
+        index, audio_ahead = position
+        return {
+            'queue_position': index,
+            'estimated_start': time.time() + audio_ahead * self.realtime_factor / self.workers
+        }
+
+
+def create_task_registry(url=None):
+    """
+    Создает реестр задач по JOB_STORE_URL: memory:// (по умолчанию, один
+    процесс), sqlite:///путь/к/jobs.db (один узел), redis://host:6379/0
+    (несколько узлов)
+    """
+    url = url or Config.JOB_STORE_URL
+    if url.startswith('memory://'):
+        return TaskRegistry()
+    if url.startswith('sqlite:///'):
+        return SQLiteTaskRegistry(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        if redis is None:
+            raise RuntimeError('Для JOB_STORE_URL=redis:// требуется пакет redis')
+        return RedisTaskRegistry(redis.Redis.from_url(url, decode_responses=True),
+                                 prefix=Config.JOB_STORE_PREFIX)
+    raise ValueError(f'Неподдерживаемое хранилище задач: {url}')
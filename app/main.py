@@ -1,14 +1,30 @@
 import os
-import logging
+import json
 import time
-from flask import Flask, request, render_template, jsonify, send_file
+import mimetypes
+import logging
+import threading
+from flask import Flask, Response, request, render_template, jsonify, send_file, stream_with_context
 from werkzeug.utils import secure_filename
 from app.audio_processor import AudioProcessor
-from app.speech_recognizer import SpeechRecognizer
+from app.speech_recognizer import SpeechRecognizer, DECODE_PROFILES
 from app.config import Config
+from app.speaker_store import SpeakerStore, load_job_embeddings
+from app.speaker_recognizer import SpeakerRecognizer
+from app.chunked_upload import ChunkedUploadManager, ChunkedUploadError
+from app.task_registry import TERMINAL_STATUSES
+from app.job_store import create_task_registry
 import uuid
-from .speaker_first_transcription_manager import SpeakerFirstTranscriptionManager
-import threading
+from app.job_dispatcher import JobDispatcher
+from app.job_queue import FairJobQueue
+from app.admission import AdmissionController, AdmissionRejected
+from app.job_runner import embeddings_path as job_embeddings_path
+from app.storage_janitor import StorageJanitor
+from app.stream_recognizer import StreamRecognizerPool, StreamCapacityError, StreamConfigError, handle_stream
+from app.online_diarizer import OnlineDiarizer
+from app.batch_registry import BatchRegistry, stream_zip
+from app.result_files import select_variant
+from flask_sock import Sock
 
 # Настраиваем логирование
 logging.basicConfig(level=logging.DEBUG)
@@ -20,13 +36,58 @@ app = Flask(__name__,
 app.config.from_object(Config)
 
 audio_processor = AudioProcessor()
-speech_recognizer = SpeechRecognizer()
 
-# Словарь для хранения результатов
-processing_results = {}
+# Реестр статусов задач с автоматической очисткой (в памяти, SQLite или Redis)
+tasks_status = create_task_registry()
+tasks_status.start_janitor()
+
+# Хранилище известных спикеров
+speaker_store = SpeakerStore()
+
+# Сессии возобновляемой загрузки по частям
+chunked_uploads = ChunkedUploadManager(Config.UPLOAD_FOLDER)
+
+def is_task_active(task_id):
+    """Задача еще не отменена и не удалена из реестра"""
+    status = tasks_status.get(task_id)
+    return status is not None and status.get('status') not in TERMINAL_STATUSES
+
+def protected_files():
+    """Файлы незавершенных задач, которые нельзя удалять"""
+    protected = set()
+    for status in tasks_status.active_tasks().values():
+        for filename in status.get('files', []):
+            protected.add(os.path.join(Config.UPLOAD_FOLDER, filename))
+    return protected
+
+# Очистка диска по TTL и квотам
+storage_janitor = StorageJanitor(protected_files)
+storage_janitor.start()
+
+# Пакеты независимых задач (/batch)
+batches = BatchRegistry(tasks_status)
+
+def on_task_update(task_id, fields):
+    """Обновление статуса от обработчика: реестр задач и сводки пакетов"""
+    tasks_status.update(task_id, fields)
+    batches.task_updated(task_id, fields)
+
+# Обработчики задач распознавания (потоки или отдельные процессы)
+dispatcher = JobDispatcher(on_task_update, should_run=is_task_active, store=tasks_status)
+
+# Прием задач по бюджету аудио в работе
+admission = AdmissionController(dispatcher)
+
+def too_busy(e):
+    """Ответ 429 с Retry-After при исчерпании бюджета"""
+    response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
 
-# Добавим словарь для хранения статуса задач
-tasks_status = {}
+# Потоковое распознавание по WebSocket (модель Vosk загружается при первом соединении)
+sock = Sock(app)
+stream_pool = StreamRecognizerPool()
 
 def allowed_file(filename):
     return '.' in filename and \
@@ -41,11 +102,51 @@ def index():
         logger.error(f'Error rendering index: {str(e)}')
         return str(e), 500
 
+def _complete_upload(filepath, filename):
+    """Конвертирует загруженный файл в WAV (если нужно) и формирует ответ"""
+    # Конвертируем в WAV если нужно
+    if not filename.endswith('.wav'):
+        logger.info(f'Converting {filepath} to WAV')
+        wav_path = None
+        try:
+            wav_path = audio_processor.convert_to_wav(filepath)
+            logger.info(f'Successfully converted to WAV: {wav_path}')
+            
+            # Проверяем, что WAV файл создан
+            if not os.path.exists(wav_path):
+                logger.error(f'WAV file was not created: {wav_path}')
+                return jsonify({'error': 'Ошибка конвертации в WAV'}), 500
+            
+            # Удаляем оригинальный файл только после успешной конвертации
+            os.remove(filepath)
+            logger.info(f'Removed original file: {filepath}')
+            filename = os.path.basename(wav_path)
+        except Exception as e:
+            logger.error(f'Error during WAV conversion: {str(e)}')
+            # Пытаемся очистить файлы в случае ошибки
+            if os.path.exists(filepath):
+                os.remove(filepath)
+            if wav_path and os.path.exists(wav_path):
+                os.remove(wav_path)
+            return jsonify({'error': f'Ошибка конвертации: {str(e)}'}), 500
+    
+    logger.info(f'File processing completed successfully: {filename}')
+    return jsonify({
+        'message': 'Файл успешно загружен',
+        'filename': filename
+    })
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     try:
         logger.info('Processing file upload')
         
+        # Проверяем место на диске до разбора тела запроса
+        if not storage_janitor.has_capacity(request.content_length or 0):
+            return jsonify({'error': 'Недостаточно места на диске, попробуйте позже'}), 507
+        # Пока очередь перегружена, новые файлы не принимаются
+        admission.check()
+        
         if 'file' not in request.files:
             logger.warning('No file in request')
             return jsonify({'error': 'Файл не найден'}), 400
@@ -88,44 +189,140 @@ def upload_file():
                 logger.error(f'File was not saved successfully: {filepath}')
                 return jsonify({'error': 'Ошибка сохранения файла'}), 500
             
-            # Конвертируем в WAV если нужно
-            if not filename.endswith('.wav'):
-                logger.info(f'Converting {filepath} to WAV')
-                try:
-                    wav_path = audio_processor.convert_to_wav(filepath)
-                    logger.info(f'Successfully converted to WAV: {wav_path}')
-                    
-                    # Проверяем, что WAV файл создан
-                    if not os.path.exists(wav_path):
-                        logger.error(f'WAV file was not created: {wav_path}')
-                        return jsonify({'error': 'Ошибка конвертации в WAV'}), 500
-                    
-                    # Удаляем оригинальный файл только после успешной конвертации
-                    os.remove(filepath)
-                    logger.info(f'Removed original file: {filepath}')
-                    filename = os.path.basename(wav_path)
-                except Exception as e:
-                    logger.error(f'Error during WAV conversion: {str(e)}')
-                    # Пытаемся очистить файлы в случае ошибки
-                    if os.path.exists(filepath):
-                        os.remove(filepath)
-                    if os.path.exists(wav_path):
-                        os.remove(wav_path)
-                    return jsonify({'error': f'Ошибка конвертации: {str(e)}'}), 500
-            
-            logger.info(f'File processing completed successfully: {filename}')
-            return jsonify({
-                'message': 'Файл успешно загружен',
-                'filename': filename
-            })
+            return _complete_upload(filepath, filename)
         
         logger.warning('Invalid file type')
         return jsonify({'error': 'Недопустимый формат файла'}), 400
         
+    except AdmissionRejected as e:
+        return too_busy(e)
     except Exception as e:
         logger.error(f'Error in upload_file: {str(e)}')
         return jsonify({'error': str(e)}), 500
 
+@app.route('/upload/chunked', methods=['POST'])
+def init_chunked_upload():
+    """Создание сессии возобновляемой загрузки по частям"""
+    try:
+        data = request.get_json() or {}
+        filename = data.get('filename') or ''
+        size = data.get('size')
+        
+        if not filename or not allowed_file(filename):
+            logger.warning(f'Invalid file type for chunked upload: {filename}')
+            return jsonify({'error': 'Недопустимый формат файла'}), 400
+        if isinstance(size, bool) or not isinstance(size, int) or size <= 0:
+            return jsonify({'error': 'Необходимо указать размер файла'}), 400
+        
+        max_size = app.config['MAX_CONTENT_LENGTH']
+        if size > max_size:
+            logger.warning(f'File too large: {size} bytes (max: {max_size})')
+            return jsonify({
+                'error': f'Файл слишком большой. Размер: {size / (1024*1024):.1f}MB, Максимум: {max_size / (1024*1024):.1f}MB'
+            }), 413
+        
+        if not storage_janitor.has_capacity(size):
+            return jsonify({'error': 'Недостаточно места на диске, попробуйте позже'}), 507
+        admission.check()
+        
+        session = chunked_uploads.init(filename, size)
+        session['chunk_size'] = Config.UPLOAD_CHUNK_SIZE
+        return jsonify(session)
+    except AdmissionRejected as e:
+        return too_busy(e)
+    except Exception as e:
+        logger.error(f'Error in init_chunked_upload: {str(e)}')
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/upload/chunked/<upload_id>', methods=['GET'])
+def chunked_upload_status(upload_id):
+    """Текущее смещение загрузки - с него клиент продолжает после обрыва"""
+    try:
+        return jsonify(chunked_uploads.status(upload_id))
+    except ChunkedUploadError as e:
+        return jsonify({'error': str(e)}), e.status_code
+
+@app.route('/upload/chunked/<upload_id>', methods=['PUT'])
+def append_chunk(upload_id):
+    """Прием очередной части; тело запроса пишется на диск потоково"""
+    try:
+        offset = request.args.get('offset', type=int)
+        if offset is None:
+            return jsonify({'error': 'Не указано смещение части'}), 400
+        
+        session = chunked_uploads.append(upload_id, offset, request.stream)
+        return jsonify(session)
+    except ChunkedUploadError as e:
+        logger.warning(f'Chunk rejected for upload {upload_id}: {str(e)}')
+        return jsonify({'error': str(e), 'offset': e.offset}), e.status_code
+    except Exception as e:
+        logger.error(f'Error in append_chunk: {str(e)}')
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/upload/chunked/<upload_id>/finalize', methods=['POST'])
+def finalize_chunked_upload(upload_id):
+    """Завершение загрузки по частям и конвертация в WAV"""
+    try:
+        filepath, filename = chunked_uploads.finalize(upload_id)
+        return _complete_upload(filepath, filename)
+    except ChunkedUploadError as e:
+        logger.warning(f'Cannot finalize upload {upload_id}: {str(e)}')
+        return jsonify({'error': str(e), 'offset': e.offset}), e.status_code
+    except Exception as e:
+        logger.error(f'Error in finalize_chunked_upload: {str(e)}')
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/upload/chunked/<upload_id>', methods=['DELETE'])
+def abort_chunked_upload(upload_id):
+    """Отмена загрузки по частям"""
+    try:
+        chunked_uploads.abort(upload_id)
+        return jsonify({'message': 'Загрузка отменена'})
+    except ChunkedUploadError as e:
+        return jsonify({'error': str(e)}), e.status_code
+
+def _client_id(data):
+    """Клиент для справедливого разделения очереди: заголовок, поле запроса или адрес"""
+    return request.headers.get('X-Client-Id') or data.get('client') or request.remote_addr
+
+def _audio_seconds(files):
+    """Суммарная длительность файлов задачи для планировщика"""
+    return sum(AudioProcessor.duration(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+               for filename in files)
+
+def _job_options(data, default_priority='interactive'):
+    """Проверяет параметры распознавания из запроса, ошибки - ValueError"""
+    priority = FairJobQueue.normalize_priority(data.get('priority') or default_priority)
+
+    language = data.get('language') or Config.WHISPER_LANGUAGE
+    if not isinstance(language, str):
+        raise ValueError('language должен быть строкой с кодом языка')
+    if not SpeechRecognizer.is_supported_language(language):
+        raise ValueError(f'Неподдерживаемый язык: {language}')
+
+    known_speakers = data.get('known_speakers') or None
+    if known_speakers is not None and not isinstance(known_speakers, list):
+        raise ValueError('known_speakers должен быть списком имен')
+
+    speaker_hints = SpeakerRecognizer.build_speaker_hints(
+        num_speakers=data.get('num_speakers'),
+        min_speakers=data.get('min_speakers'),
+        max_speakers=data.get('max_speakers')
+    )
+
+    # Профиль декодирования: из запроса или по умолчанию для класса приоритета
+    profile = data.get('profile') or Config.WHISPER_QUEUE_PROFILES.get(priority, Config.WHISPER_PROFILE)
+    if profile not in DECODE_PROFILES:
+        raise ValueError(f'Неизвестный профиль декодирования: {profile}')
+    return {
+        'language': language,
+        'known_speakers': known_speakers,
+        'speaker_hints': speaker_hints,
+        'priority': priority,
+        'profile': profile,
+        'client': _client_id(data)
+    }
+
 @app.route('/recognize', methods=['POST'])
 def recognize():
     try:
@@ -156,6 +353,12 @@ def recognize():
             logger.warning('Empty files list')
             return jsonify({'error': 'Список файлов пуст'}), 400
 
+        try:
+            options = _job_options(data)
+        except ValueError as e:
+            logger.warning(f'Invalid recognition options: {str(e)}')
+            return jsonify({'error': str(e)}), 400
+
         # Проверяем существование файлов
         for filename in files:
             filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
@@ -166,174 +369,324 @@ def recognize():
 
         # Создаем ID задачи
         task_id = str(uuid.uuid4())
-        tasks_status[task_id] = {
-            'progress': 0,
-            'status': 'processing',
-            'current_file': 0,
-            'total_files': len(files),
-            'created_at': time.time(),
-            'last_update': time.time()
-        }
-        logger.info(f'Created task {task_id} for {len(files)} files')
-
-        def process_files():
-            try:
-                logger.info(f'Starting background processing for task {task_id}')
-                
-                # Собираем полные пути к файлам
-                file_paths = [os.path.join(app.config['UPLOAD_FOLDER'], filename) for filename in files]
-                logger.info(f'File paths: {file_paths}')
-                
-                # Создаем имя для объединенного файла
-                merged_filename = f'merged_{uuid.uuid4()}.wav'
-                merged_path = os.path.join(app.config['UPLOAD_FOLDER'], merged_filename)
-                logger.info(f'Will merge files into: {merged_path}')
-                
-                # Объединяем файлы
-                logger.info(f'Merging {len(file_paths)} files into {merged_path}')
-                audio_processor.merge_wav_files(file_paths, merged_path)
-                
-                # Проверяем, что файл создан
-                if not os.path.exists(merged_path):
-                    raise Exception('Ошибка создания объединенного файла')
-                
-                logger.info('Files merged successfully')
-                
-                # Обновляем прогресс
-                tasks_status[task_id]['progress'] = 20  # 20% за объединение файлов
-                
-                # Распознаем речь
-                logger.info('Starting transcription of merged file')
-                transcription_manager = SpeakerFirstTranscriptionManager()
-                
-                def update_progress(progress):
-                    # Корректируем прогресс: 20% за объединение + 80% за распознавание
-                    adjusted_progress = 20 + int(progress * 0.8)
-                    tasks_status[task_id]['progress'] = adjusted_progress
-                    tasks_status[task_id]['last_update'] = time.time()
-                    logger.info(f'Task {task_id} progress: {adjusted_progress}% (raw: {progress}%)')
-                
-                text = transcription_manager.process_audio(merged_path, update_progress)
-                
-                # Сохраняем результат
-                result_filename = f'result_{uuid.uuid4()}.txt'
-                result_path = os.path.join(app.config['RESULT_FOLDER'], result_filename)
-                
-                logger.info(f'Creating result file: {result_path}')
-                
-                # Проверяем существование директории результатов
-                if not os.path.exists(app.config['RESULT_FOLDER']):
-                    logger.info(f'Creating results directory: {app.config["RESULT_FOLDER"]}')
-                    os.makedirs(app.config['RESULT_FOLDER'])
-                
-                with open(result_path, 'w', encoding='utf-8') as f:
-                    f.write(text)
-                    
-                # Проверяем, что файл создан
-                if not os.path.exists(result_path):
-                    logger.error(f'Failed to create result file: {result_path}')
-                    raise Exception('Ошибка создания файла результата')
-                    
-                logger.info(f'Result file created successfully: {result_path}')
-
-                # Удаляем временные файлы
-                os.remove(merged_path)
-                for file_path in file_paths:
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-
-                # Обновляем статус задачи
-                logger.info(f'Updating task status with result file: {result_filename}')
-                tasks_status[task_id].update({
-                    'status': 'completed',
-                    'result_file': result_filename
-                })
-                logger.info(f'Task status updated: {tasks_status[task_id]}')
-                
-            except Exception as e:
-                logger.error(f'Error in process_files: {str(e)}')
-                tasks_status[task_id].update({
-                    'status': 'error',
-                    'error': str(e)
-                })
-
-        # Запускаем обработку в отдельном потоке
-        thread = threading.Thread(target=process_files)
-        thread.start()
+        audio_seconds = _audio_seconds(files)
+
+        def register_task(accepted):
+            tasks_status.create(task_id, {
+                'progress': 0,
+                'status': 'queued',
+                'current_file': 0,
+                'total_files': len(files),
+                'files': files,
+                'language': options['language'],
+                'speaker_hints': options['speaker_hints'],
+                'priority': options['priority'],
+                'profile': options['profile'],
+                'audio_seconds': audio_seconds
+            })
+            logger.info(f'Created task {task_id} for {len(files)} files')
+
+        # Передаем задачу обработчикам, если для нее есть место
+        admission.submit([(task_id, dict(options, files=files, audio_seconds=audio_seconds))],
+                         on_accept=register_task)
         
         return jsonify({
             'task_id': task_id,
             'message': 'Обработка начата'
         })
         
+    except AdmissionRejected as e:
+        return too_busy(e)
     except Exception as e:
         logger.error(f'Error in recognize: {str(e)}')
         return jsonify({'error': str(e)}), 500
 
+@app.route('/batch', methods=['POST'])
+def create_batch():
+    """Пакетная отправка: каждый файл распознается отдельной задачей"""
+    data = request.get_json(silent=True)
+    if not data or not data.get('files'):
+        return jsonify({'error': 'Файлы не указаны'}), 400
+
+    files = data['files']
+    if not isinstance(files, list) or not all(isinstance(name, str) for name in files):
+        return jsonify({'error': 'files должен быть списком имен файлов'}), 400
+
+    try:
+        options = _job_options(data, default_priority='bulk')
+    except ValueError as e:
+        logger.warning(f'Invalid batch options: {str(e)}')
+        return jsonify({'error': str(e)}), 400
+
+    missing = [name for name in files
+               if not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], name))]
+    if missing:
+        logger.error(f'Batch files not found: {missing[:10]}')
+        return jsonify({'error': 'Файлы не найдены', 'missing': missing}), 404
+
+    batch_id = str(uuid.uuid4())
+    task_ids = [str(uuid.uuid4()) for _ in files]
+    jobs = [(task_id, dict(options, files=[filename], audio_seconds=_audio_seconds([filename])))
+            for task_id, filename in zip(task_ids, files)]
+
+    def register_batch(accepted):
+        for task_id, job in accepted:
+            tasks_status.create(task_id, {
+                'progress': 0,
+                'status': 'queued',
+                'current_file': 0,
+                'total_files': 1,
+                'files': job['files'],
+                'language': options['language'],
+                'speaker_hints': options['speaker_hints'],
+                'priority': options['priority'],
+                'profile': options['profile'],
+                'audio_seconds': job['audio_seconds'],
+                'batch_id': batch_id
+            })
+        batches.create(batch_id, [task_id for task_id, _ in accepted],
+                       [job['files'][0] for _, job in accepted])
+
+    # Задачи пакета идут в общую очередь и используют общие обработчики;
+    # сверх бюджета пакетного класса принимается только начало списка
+    try:
+        accepted = admission.submit(jobs, on_accept=register_batch, partial=True)
+    except AdmissionRejected as e:
+        return too_busy(e)
+    logger.info(f'Created batch {batch_id} with {len(accepted)} of {len(files)} tasks')
+
+    result = {
+        'batch_id': batch_id,
+        'task_ids': [task_id for task_id, _ in accepted],
+        'message': 'Обработка начата'
+    }
+    if len(accepted) == len(jobs):
+        return jsonify(result)
+
+    # Остальные файлы клиент отправляет новым пакетом после Retry-After
+    rejected = jobs[len(accepted):]
+    retry_after = admission.retry_after(sum(job['audio_seconds'] or 0.0 for _, job in rejected[:1]),
+                                        options['priority'])
+    result.update({
+        'message': 'Пакет принят частично, остальные файлы отправьте позже',
+        'rejected_files': [job['files'][0] for _, job in rejected],
+        'retry_after': retry_after
+    })
+    response = jsonify(result)
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 202
+
+@app.route('/batch/<batch_id>')
+def get_batch(batch_id):
+    """Сводный прогресс пакета и статусы его задач"""
+    summary = batches.get(batch_id)
+    if summary is None:
+        return jsonify({'error': 'Пакет не найден'}), 404
+    return jsonify(summary)
+
+@app.route('/batch/<batch_id>/download')
+def download_batch(batch_id):
+    """Zip с готовыми результатами пакета, отдается потоком"""
+    entries = batches.results(batch_id)
+    if entries is None:
+        return jsonify({'error': 'Пакет не найден'}), 404
+    if not entries:
+        return jsonify({'error': 'Готовых результатов пока нет'}), 404
+
+    logger.info(f'Streaming {len(entries)} results of batch {batch_id}')
+    return Response(
+        stream_with_context(stream_zip(entries)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename=batch_{batch_id}.zip'}
+    )
+
+@app.route('/capacity')
+def get_capacity():
+    """Бюджет мощности узла для балансировщика (503, если новые задачи не принимаются)"""
+    capacity = admission.capacity()
+    return jsonify(capacity), 200 if capacity['accepting'] else 503
+
+@app.route('/speakers')
+def list_speakers():
+    """Список зарегистрированных спикеров"""
+    return jsonify({'speakers': speaker_store.names()})
+
+@app.route('/speakers/enroll', methods=['POST'])
+def enroll_speaker():
+    """Регистрирует спикера из завершенной задачи под заданным именем"""
+    try:
+        data = request.get_json() or {}
+        task_id = data.get('task_id')
+        speaker = data.get('speaker')
+        name = (data.get('name') or '').strip()
+        if not task_id or not speaker or not name:
+            return jsonify({'error': 'Необходимо указать task_id, speaker и name'}), 400
+
+        embeddings_path = job_embeddings_path(secure_filename(task_id))
+        if not os.path.exists(embeddings_path):
+            logger.warning(f'No speaker embeddings for task {task_id}')
+            return jsonify({'error': 'Эмбеддинги спикеров для задачи не найдены'}), 404
+
+        embeddings = load_job_embeddings(embeddings_path)
+        if speaker not in embeddings:
+            return jsonify({'error': f'Спикер {speaker} не найден в задаче'}), 404
+
+        speaker_store.enroll(name, embeddings[speaker])
+        logger.info(f'Speaker {speaker} of task {task_id} enrolled as {name}')
+        return jsonify({'message': 'Спикер зарегистрирован', 'name': name})
+    except Exception as e:
+        logger.error(f'Error in enroll_speaker: {str(e)}')
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/speakers/<name>', methods=['DELETE'])
+def delete_speaker(name):
+    """Удаляет зарегистрированного спикера"""
+    if not speaker_store.remove(name):
+        return jsonify({'error': 'Спикер не найден'}), 404
+    return jsonify({'message': 'Спикер удален'})
+
+# Поля статуса, изменение которых отправляется клиенту по SSE
+STATUS_PUSH_FIELDS = ('status', 'progress', 'error', 'result_file', 'queue_position', 'estimated_start')
+# Позиция в очереди меняется без обновления задачи - перепроверяем ее чаще
+QUEUED_RECHECK_SECONDS = 5
+# Пауза перед повторным запросом, когда все слоты ожидания заняты
+STATUS_BUSY_RETRY_SECONDS = 5
+
+# Слоты долгих запросов статуса: каждый занимает поток сервера
+status_waiters = threading.BoundedSemaphore(Config.STATUS_MAX_WAITERS)
+
+def _task_status(task_id, status=None):
+    """Статус задачи с позицией в очереди для ожидающих задач (None - задачи нет)"""
+    status = tasks_status.get(task_id) if status is None else status
+    if status is not None and status.get('status') == 'queued':
+        # Позиция в очереди и ориентировочное время начала обработки
+        status.update(dispatcher.position(task_id) or {})
+    return status
+
+def _wait_for_update(task_id, status, timeout):
+    """Ждет изменения статуса задачи не дольше timeout секунд"""
+    if status.get('status') == 'queued':
+        timeout = min(timeout, QUEUED_RECHECK_SECONDS)
+    return _task_status(task_id, tasks_status.wait_for_change(task_id, status.get('last_update'), timeout))
+
 @app.route('/status/<task_id>')
 def get_status(task_id):
-    """Получение статуса обработки"""
-    logger.info(f'Status request for task {task_id}')
-    
-    if task_id not in tasks_status:
+    """
+    Получение статуса обработки.
+
+    С параметрами ?since=<last_update>&wait=<секунды> запрос ждет (long-poll),
+    пока статус не изменится после since, и только потом отвечает.
+    """
+    status = _task_status(task_id)
+    if status is None:
         logger.warning(f'Task {task_id} not found in tasks_status')
         return jsonify({'error': 'Задача не найдена'}), 404
-    
-    status = tasks_status[task_id]
-    logger.info(f'Task {task_id} status: {status}')
+
+    since = request.args.get('since', type=float)
+    wait = min(max(request.args.get('wait', 0, type=float), 0), Config.STATUS_WAIT_SECONDS)
+    if wait and since == status.get('last_update') and status.get('status') not in TERMINAL_STATUSES:
+        if not status_waiters.acquire(blocking=False):
+            # Без свободного слота сразу отвечаем текущим статусом и просим
+            # клиента подождать, чтобы он не повторял запрос без паузы
+            response = jsonify(status)
+            response.headers['Retry-After'] = str(STATUS_BUSY_RETRY_SECONDS)
+            return response
+        try:
+            status = _wait_for_update(task_id, status, wait) or status
+        finally:
+            status_waiters.release()
+
     return jsonify(status)
 
+@app.route('/status/<task_id>/events')
+def status_events(task_id):
+    """
+    Поток изменений статуса (Server-Sent Events).
+
+    Событие отправляется только при изменении видимых полей статуса, в
+    остальное время - комментарий keepalive. Поток закрывается после
+    завершения задачи или через STATUS_STREAM_SECONDS (браузер
+    переподключится сам).
+    """
+    status = _task_status(task_id)
+    if status is None:
+        return jsonify({'error': 'Задача не найдена'}), 404
+    if not status_waiters.acquire(blocking=False):
+        response = jsonify({'error': 'Слишком много подписок на статус, используйте опрос'})
+        response.headers['Retry-After'] = str(STATUS_BUSY_RETRY_SECONDS)
+        return response, 503
+
+    def events(status):
+        deadline = time.time() + Config.STATUS_STREAM_SECONDS
+        sent = None
+        while True:
+            visible = {key: status.get(key) for key in STATUS_PUSH_FIELDS}
+            if visible != sent:
+                sent = visible
+                yield f'data: {json.dumps(status, ensure_ascii=False)}\n\n'
+            else:
+                yield ': keepalive\n\n'
+            remaining = deadline - time.time()
+            if status.get('status') in TERMINAL_STATUSES or remaining <= 0:
+                return
+            status = _wait_for_update(task_id, status, min(remaining, Config.STATUS_WAIT_SECONDS))
+            if status is None:
+                yield 'event: gone\ndata: {}\n\n'
+                return
+
+    response = Response(
+        stream_with_context(events(status)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    response.call_on_close(status_waiters.release)
+    return response
+
 @app.route('/tasks')
 def get_all_tasks():
-    """Получение списка всех задач"""
-    logger.info('Request for all tasks')
+    """Получение списка задач постранично (?offset=&limit=&status=)"""
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+    status = request.args.get('status')
+    logger.info(f'Request for tasks: offset={offset}, limit={limit}, status={status}')
     
-    tasks_list = []
-    for task_id, status in tasks_status.items():
-        task_info = {
-            'task_id': task_id,
-            'status': status.get('status', 'unknown'),
-            'progress': status.get('progress', 0),
-            'total_files': status.get('total_files', 0),
-            'current_file': status.get('current_file', 0)
-        }
-        
-        # Добавляем время последнего обновления
-        if 'last_update' not in status:
-            status['last_update'] = time.time()
-        task_info['last_update'] = status['last_update']
-        
-        tasks_list.append(task_info)
+    tasks_list, total = tasks_status.list(offset=offset, limit=limit, status=status)
     
-    logger.info(f'Returning {len(tasks_list)} tasks')
-    return jsonify(tasks_list)
+    logger.info(f'Returning {len(tasks_list)} of {total} tasks')
+    return jsonify({
+        'tasks': tasks_list,
+        'total': total,
+        'offset': offset,
+        'limit': limit
+    })
 
 @app.route('/cancel/<task_id>', methods=['POST'])
 def cancel_task(task_id):
     """Отмена задачи"""
     logger.info(f'Cancel request for task {task_id}')
     
-    if task_id not in tasks_status:
+    previous_status, cancelled = tasks_status.cancel(task_id)
+    if previous_status is None:
         logger.warning(f'Task {task_id} not found in tasks_status')
         return jsonify({'error': 'Задача не найдена'}), 404
     
-    current_status = tasks_status[task_id]
-    if current_status.get('status') in ['completed', 'error']:
-        logger.warning(f'Task {task_id} is already {current_status["status"]}')
-        return jsonify({'error': f'Задача уже {current_status["status"]}'}), 400
-    
-    # Помечаем задачу как отмененную
-    tasks_status[task_id].update({
-        'status': 'cancelled',
-        'error': 'Задача отменена пользователем',
-        'last_update': time.time()
-    })
+    if not cancelled:
+        logger.warning(f'Task {task_id} is already {previous_status}')
+        return jsonify({'error': f'Задача уже {previous_status}'}), 400
     
+    dispatcher.discard(task_id)
     logger.info(f'Task {task_id} cancelled successfully')
     return jsonify({'message': 'Задача отменена'})
 
 @app.route('/download/<filename>')
 def download_result(filename):
+    """
+    Скачивание результата.
+
+    Файлы результатов не меняются после записи, поэтому ответ кэшируется
+    (ETag, Last-Modified, Cache-Control), поддерживает условные запросы и
+    Range, а клиенту с Accept-Encoding отдается заранее сжатый вариант.
+    """
     try:
         logger.info(f'Attempting to download result file: {filename}')
         
@@ -347,17 +700,57 @@ def download_result(filename):
         if not os.path.exists(result_path):
             logger.error(f'Result file not found: {result_path}')
             return jsonify({'error': 'Результат не найден'}), 404
-            
-        logger.info(f'File exists, sending: {result_path}')
-        return send_file(
-            result_path,
+
+        path, encoding = select_variant(result_path, request.accept_encodings)
+        logger.info(f'File exists, sending: {path}')
+        response = send_file(
+            path,
+            mimetype=mimetypes.guess_type(result_path)[0] or 'text/plain',
             as_attachment=True,
-            download_name='transcription.txt'
+            download_name='transcription' + os.path.splitext(result_path)[1],
+            max_age=Config.RESULT_CACHE_MAX_AGE
         )
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
     except Exception as e:
         logger.error(f'Error in download_result: {str(e)}')
         return jsonify({'error': str(e)}), 500
 
+def close_stream(ws, message, code):
+    """Сообщает клиенту об ошибке и закрывает WebSocket с кодом code"""
+    ws.send(json.dumps({'error': message}, ensure_ascii=False))
+    ws.close(reason=code)
+
+@sock.route('/ws/stream')
+def stream(ws):
+    """Потоковое распознавание: PCM 16 бит моно -> промежуточные и финальные результаты"""
+    if not Config.STREAMING_ENABLED:
+        close_stream(ws, 'Потоковое распознавание отключено', 1008)
+        return
+
+    sample_rate = request.args.get('sample_rate', default=Config.STREAM_SAMPLE_RATE, type=int)
+    diarize = request.args.get('diarize', '').lower() in ('1', 'true', 'yes')
+    known_speakers = [name for name in request.args.get('speakers', '').split(',') if name] or None
+    try:
+        handle_stream(
+            ws, stream_pool, sample_rate, diarize=diarize,
+            diarizer_factory=lambda: OnlineDiarizer(speaker_store=speaker_store,
+                                                    known_speakers=known_speakers),
+            # Эмбеддинги pyannote считаются в процессе соединения: вне режима inline
+            # API-процесс моделей pyannote не загружает
+            allow_diarization=Config.SERVING_MODE == 'inline'
+        )
+    except StreamCapacityError as e:
+        logger.warning(f'Rejecting stream: {str(e)}')
+        # 1013 - Try Again Later
+        close_stream(ws, str(e), 1013)
+    except StreamConfigError as e:
+        logger.warning(f'Rejecting stream with invalid config: {str(e)}')
+        # 1008 - Policy Violation
+        close_stream(ws, str(e), 1008)
+
 @app.errorhandler(413)
 def too_large(e):
     """Обработчик ошибки превышения размера файла"""
@@ -368,4 +761,5 @@ def too_large(e):
 
 if __name__ == '__main__':
     logger.info('Starting Flask application')
-    app.run(host='0.0.0.0', debug=True) 
\ No newline at end of file
+    dispatcher.start()
+    app.run(host='0.0.0.0', debug=True, use_reloader=False) 
\ No newline at end of file
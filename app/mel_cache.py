@@ -0,0 +1,77 @@
+import logging
+import time
+import numpy as np
+import torch
+from whisper.audio import N_FFT, HOP_LENGTH, N_FRAMES, SAMPLE_RATE, FRAMES_PER_SECOND, mel_filters
+
+logger = logging.getLogger(__name__)
+
+# log10 от нижней границы мощности: значение кадров тишины/дополнения
+SILENCE_LOG_MEL = -10.0
+
+
+class MelCache:
+    """
+    Log-mel спектрограмма всей записи, вычисленная один раз на задачу.
+
+    Хранятся "сырые" значения log10 до нормализации Whisper: нормализация
+    (ограничение снизу максимумом минус 8 и масштабирование) зависит от
+    максимума конкретного окна, поэтому выполняется при выдаче сегмента.
+    Кадры внутри записи совпадают с log_mel_spectrogram Whisper; на границах
+    сегмента используются реальные соседние отсчеты вместо отражения.
+    """
+
+    def __init__(self, waveform, n_mels=80, block_seconds=300):
+        """
+        Args:
+            waveform: моно float32 массив с частотой 16 кГц
+            n_mels: число mel-полос модели (model.dims.n_mels)
+            block_seconds: длина блока STFT; длинные записи обрабатываются по
+                блокам, чтобы не держать в памяти полную комплексную STFT
+        """
+        start_time = time.time()
+        self.n_mels = n_mels
+        audio = torch.from_numpy(np.ascontiguousarray(waveform, dtype=np.float32))
+        self.frames = len(audio) // HOP_LENGTH
+        self._log_spec = torch.full((n_mels, self.frames), SILENCE_LOG_MEL)
+
+        window = torch.hann_window(N_FFT)
+        filters = mel_filters('cpu', n_mels)
+        block_frames = max(1, int(block_seconds * SAMPLE_RATE) // HOP_LENGTH)
+
+        for first in range(0, self.frames, block_frames):
+            last = min(first + block_frames, self.frames)
+            # Кадр f покрывает отсчеты [f*HOP - N_FFT/2, f*HOP + N_FFT/2)
+            begin = first * HOP_LENGTH - N_FFT // 2
+            end = (last - 1) * HOP_LENGTH + N_FFT // 2
+            chunk = audio[max(begin, 0):min(end, len(audio))]
+            pad_left, pad_right = max(0, -begin), max(0, end - len(audio))
+            if pad_left or pad_right:
+                # На краях записи отражаем сигнал, как STFT с center=True
+                mode = 'reflect' if len(chunk) > max(pad_left, pad_right) else 'constant'
+                chunk = torch.nn.functional.pad(
+                    chunk[None, None], (pad_left, pad_right), mode=mode
+                )[0, 0]
+
+            stft = torch.stft(chunk, N_FFT, HOP_LENGTH, window=window,
+                              center=False, return_complex=True)
+            magnitudes = stft.abs() ** 2
+            mel_spec = filters @ magnitudes
+            self._log_spec[:, first:last] = torch.clamp(mel_spec, min=1e-10).log10()
+
+        logger.info(f"Mel spectrogram for {len(audio) / SAMPLE_RATE:.1f}s "
+                    f"computed in {time.time() - start_time:.2f} seconds")
+
+    def segment(self, start_time, end_time):
+        """
+        Возвращает нормализованное окно Whisper (n_mels, N_FRAMES) для
+        сегмента [start_time, end_time) длиной не более 30 секунд,
+        дополненное тишиной так же, как в whisper.transcribe.
+        """
+        first = max(0, int(round(start_time * FRAMES_PER_SECOND)))
+        last = min(self.frames, int(round(end_time * FRAMES_PER_SECOND)), first + N_FRAMES)
+        log_spec = torch.full((self.n_mels, N_FRAMES), SILENCE_LOG_MEL)
+        log_spec[:, :max(0, last - first)] = self._log_spec[:, first:last]
+
+        log_spec = torch.maximum(log_spec, log_spec.max() - 8.0)
+        return (log_spec + 4.0) / 4.0
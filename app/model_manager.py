@@ -1,38 +1,395 @@
 import os
-import wget
-import zipfile
+import sys
+import json
+import time
+import fcntl
 import shutil
+import hashlib
+import logging
+import zipfile
+import tempfile
+import threading
+import urllib.request
+from contextlib import contextmanager
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+# Модели Hugging Face, из которых собирается pipeline диаризации
+PYANNOTE_REPOS = [
+    "pyannote/speaker-diarization",
+    "pyannote/segmentation",
+    "pyannote/embedding",
+    "speechbrain/spkrec-ecapa-voxceleb",
+]
+
+# Файл-маркер полностью распакованного артефакта
+COMPLETE_MARKER = '.complete'
+
+
+class ModelUnavailableError(Exception):
+    """Артефакт модели отсутствует или поврежден и не может быть загружен"""
+
+
+def sha256sum(path, block_size=1024 * 1024):
+    """Считает SHA256 файла блоками"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def convert_whisper_checkpoint(source_path, target_path):
+    """
+    Сохраняет чекпоинт Whisper с весами float32 для загрузки через mmap.
+
+    Официальные чекпоинты хранят веса в float16, а на CPU модель работает в
+    float32: при обычной загрузке веса копируются и приводятся в памяти
+    каждого процесса. После конвертации тензоры файла используются как есть.
+    """
+    import torch
+
+    checkpoint = torch.load(source_path, map_location='cpu', weights_only=True)
+    state_dict = {
+        key: value.float() if value.is_floating_point() else value
+        for key, value in checkpoint['model_state_dict'].items()
+    }
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target_path), suffix='.part')
+    os.close(fd)
+    try:
+        torch.save({'dims': checkpoint['dims'], 'model_state_dict': state_dict}, tmp_path)
+        os.replace(tmp_path, target_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return target_path
+
 
 class ModelManager:
+    """
+    Локальный кэш артефактов моделей: Vosk, Whisper и pyannote.
+
+    Все артефакты лежат в Config.MODELS_DIR, а их файлы и SHA256 записываются
+    в manifest.json. При повторном запуске артефакт проверяется по манифесту;
+    поврежденный или недораспакованный артефакт загружается заново, а в
+    офлайн-режиме (MODEL_OFFLINE или HF_HUB_OFFLINE) вызывает
+    ModelUnavailableError без обращения к сети.
+    """
+
     MODEL_URL = "https://alphacephei.com/vosk/models/vosk-model-ru-0.22.zip"
-    MODEL_DIR = "/app/models"
     MODEL_NAME = "vosk-model-ru-0.22"
-    
+    ARTIFACTS = ('vosk', 'whisper', 'pyannote')
+
+    # Блокировка каталога моделей: процессы и контейнеры с общим томом
+    # загружают артефакты и меняют манифест по очереди
+    _thread_lock = threading.RLock()
+    _lock_depth = 0
+    _lock_file = None
+
+    @classmethod
+    def models_dir(cls):
+        return Config.MODELS_DIR
+
+    @classmethod
+    def _manifest_path(cls):
+        return os.path.join(cls.models_dir(), 'manifest.json')
+
+    @classmethod
+    @contextmanager
+    def _exclusive(cls):
+        """
+        Монопольный доступ к каталогу моделей (flock на manifest.lock).
+        Повторный вход из того же потока не блокируется.
+        """
+        with cls._thread_lock:
+            if cls._lock_depth == 0:
+                os.makedirs(cls.models_dir(), exist_ok=True)
+                lock_file = open(os.path.join(cls.models_dir(), 'manifest.lock'), 'a')
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                cls._lock_file = lock_file
+            cls._lock_depth += 1
+            try:
+                yield
+            finally:
+                cls._lock_depth -= 1
+                if cls._lock_depth == 0:
+                    fcntl.flock(cls._lock_file, fcntl.LOCK_UN)
+                    cls._lock_file.close()
+                    cls._lock_file = None
+
+    @classmethod
+    def load_manifest(cls):
+        """Возвращает манифест {артефакт: {path, source, files: {путь: sha256}, sizes: {путь: размер}}}"""
+        try:
+            with open(cls._manifest_path(), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    @classmethod
+    def _record(cls, name, path, source, files):
+        """Атомарно записывает артефакт в манифест"""
+        base = path if os.path.isdir(path) else os.path.dirname(path)
+        with cls._exclusive():
+            manifest = cls.load_manifest()
+            manifest[name] = {
+                'path': os.path.relpath(path, cls.models_dir()),
+                'source': source,
+                'files': files,
+                'sizes': {
+                    relative_path: os.path.getsize(os.path.realpath(os.path.join(base, relative_path)))
+                    for relative_path in files
+                },
+                'created_at': time.time()
+            }
+            fd, tmp_path = tempfile.mkstemp(dir=cls.models_dir(), suffix='.json')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, cls._manifest_path())
+
+    @staticmethod
+    def _hash_tree(path):
+        """SHA256 всех файлов каталога (или одного файла) {относительный путь: sha256}"""
+        if os.path.isfile(path):
+            return {os.path.basename(path): sha256sum(path)}
+        files = {}
+        for root, _, names in os.walk(path):
+            for filename in names:
+                if filename == COMPLETE_MARKER:
+                    continue
+                full_path = os.path.join(root, filename)
+                # В кэше Hugging Face файлы снимков - ссылки на blobs
+                files[os.path.relpath(full_path, path)] = sha256sum(os.path.realpath(full_path))
+        return files
+
+    @classmethod
+    def _expected_source(cls, name):
+        """Источник, из которого должен быть собран артефакт при текущих настройках"""
+        if name == 'vosk':
+            return Config.VOSK_MODEL_URL or cls.MODEL_URL
+        if name == 'whisper':
+            import whisper
+            return whisper._MODELS.get(Config.WHISPER_MODEL)
+        if name == 'whisper_mmap':
+            return Config.WHISPER_MODEL
+        return ','.join(PYANNOTE_REPOS)
+
+    @classmethod
+    def verify(cls, name, full=False):
+        """
+        Проверяет файлы артефакта по манифесту, возвращает путь или None.
+
+        При запуске проверяются только маркер распаковки и размеры файлов:
+        чтение нескольких гигабайт для SHA256 свело бы на нет быстрый старт.
+        SHA256 сверяется при full=True (команды prebake и verify).
+        """
+        entry = cls.load_manifest().get(name)
+        if not entry:
+            return None
+        # Артефакт другой модели (например, после смены WHISPER_MODEL) не подходит
+        if entry.get('source') != cls._expected_source(name):
+            logger.warning(f'Model artifact {name} was built from {entry.get("source")}, '
+                           f'expected {cls._expected_source(name)}')
+            return None
+        path = os.path.join(cls.models_dir(), entry['path'])
+        if not os.path.exists(path):
+            return None
+        if os.path.isdir(path) and name == 'vosk' and not os.path.exists(os.path.join(path, COMPLETE_MARKER)):
+            logger.warning(f'Model artifact {name} is incomplete: {path}')
+            return None
+
+        base = path if os.path.isdir(path) else os.path.dirname(path)
+        sizes = entry.get('sizes', {})
+        for relative_path in entry['files']:
+            file_path = os.path.realpath(os.path.join(base, relative_path))
+            if not os.path.exists(file_path) or (
+                    relative_path in sizes and os.path.getsize(file_path) != sizes[relative_path]):
+                logger.warning(f'Model artifact {name}: size mismatch for {relative_path}')
+                return None
+        if not full:
+            return path
+
+        for relative_path, expected in entry['files'].items():
+            file_path = os.path.realpath(os.path.join(base, relative_path))
+            if not os.path.exists(file_path) or sha256sum(file_path) != expected:
+                logger.warning(f'Model artifact {name}: checksum mismatch for {relative_path}')
+                return None
+        return path
+
+    @classmethod
+    def ensure(cls, name, full=False):
+        """
+        Возвращает путь к проверенному артефакту, при необходимости загружая его.
+        При full=True существующий артефакт сверяется по SHA256.
+        """
+        if name not in cls.ARTIFACTS:
+            raise ValueError(f"Неизвестный артефакт модели: {name}")
+
+        path = cls.verify(name, full)
+        if path:
+            logger.info(f'Model artifact {name} verified: {path}')
+            return path
+
+        if Config.MODEL_OFFLINE:
+            raise ModelUnavailableError(
+                f"Модель {name} не найдена в {cls.models_dir()}, а загрузка запрещена "
+                f"офлайн-режимом. Выполните python -m app.model_manager prebake {name}"
+            )
+
+        with cls._exclusive():
+            # Пока ждали блокировку, артефакт мог загрузить другой процесс
+            path = cls.verify(name, full)
+            if path:
+                logger.info(f'Model artifact {name} verified: {path}')
+                return path
+            logger.info(f'Fetching model artifact {name}...')
+            start_time = time.time()
+            path = getattr(cls, f'_fetch_{name}')()
+        logger.info(f'Model artifact {name} ready in {time.time() - start_time:.1f} seconds: {path}')
+        return path
+
+    @classmethod
+    def _download(cls, url, target_path, expected_sha256=None):
+        """Загружает файл через временный .part, проверяя SHA256 по ходу загрузки"""
+        fd, part_path = tempfile.mkstemp(dir=os.path.dirname(target_path),
+                                         prefix=f'{os.path.basename(target_path)}.', suffix='.part')
+        digest = hashlib.sha256()
+        try:
+            with urllib.request.urlopen(url) as response, os.fdopen(fd, 'wb') as f:
+                for block in iter(lambda: response.read(1024 * 1024), b''):
+                    digest.update(block)
+                    f.write(block)
+            if expected_sha256 and digest.hexdigest() != expected_sha256:
+                raise ModelUnavailableError(f"Контрольная сумма {url} не совпадает с ожидаемой")
+            os.replace(part_path, target_path)
+            return digest.hexdigest()
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+    @classmethod
+    def _fetch_vosk(cls):
+        """Загружает архив Vosk и распаковывает его атомарно"""
+        model_path = os.path.join(cls.models_dir(), cls.MODEL_NAME)
+        os.makedirs(cls.models_dir(), exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=f'.{cls.MODEL_NAME}-', dir=cls.models_dir())
+        try:
+            zip_path = os.path.join(staging, f"{cls.MODEL_NAME}.zip")
+            cls._download(Config.VOSK_MODEL_URL or cls.MODEL_URL, zip_path, Config.VOSK_MODEL_SHA256)
+
+            extract_dir = os.path.join(staging, 'extract')
+            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+                zip_ref.extractall(extract_dir)
+            os.remove(zip_path)
+
+            extracted = os.path.join(extract_dir, cls.MODEL_NAME)
+            if not os.path.isdir(extracted):
+                extracted = extract_dir
+            open(os.path.join(extracted, COMPLETE_MARKER), 'w').close()
+
+            # Каталог модели появляется под своим именем только целиком
+            if os.path.exists(model_path):
+                shutil.rmtree(model_path)
+            os.replace(extracted, model_path)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+        cls._record('vosk', model_path, Config.VOSK_MODEL_URL or cls.MODEL_URL, cls._hash_tree(model_path))
+        return model_path
+
+    @classmethod
+    def whisper_dir(cls):
+        return os.path.join(cls.models_dir(), 'whisper')
+
+    @classmethod
+    def _fetch_whisper(cls):
+        """Загружает чекпоинт Whisper; SHA256 задан в URL официального чекпоинта"""
+        import whisper
+
+        name = Config.WHISPER_MODEL
+        if name not in whisper._MODELS:
+            raise ValueError(f"Неизвестная модель Whisper: {name}")
+        url = whisper._MODELS[name]
+        expected_sha256 = url.split('/')[-2]
+        os.makedirs(cls.whisper_dir(), exist_ok=True)
+        checkpoint_path = os.path.join(cls.whisper_dir(), os.path.basename(url))
+        cls._download(url, checkpoint_path, expected_sha256)
+
+        cls._record('whisper', checkpoint_path, url, {os.path.basename(url): expected_sha256})
+        return checkpoint_path
+
+    @classmethod
+    def ensure_whisper_mmap(cls, full=False):
+        """
+        Возвращает путь к весам Whisper float32 для загрузки через mmap,
+        при необходимости конвертируя проверенный исходный чекпоинт
+        (конвертация выполняется локально и в офлайн-режиме).
+        """
+        path = cls.verify('whisper_mmap', full)
+        if path:
+            return path
+
+        with cls._exclusive():
+            path = cls.verify('whisper_mmap', full)
+            if path:
+                return path
+            source_path = cls.ensure('whisper', full)
+            logger.info(f'Converting Whisper {Config.WHISPER_MODEL} checkpoint for memory-mapped loading...')
+            start_time = time.time()
+            path = os.path.join(cls.whisper_dir(), f'{Config.WHISPER_MODEL}-fp32.pt')
+            convert_whisper_checkpoint(source_path, path)
+            cls._record('whisper_mmap', path, Config.WHISPER_MODEL, cls._hash_tree(path))
+        logger.info(f'Whisper checkpoint converted in {time.time() - start_time:.1f} seconds: {path}')
+        return path
+
+    @classmethod
+    def _fetch_pyannote(cls):
+        """Загружает снимки репозиториев pipeline диаризации в кэш Hugging Face"""
+        from huggingface_hub import snapshot_download
+
+        token = os.getenv('HF_TOKEN')
+        if not token:
+            raise ModelUnavailableError("HF_TOKEN не установлен в переменных окружения")
+
+        files = {}
+        for repo_id in PYANNOTE_REPOS:
+            snapshot = snapshot_download(repo_id, cache_dir=Config.MODEL_CACHE_DIR, token=token)
+            relative = os.path.relpath(snapshot, Config.MODEL_CACHE_DIR)
+            for relative_path, digest in cls._hash_tree(snapshot).items():
+                files[os.path.join(relative, relative_path)] = digest
+
+        cls._record('pyannote', Config.MODEL_CACHE_DIR, ','.join(PYANNOTE_REPOS), files)
+        return Config.MODEL_CACHE_DIR
+
     @classmethod
     def ensure_model_exists(cls):
-        """Проверяет наличие модели и загружает её при необходимости"""
-        model_path = os.path.join(cls.MODEL_DIR, cls.MODEL_NAME)
-        
-        # Если модель уже существует, ничего не делаем
-        if os.path.exists(model_path):
-            print(f"Модель {cls.MODEL_NAME} уже установлена")
-            return model_path
-            
-        print(f"Модель {cls.MODEL_NAME} не найдена. Начинаем загрузку...")
-        
-        # Создаем директорию для моделей если её нет
-        os.makedirs(cls.MODEL_DIR, exist_ok=True)
-        
-        # Загружаем архив с моделью
-        zip_path = os.path.join(cls.MODEL_DIR, f"{cls.MODEL_NAME}.zip")
-        wget.download(cls.MODEL_URL, zip_path)
-        
-        # Распаковываем архив
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(cls.MODEL_DIR)
-            
-        # Удаляем архив
-        os.remove(zip_path)
-        
-        print(f"\nМодель {cls.MODEL_NAME} успешно установлена")
-        return model_path 
\ No newline at end of file
+        """Проверяет наличие модели Vosk и загружает её при необходимости"""
+        return cls.ensure('vosk')
+
+    @classmethod
+    def prebake(cls, names=None):
+        """Загружает артефакты заранее (при сборке образа), сверяя имеющиеся по SHA256"""
+        paths = {}
+        for name in names or ('whisper', 'pyannote'):
+            paths[name] = cls.ensure_whisper_mmap(full=True) if name == 'whisper_mmap' else cls.ensure(name, full=True)
+        return paths
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    usage = ("Использование: python -m app.model_manager prebake|verify "
+             "[vosk] [whisper] [whisper_mmap] [pyannote]")
+    if len(sys.argv) < 2 or sys.argv[1] not in ('prebake', 'verify'):
+        print(usage)
+        sys.exit(1)
+
+    names = sys.argv[2:] or ['whisper', 'pyannote']
+    if sys.argv[1] == 'prebake':
+        for artifact, artifact_path in ModelManager.prebake(names).items():
+            print(f"{artifact}: {artifact_path}")
+    else:
+        failed = [name for name in names if not ModelManager.verify(name, full=True)]
+        for name in names:
+            print(f"{name}: {'повреждена или отсутствует' if name in failed else 'OK'}")
+        sys.exit(1 if failed else 0)
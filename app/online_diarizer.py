@@ -0,0 +1,205 @@
+import logging
+import numpy as np
+from .config import Config
+from .audio_processor import SAMPLE_RATE
+from .speaker_store import _normalize
+
+logger = logging.getLogger(__name__)
+
+
+def pcm16_to_float(data, sample_rate=SAMPLE_RATE):
+    """
+    Преобразует кадр PCM 16 бит моно в float32 с частотой SAMPLE_RATE
+    (линейная интерполяция, для телефонных 8 кГц этого достаточно)
+    """
+    samples = np.frombuffer(data, dtype='<i2').astype(np.float32) / 32768.0
+    if sample_rate == SAMPLE_RATE or samples.size == 0:
+        return samples
+    count = int(round(samples.size * SAMPLE_RATE / sample_rate))
+    positions = np.arange(count, dtype=np.float64) * sample_rate / SAMPLE_RATE
+    return np.interp(positions, np.arange(samples.size), samples).astype(np.float32)
+
+
+def _default_embed_fn():
+    """Эмбеддинги из модели pipeline диаризации (модели загружаются один раз)"""
+    from .speaker_recognizer import SpeakerRecognizer
+    return SpeakerRecognizer().embed
+
+
+class OnlineDiarizer:
+    """
+    Инкрементальная диаризация для потоков и предварительного результата
+    длинных записей.
+
+    Аудио принимается порциями. Каждые step_seconds берется окно последних
+    window_seconds, для него вычисляется эмбеддинг, и шаг присваивается
+    ближайшему по косинусному сходству текущему центроиду (центроид
+    обновляется как скользящее среднее) или новому спикеру. Метки
+    предварительные: полная диаризация по всей записи может их уточнить.
+    """
+
+    def __init__(self, embed_fn=None, window_seconds=None, step_seconds=None,
+                 threshold=None, max_speakers=None, min_rms=None,
+                 speaker_store=None, known_speakers=None):
+        """
+        Args:
+            embed_fn: функция (моно float32 массив SAMPLE_RATE) -> вектор;
+                по умолчанию модель эмбеддингов pipeline pyannote
+            window_seconds: длина окна для эмбеддинга
+            step_seconds: шаг, с которым выдаются метки
+            threshold: минимальное косинусное сходство с центроидом
+            max_speakers: предел числа спикеров (дальше - ближайший центроид)
+            min_rms: окна тише этого уровня считаются паузой и не размечаются
+            speaker_store: SpeakerStore для присвоения имен известных спикеров
+            known_speakers: имена, среди которых искать в speaker_store
+        """
+        self._embed_fn = embed_fn
+        self.window_seconds = window_seconds or Config.ONLINE_DIARIZATION_WINDOW
+        self.step_seconds = step_seconds or Config.ONLINE_DIARIZATION_STEP
+        self.threshold = Config.ONLINE_DIARIZATION_THRESHOLD if threshold is None else threshold
+        self.max_speakers = max_speakers or Config.ONLINE_DIARIZATION_MAX_SPEAKERS
+        self.min_rms = Config.ONLINE_DIARIZATION_MIN_RMS if min_rms is None else min_rms
+        self.speaker_store = speaker_store
+        self.known_speakers = known_speakers
+
+        self._window = int(self.window_seconds * SAMPLE_RATE)
+        self._step = int(self.step_seconds * SAMPLE_RATE)
+        self._buffer = np.zeros(0, dtype=np.float32)
+        # Абсолютный номер первого отсчета буфера и конец размеченной части
+        self._buffer_start = 0
+        self._processed = 0
+        self._centroids = []
+        self._counts = []
+        self._labels = []
+        self.turns = []
+
+    @property
+    def duration(self):
+        """Длительность принятого аудио в секундах"""
+        return (self._buffer_start + len(self._buffer)) / SAMPLE_RATE
+
+    def accept(self, samples):
+        """
+        Принимает очередную порцию аудио (моно float32, SAMPLE_RATE).
+
+        Returns:
+            список новых предварительных реплик {'start', 'end', 'speaker'}
+        """
+        self._buffer = np.concatenate([self._buffer, np.asarray(samples, dtype=np.float32)])
+        total = self._buffer_start + len(self._buffer)
+        new_turns = []
+        while self._processed + self._step <= total:
+            turn = self._label_step(self._processed, self._processed + self._step)
+            if turn is not None:
+                new_turns.append(turn)
+            self._processed += self._step
+
+        # В буфере достаточно хвоста длиной в окно
+        keep_from = max(self._buffer_start, self._processed - self._window)
+        if keep_from > self._buffer_start:
+            self._buffer = self._buffer[keep_from - self._buffer_start:]
+            self._buffer_start = keep_from
+        return new_turns
+
+    def flush(self):
+        """Размечает остаток аудио короче шага (конец потока)"""
+        total = self._buffer_start + len(self._buffer)
+        if total <= self._processed:
+            return []
+        turn = self._label_step(self._processed, total)
+        self._processed = total
+        return [turn] if turn is not None else []
+
+    def _label_step(self, step_start, step_end):
+        """Присваивает спикера шагу [step_start, step_end) (в отсчетах)"""
+        step = self._buffer[step_start - self._buffer_start:step_end - self._buffer_start]
+        if step.size == 0 or float(np.sqrt(np.mean(step ** 2))) < self.min_rms:
+            return None
+
+        window_start = max(self._buffer_start, step_end - self._window)
+        window = self._buffer[window_start - self._buffer_start:step_end - self._buffer_start]
+        if self._embed_fn is None:
+            self._embed_fn = _default_embed_fn()
+        embedding = _normalize(self._embed_fn(window))[0]
+        if not np.all(np.isfinite(embedding)):
+            return None
+
+        index = self._assign(embedding)
+        turn = {
+            'start': round(step_start / SAMPLE_RATE, 3),
+            'end': round(step_end / SAMPLE_RATE, 3),
+            'speaker': self._labels[index]
+        }
+        # Соседние шаги одного спикера объединяются в одну реплику
+        last = self.turns[-1] if self.turns else None
+        if last is not None and last['speaker'] == turn['speaker'] and last['end'] == turn['start']:
+            last['end'] = turn['end']
+        else:
+            self.turns.append(dict(turn))
+        return turn
+
+    def _assign(self, embedding):
+        """Возвращает индекс спикера для эмбеддинга, обновляя центроиды"""
+        if self._centroids:
+            scores = np.stack(self._centroids) @ embedding
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold or len(self._centroids) >= self.max_speakers:
+                count = self._counts[best]
+                self._centroids[best] = _normalize(self._centroids[best] * count + embedding)[0]
+                self._counts[best] = count + 1
+                self._rename(best)
+                return best
+
+        self._centroids.append(embedding)
+        self._counts.append(1)
+        self._labels.append(f'SPEAKER_{len(self._labels)}')
+        logger.info(f'Online diarization: new speaker {self._labels[-1]} at {self.duration:.1f}s')
+        self._rename(len(self._labels) - 1)
+        return len(self._labels) - 1
+
+    def _rename(self, index):
+        """Присваивает спикеру имя из хранилища, если центроид с ним совпал"""
+        if self.speaker_store is None or not self._labels[index].startswith('SPEAKER_'):
+            return
+        taken = set(label for label in self._labels if not label.startswith('SPEAKER_'))
+        candidates = [name for name in (self.known_speakers or self.speaker_store.names())
+                      if name not in taken]
+        if not candidates:
+            return
+        name, score = self.speaker_store.match(self._centroids[index][None], candidates=candidates)[0]
+        if name is not None:
+            logger.info(f'Online diarization: {self._labels[index]} identified as '
+                        f"'{name}' (similarity {score:.2f})")
+            self._labels[index] = name
+
+    def speaker_at(self, start, end):
+        """Спикер с наибольшим перекрытием интервала [start, end) в секундах"""
+        overlaps = {}
+        for turn in self.turns:
+            overlap = min(end, turn['end']) - max(start, turn['start'])
+            if overlap > 0:
+                overlaps[turn['speaker']] = overlaps.get(turn['speaker'], 0.0) + overlap
+        if not overlaps:
+            return None
+        return max(overlaps, key=overlaps.get)
+
+    def centroids(self):
+        """Текущие центроиды спикеров {метка: вектор}"""
+        return {label: centroid for label, centroid in zip(self._labels, self._centroids)}
+
+
+def diarize_incrementally(waveform, diarizer=None, chunk_seconds=30.0, should_stop=None):
+    """
+    Прогоняет уже декодированную запись через OnlineDiarizer порциями,
+    выдавая накопленные реплики после каждой порции. Используется для
+    предварительной разметки длинных файлов до окончания полной диаризации.
+    """
+    diarizer = diarizer or OnlineDiarizer()
+    chunk = max(1, int(chunk_seconds * SAMPLE_RATE))
+    for offset in range(0, len(waveform), chunk):
+        if should_stop is not None and should_stop():
+            return
+        diarizer.accept(waveform[offset:offset + chunk])
+        yield [dict(turn) for turn in diarizer.turns]
+    diarizer.flush()
+    yield [dict(turn) for turn in diarizer.turns]
@@ -0,0 +1,80 @@
+import os
+import gzip
+import shutil
+import logging
+from .config import Config
+
+try:
+    import zstandard
+except ImportError:  # zstd-вариант создается, только если установлен zstandard
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Сжатые варианты результата в порядке предпочтения: (Content-Encoding, суффикс)
+ENCODINGS = (('zstd', '.zst'), ('gzip', '.gz'))
+
+
+def variant_path(path, encoding):
+    """Путь к сжатому варианту файла результата"""
+    return path + dict(ENCODINGS)[encoding]
+
+
+def _available_encodings():
+    return [encoding for encoding, _ in ENCODINGS if encoding != 'zstd' or zstandard is not None]
+
+
+def write_compressed_variants(path):
+    """
+    Сохраняет рядом с результатом сжатые копии (.gz и, если доступен
+    zstandard, .zst), чтобы повторные скачивания не сжимали файл заново.
+
+    Варианты пишутся во временный файл и переименовываются, получают mtime
+    оригинала и удаляются очисткой диска вместе с ним. Возвращает список
+    созданных кодировок.
+    """
+    if not Config.RESULT_COMPRESSION or os.path.getsize(path) < Config.RESULT_COMPRESSION_MIN_BYTES:
+        return []
+
+    created = []
+    stat = os.stat(path)
+    for encoding in _available_encodings():
+        target = variant_path(path, encoding)
+        temp_path = f'{target}.tmp-{os.getpid()}'
+        try:
+            with open(path, 'rb') as source, open(temp_path, 'wb') as raw:
+                if encoding == 'zstd':
+                    with zstandard.ZstdCompressor(level=10).stream_writer(raw, closefd=False) as compressed:
+                        shutil.copyfileobj(source, compressed)
+                else:
+                    # mtime=0: одинаковое содержимое дает одинаковые байты
+                    with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=9, mtime=0) as compressed:
+                        shutil.copyfileobj(source, compressed)
+            os.utime(temp_path, (stat.st_atime, stat.st_mtime))
+            os.replace(temp_path, target)
+            created.append(encoding)
+        except OSError as e:
+            logger.warning(f'Failed to write {encoding} variant of {path}: {str(e)}')
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    return created
+
+
+def select_variant(path, accept_encodings):
+    """
+    Выбирает файл для отдачи по заголовку Accept-Encoding клиента.
+
+    Возвращает (путь, кодировка); кодировка None означает исходный файл.
+    Вариант старше оригинала (файл перезаписан) не используется.
+    """
+    mtime = os.path.getmtime(path)
+    for encoding in _available_encodings():
+        if not accept_encodings[encoding]:
+            continue
+        candidate = variant_path(path, encoding)
+        try:
+            if os.path.getmtime(candidate) >= mtime:
+                return candidate, encoding
+        except OSError:
+            continue
+    return path, None
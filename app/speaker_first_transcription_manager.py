@@ -1,27 +1,95 @@
 from .speech_recognizer import SpeechRecognizer
 from .speaker_recognizer import SpeakerRecognizer
-from .audio_processor import AudioProcessor
+from .audio_processor import AudioProcessor, SAMPLE_RATE
+from .config import Config
+from .speaker_store import save_job_embeddings
 import logging
 import os
-import soundfile as sf
-import tempfile
-import shutil
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
+# Длина окна Whisper: сегменты не длиннее декодируются одним окном
+MAX_WINDOW_SECONDS = 30
+
+# Число потоков torch задается для процесса один раз (см. configure_torch_threads)
+_torch_threads_lock = threading.Lock()
+_torch_threads = None
+
+
+def configure_torch_threads():
+    """
+    Задает число потоков torch для процесса по ASR_PARALLEL_WORKERS и
+    возвращает его.
+
+    Настройка torch общая для всего процесса, поэтому она не меняется от
+    задачи к задаче: при ASR_PARALLEL_WORKERS > 1 каждый поток распознавания
+    получает cores / ASR_PARALLEL_WORKERS потоков torch, и столько же
+    получает задача, распознающая сегменты последовательно (например,
+    короткая запись). Иначе значение torch по умолчанию не меняется.
+    """
+    global _torch_threads
+    with _torch_threads_lock:
+        if _torch_threads is None:
+            import torch
+            if Config.ASR_PARALLEL_WORKERS > 1:
+                torch.set_num_threads(max(1, (os.cpu_count() or 1) // Config.ASR_PARALLEL_WORKERS))
+            _torch_threads = torch.get_num_threads()
+        return _torch_threads
+
+
 class SpeakerFirstTranscriptionManager:
     def __init__(self):
+        configure_torch_threads()
         self.speech_recognizer = SpeechRecognizer()
         self.speaker_recognizer = SpeakerRecognizer()
         self.audio_processor = AudioProcessor()
     
-    def process_audio(self, audio_path, progress_callback=None):
+    def process_audio(self, audio, progress_callback=None, language=None,
+                      known_speakers=None, embeddings_path=None, speaker_hints=None,
+                      profile=None, stats=None, details=None):
         """
         Обрабатывает аудио в новом порядке:
         1. Определяет сегменты спикеров
         2. Транскрибирует каждый сегмент отдельно
         3. Объединяет результаты с точными таймингами
+
+        Args:
+            audio: путь к аудио файлу или уже декодированный моно float32
+                массив с частотой SAMPLE_RATE
+            language: код языка для всей задачи, 'auto' для однократного
+                автоопределения или None для значения из конфигурации
+            known_speakers: имена зарегистрированных спикеров, участвующих в записи
+            embeddings_path: путь для сохранения эмбеддингов спикеров задачи
+                (для последующей регистрации спикеров по имени)
+            speaker_hints: подсказки о числе спикеров для диаризации
+            profile: профиль декодирования Whisper (DECODE_PROFILES)
+            stats: DecodeStats для учета проходов декодирования задачи; в
+                stats.language записывается язык, с которым распознана запись
+            details: список, в который добавляются сегменты спикеров с
+                сегментами Whisper и их оценками в поле asr (структурированный
+                результат для контроля качества)
+
+        Аудио декодируется один раз и используется и для диаризации, и для
+        распознавания: сегменты - срезы общего массива, временные файлы не
+        создаются. Метод реентерабелен: все состояние задачи локально, поэтому
+        несколько задач могут обрабатываться одновременно.
         """
+        if isinstance(audio, np.ndarray):
+            waveform = audio
+        else:
+            waveform = self.audio_processor.load_audio(audio)
+        return self._process_audio(
+            waveform, progress_callback, language, known_speakers, embeddings_path, speaker_hints,
+            profile, stats, details
+        )
+
+    def _process_audio(self, waveform, progress_callback, language,
+                       known_speakers, embeddings_path, speaker_hints, profile=None, stats=None,
+                       details=None):
+        """Основной конвейер обработки (см. process_audio)"""
         try:
             def update_progress(progress, message=""):
                 if progress_callback:
@@ -41,10 +109,19 @@ class SpeakerFirstTranscriptionManager:
                 scaled_progress = 5 + (progress * 0.15)  # 15% от общего прогресса
                 update_progress(scaled_progress, f"Диаризация: {progress:.0f}%")
             
-            speaker_segments = self.speaker_recognizer.recognize_speakers(audio_path, speaker_progress_callback)
+            speaker_segments, speaker_embeddings = self.speaker_recognizer.recognize_speakers(
+                waveform,
+                speaker_progress_callback,
+                known_speakers=known_speakers,
+                return_embeddings=True,
+                speaker_hints=speaker_hints
+            )
+            if embeddings_path and speaker_embeddings:
+                save_job_embeddings(embeddings_path, speaker_embeddings)
             if not speaker_segments:
                 logger.warning("No speaker segments found, falling back to full transcription")
-                return self._fallback_full_transcription(audio_path, progress_callback)
+                return self._fallback_full_transcription(waveform, progress_callback, language,
+                                                         profile, stats, details)
             
             logger.info(f"Found {len(speaker_segments)} speaker segments")
             update_progress(20, f"Найдено {len(speaker_segments)} сегментов спикеров")
@@ -53,47 +130,31 @@ class SpeakerFirstTranscriptionManager:
             logger.info("Step 2: Transcribing individual segments")
             update_progress(25, "Транскрибируем сегменты")
             
-            transcribed_segments = []
             total_segments = len(speaker_segments)
-            
-            for i, segment in enumerate(speaker_segments):
-                segment_progress = 25 + (i / total_segments) * 70  # от 25% до 95%
-                update_progress(segment_progress, f"Сегмент {i+1}/{total_segments}")
-                
-                try:
-                    # Извлекаем сегмент аудио
-                    segment_audio_path = self._extract_audio_segment(
-                        audio_path, 
-                        segment['start'], 
-                        segment['end']
-                    )
-                    
-                    # Транскрибируем сегмент
-                    segment_text = self.speech_recognizer.recognize(segment_audio_path)
-                    
-                    # Очищаем временный файл
-                    if os.path.exists(segment_audio_path):
-                        os.remove(segment_audio_path)
-                    
-                    # Добавляем результат
-                    transcribed_segments.append({
-                        'speaker': segment['speaker'],
-                        'start': segment['start'],
-                        'end': segment['end'],
-                        'text': segment_text.strip()
-                    })
-                    
-                    logger.info(f"Segment {i+1}: {segment['speaker']} ({segment['start']:.2f}s - {segment['end']:.2f}s) - {len(segment_text)} chars")
-                    
-                except Exception as e:
-                    logger.error(f"Error processing segment {i+1}: {str(e)}")
-                    # Добавляем пустой сегмент в случае ошибки
-                    transcribed_segments.append({
-                        'speaker': segment['speaker'],
-                        'start': segment['start'],
-                        'end': segment['end'],
-                        'text': "[Ошибка транскрибации]"
-                    })
+
+            # Спектрограмма считается один раз, сегменты берут из нее срезы
+            mel_cache = self.speech_recognizer.compute_mel(waveform) if Config.WHISPER_SHARED_MEL else None
+
+            # Параметры декодирования и контекст общие для всех сегментов задачи
+            language = self._resolve_language(waveform, language, speaker_segments[0]['start'], mel_cache)
+            if stats is not None:
+                stats.language = language
+            decode_options = self.speech_recognizer.build_decode_options(language, profile)
+
+            def segment_done(completed):
+                segment_progress = 25 + (completed / total_segments) * 70  # от 25% до 95%
+                update_progress(segment_progress, f"Сегмент {completed}/{total_segments}")
+
+            transcribed_segments = self.transcribe_segments(
+                waveform,
+                speaker_segments,
+                decode_options,
+                progress_callback=segment_done,
+                mel_cache=mel_cache,
+                stats=stats
+            )
+            if details is not None:
+                details.extend(transcribed_segments)
 
             # Шаг 3: Форматируем результат (5% прогресса)
             logger.info("Step 3: Formatting results")
@@ -110,25 +171,174 @@ class SpeakerFirstTranscriptionManager:
             logger.error(f"Error in speaker-first transcription: {str(e)}", exc_info=True)
             raise
     
-    def _extract_audio_segment(self, audio_path, start_time, end_time):
+    def transcribe_segments(self, waveform, segments, decode_options,
+                            workers=None, progress_callback=None, mel_cache=None, stats=None):
         """
-        Извлекает сегмент аудио из основного файла
+        Транскрибирует сегменты (срезы waveform) и возвращает результаты в
+        исходном порядке.
+
+        При workers > 1 сегменты делятся на непрерывные серии примерно равной
+        длительности, серии обрабатываются пулом потоков, каждый поток
+        использует свою реплику модели и число потоков torch, заданное для
+        процесса configure_torch_threads(). Внутри
+        серии контекст предыдущего сегмента передается как и при
+        последовательной обработке.
+
+        Args:
+            workers: число параллельных потоков (по умолчанию ASR_PARALLEL_WORKERS)
+            progress_callback: вызывается с числом обработанных сегментов
+            mel_cache: спектрограмма записи (MelCache); сегменты до 30 секунд
+                декодируются по ее срезам без повторного вычисления признаков
+            stats: DecodeStats для учета проходов декодирования
         """
-        try:
-            # Создаем временный файл для сегмента
-            temp_dir = tempfile.gettempdir()
-            segment_filename = f"segment_{start_time:.2f}_{end_time:.2f}.wav"
-            segment_path = os.path.join(temp_dir, segment_filename)
-            
-            # Извлекаем сегмент с помощью ffmpeg
-            duration = end_time - start_time
-            self.audio_processor.extract_segment(audio_path, segment_path, start_time, duration)
-            
-            return segment_path
-            
-        except Exception as e:
-            logger.error(f"Error extracting audio segment: {str(e)}")
-            raise
+        workers = max(1, min(workers or Config.ASR_PARALLEL_WORKERS, len(segments)))
+        completed = [0]
+        completed_lock = threading.Lock()
+
+        def on_segment_done():
+            with completed_lock:
+                completed[0] += 1
+                done = completed[0]
+            if progress_callback:
+                progress_callback(done)
+
+        def transcribe_run(run):
+            return self._transcribe_run(waveform, run, decode_options, on_segment_done, mel_cache, stats)
+
+        threads = configure_torch_threads()
+        if workers == 1:
+            return transcribe_run(list(enumerate(segments)))
+
+        runs = self._split_runs(segments, workers * Config.ASR_RUNS_PER_WORKER)
+        logger.info(f"Transcribing {len(segments)} segments in {len(runs)} runs "
+                    f"with {workers} workers x {threads} torch threads")
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(transcribe_run, runs))
+        return [segment for run in results for segment in run]
+
+    @staticmethod
+    def _offset_details(asr, start, end):
+        """Переводит времена сегментов Whisper из отсчета фрагмента в отсчет записи"""
+        for entry in asr:
+            entry['start'] = round(start + (entry['start'] or 0.0), 3)
+            entry['end'] = round(min(end, start + entry['end']) if entry['end'] is not None else end, 3)
+        return asr
+
+    @staticmethod
+    def _split_runs(segments, count):
+        """Делит сегменты на count непрерывных серий примерно равной длительности"""
+        total = sum(segment['end'] - segment['start'] for segment in segments) or 1.0
+        target = total / count
+        runs, current, duration = [], [], 0.0
+        for i, segment in enumerate(segments):
+            current.append((i, segment))
+            duration += segment['end'] - segment['start']
+            if duration >= target and len(runs) < count - 1:
+                runs.append(current)
+                current, duration = [], 0.0
+        if current:
+            runs.append(current)
+        return runs
+
+    def _transcribe_run(self, waveform, run, decode_options, on_segment_done, mel_cache=None, stats=None):
+        """Последовательно транскрибирует серию сегментов [(номер, сегмент)] с переносом контекста"""
+        transcribed_segments = []
+        previous_text = ""
+
+        for i, segment in run:
+            asr = []
+            try:
+                # Транскрибируем сегмент, передавая хвост предыдущего текста как контекст
+                # (если профиль декодирования не отключает condition_on_previous_text)
+                initial_prompt = None
+                if decode_options.get('condition_on_previous_text', True):
+                    initial_prompt = self._build_prompt(previous_text)
+                if mel_cache is not None and segment['end'] - segment['start'] <= MAX_WINDOW_SECONDS:
+                    segment_text = self.speech_recognizer.decode_segment(
+                        mel_cache.segment(segment['start'], segment['end']),
+                        initial_prompt=initial_prompt,
+                        decode_options=decode_options,
+                        stats=stats,
+                        details=asr
+                    )
+                else:
+                    segment_text = self.speech_recognizer.recognize(
+                        self._slice(waveform, segment['start'], segment['end']),
+                        initial_prompt=initial_prompt,
+                        decode_options=decode_options,
+                        stats=stats,
+                        details=asr
+                    )
+                
+                # Добавляем результат
+                transcribed_segments.append({
+                    'speaker': segment['speaker'],
+                    'start': segment['start'],
+                    'end': segment['end'],
+                    'text': segment_text.strip(),
+                    'asr': self._offset_details(asr, segment['start'], segment['end'])
+                })
+                if segment_text.strip():
+                    previous_text = segment_text
+                
+                logger.info(f"Segment {i+1}: {segment['speaker']} ({segment['start']:.2f}s - {segment['end']:.2f}s) - {len(segment_text)} chars")
+                
+            except Exception as e:
+                logger.error(f"Error processing segment {i+1}: {str(e)}")
+                # Добавляем пустой сегмент в случае ошибки
+                transcribed_segments.append({
+                    'speaker': segment['speaker'],
+                    'start': segment['start'],
+                    'end': segment['end'],
+                    'text': "[Ошибка транскрибации]",
+                    'asr': []
+                })
+            finally:
+                on_segment_done()
+
+        return transcribed_segments
+
+    def _resolve_language(self, waveform, language, speech_start=0.0, mel_cache=None):
+        """
+        Возвращает язык задачи. При 'auto' язык определяется один раз по
+        первым секундам речи и затем используется для всех сегментов.
+        """
+        language = language or Config.WHISPER_LANGUAGE
+        if language != 'auto':
+            return language
+
+        speech_end = speech_start + min(Config.LANGUAGE_DETECTION_SECONDS, MAX_WINDOW_SECONDS)
+        if mel_cache is not None:
+            return self.speech_recognizer.detect_language(
+                None, mel=mel_cache.segment(speech_start, speech_end)
+            )
+        return self.speech_recognizer.detect_language(self._slice(waveform, speech_start, speech_end))
+
+    def _build_prompt(self, previous_text):
+        """
+        Формирует initial_prompt из хвоста предыдущего сегмента
+        """
+        if not Config.WHISPER_CONTEXT_CARRYOVER or not previous_text:
+            return None
+
+        # Убираем тайм-коды вида [HH:MM:SS], чтобы они не попадали в подсказку
+        lines = [line[11:].strip() if line.startswith('[') else line.strip()
+                 for line in previous_text.split('\n')]
+        text = ' '.join(line for line in lines if line)
+        if not text:
+            return None
+
+        tail = text[-Config.WHISPER_PROMPT_CHARS:]
+        # Не обрезаем слово посередине
+        if len(text) > Config.WHISPER_PROMPT_CHARS and ' ' in tail:
+            tail = tail.split(' ', 1)[1]
+        return tail
+
+    @staticmethod
+    def _slice(waveform, start_time, end_time):
+        """Возвращает фрагмент общего массива аудио без копирования"""
+        return waveform[int(start_time * SAMPLE_RATE):int(end_time * SAMPLE_RATE)]
     
     def _format_results(self, transcribed_segments):
         """
@@ -166,7 +376,8 @@ class SpeakerFirstTranscriptionManager:
         import datetime
         return datetime.datetime.utcfromtimestamp(seconds).strftime('[%H:%M:%S]')
     
-    def _fallback_full_transcription(self, audio_path, progress_callback):
+    def _fallback_full_transcription(self, waveform, progress_callback, language=None,
+                                     profile=None, stats=None, details=None):
         """
         Fallback к полной транскрибации если не удалось определить спикеров
         """
@@ -175,7 +386,21 @@ class SpeakerFirstTranscriptionManager:
             progress_callback(50)
         
         # Используем обычную транскрибацию
-        text = self.speech_recognizer.recognize(audio_path, progress_callback)
+        language = self._resolve_language(waveform, language)
+        if stats is not None:
+            stats.language = language
+        asr = []
+        text = self.speech_recognizer.recognize(
+            waveform,
+            progress_callback,
+            decode_options=self.speech_recognizer.build_decode_options(language, profile),
+            stats=stats,
+            details=asr
+        )
+        if details is not None:
+            duration = len(waveform) / SAMPLE_RATE
+            details.append({'speaker': None, 'start': 0.0, 'end': duration, 'text': text,
+                            'asr': self._offset_details(asr, 0.0, duration)})
         
         if progress_callback:
             progress_callback(100)
@@ -1,11 +1,19 @@
+# Config импортируется первым: он задает кэш и офлайн-режим Hugging Face
+from .config import Config
 from pyannote.audio import Pipeline
 import torch
 import os
 import logging
 import time
-import soundfile as sf
+import numpy as np
+import queue
+import inspect
+import threading
 from dotenv import load_dotenv
 from huggingface_hub import login, HfApi
+from .speaker_store import SpeakerStore
+from .audio_processor import SAMPLE_RATE
+from .model_manager import ModelManager
 
 # Загружаем переменные окружения явно
 load_dotenv()
@@ -14,14 +22,22 @@ logger = logging.getLogger(__name__)
 
 class SpeakerRecognizer:
     _instance = None
+    _init_lock = threading.RLock()
     _pipeline = None
+    _pipeline_lock = threading.Lock()
     
     def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super(SpeakerRecognizer, cls).__new__(cls)
+        with cls._init_lock:
+            if cls._instance is None:
+                cls._instance = super(SpeakerRecognizer, cls).__new__(cls)
         return cls._instance
     
     def __init__(self):
+        # Одновременное создание из нескольких потоков не должно загружать модель дважды
+        with self._init_lock:
+            self._initialize()
+
+    def _initialize(self):
         if hasattr(self, 'initialized'):
             return
             
@@ -31,34 +47,19 @@ class SpeakerRecognizer:
         logger.info(f"Speaker recognizer using device: {self.device}")
         
         self.hf_token = os.getenv('HF_TOKEN')
-        if not self.hf_token:
+        if not self.hf_token and not Config.MODEL_OFFLINE:
             logger.error("HF_TOKEN не установлен в переменных окружения")
             raise ValueError("HF_TOKEN не установлен в переменных окружения")
             
-        logger.info("Logging in to Hugging Face...")
         try:
-            # Явная авторизация в Hugging Face
-            login(token=self.hf_token)
-            logger.info("Successfully logged in to Hugging Face")
-            
-            # Проверяем доступ к необходимым моделям
-            api = HfApi()
-            models_to_check = [
-                "pyannote/speaker-diarization",
-                "pyannote/segmentation",
-                "pyannote/embedding"
-            ]
-            
-            for model in models_to_check:
-                try:
-                    api.model_info(model)
-                    logger.info(f"Access confirmed for {model}")
-                except Exception as e:
-                    logger.error(f"No access to {model}. Please visit https://huggingface.co/{model} "
-                               f"and accept the user conditions.")
-                    raise ValueError(f"Нет доступа к модели {model}. Необходимо принять условия "
-                                  f"использования на https://huggingface.co/{model}")
-            
+            if Config.MODEL_OFFLINE:
+                logger.info("Offline mode: using pre-baked pyannote models")
+            else:
+                self._check_hf_access()
+
+            # Проверенные по манифесту модели из локального кэша
+            ModelManager.ensure('pyannote')
+
             if SpeakerRecognizer._pipeline is None:
                 logger.info("Initializing speaker recognition pipeline...")
                 
@@ -68,7 +69,8 @@ class SpeakerRecognizer:
                 
                 SpeakerRecognizer._pipeline = Pipeline.from_pretrained(
                     "pyannote/speaker-diarization",
-                    use_auth_token=self.hf_token
+                    use_auth_token=self.hf_token,
+                    cache_dir=Config.MODEL_CACHE_DIR
                 )
                 
                 # Явно переносим на CPU
@@ -88,29 +90,130 @@ class SpeakerRecognizer:
                     logger.info("Pipeline device: CPU (assumed)")
             
             self.pipeline = SpeakerRecognizer._pipeline
+            self.supports_embeddings = self._supports_embeddings(self.pipeline)
+            self.speaker_store = SpeakerStore()
             logger.info("Speaker recognition initialized successfully")
             
         except Exception as e:
             logger.error(f"Failed to initialize pipeline: {str(e)}", exc_info=True)
             raise
         
-    def recognize_speakers(self, audio_path, progress_callback=None):
-        """Распознает спикеров в аудиофайле"""
+    @staticmethod
+    def _supports_embeddings(pipeline):
+        """Умеет ли pipeline возвращать эмбеддинги спикеров (старые версии не умеют)"""
         try:
-            logger.info(f"Starting speaker recognition for {audio_path}")
-            
-            # Проверяем существование файла
-            if not os.path.exists(audio_path):
-                logger.error(f"Audio file not found: {audio_path}")
-                return []
-                
-            # Проверяем размер файла
-            file_size = os.path.getsize(audio_path)
-            logger.info(f"Audio file size: {file_size} bytes")
-            
-            if file_size == 0:
-                logger.error("Audio file is empty")
-                return []
+            return 'return_embeddings' in inspect.signature(pipeline.apply).parameters
+        except (AttributeError, TypeError, ValueError):
+            return False
+
+    def _check_hf_access(self):
+        """Авторизуется в Hugging Face и проверяет доступ к моделям pyannote"""
+        logger.info("Logging in to Hugging Face...")
+        # Явная авторизация в Hugging Face
+        login(token=self.hf_token)
+        logger.info("Successfully logged in to Hugging Face")
+        
+        # Проверяем доступ к необходимым моделям
+        api = HfApi()
+        models_to_check = [
+            "pyannote/speaker-diarization",
+            "pyannote/segmentation",
+            "pyannote/embedding"
+        ]
+        
+        for model in models_to_check:
+            try:
+                api.model_info(model)
+                logger.info(f"Access confirmed for {model}")
+            except Exception as e:
+                logger.error(f"No access to {model}. Please visit https://huggingface.co/{model} "
+                           f"and accept the user conditions.")
+                raise ValueError(f"Нет доступа к модели {model}. Необходимо принять условия "
+                              f"использования на https://huggingface.co/{model}")
+
+    @staticmethod
+    def build_speaker_hints(num_speakers=None, min_speakers=None, max_speakers=None):
+        """
+        Формирует подсказки о числе спикеров для pipeline.
+
+        Незаданные значения берутся из конфигурации; точное число спикеров
+        имеет приоритет над диапазоном. Некорректные значения вызывают ValueError.
+        """
+        hints = {}
+        if num_speakers is None and min_speakers is None and max_speakers is None:
+            num_speakers = Config.DEFAULT_NUM_SPEAKERS
+            min_speakers = Config.DEFAULT_MIN_SPEAKERS
+            max_speakers = Config.DEFAULT_MAX_SPEAKERS
+
+        for key, value in (('num_speakers', num_speakers),
+                           ('min_speakers', min_speakers),
+                           ('max_speakers', max_speakers)):
+            if value is None:
+                continue
+            if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+                raise ValueError(f"{key} должно быть целым числом не меньше 1")
+            hints[key] = value
+
+        if 'num_speakers' in hints:
+            return {'num_speakers': hints['num_speakers']}
+        if ('min_speakers' in hints and 'max_speakers' in hints
+                and hints['min_speakers'] > hints['max_speakers']):
+            raise ValueError("min_speakers не может быть больше max_speakers")
+        return hints
+
+    def recognize_speakers(self, audio, progress_callback=None, known_speakers=None,
+                           return_embeddings=False, speaker_hints=None):
+        """
+        Распознает спикеров в аудио
+
+        Args:
+            audio: путь к аудио файлу или уже декодированный моно float32
+                массив с частотой SAMPLE_RATE (pipeline не читает файл повторно)
+            progress_callback: функция обратного вызова для прогресса
+            known_speakers: список имен зарегистрированных спикеров, участвующих
+                в записи. Если все они есть в хранилище, число кластеров
+                фиксируется и метки назначаются только среди этих имен.
+            return_embeddings: вернуть также эмбеддинги спикеров {метка: вектор}
+            speaker_hints: num_speakers/min_speakers/max_speakers из
+                build_speaker_hints(), ограничивающие перебор при кластеризации
+        """
+        speakers, embeddings = self._recognize_speakers(
+            audio, progress_callback, known_speakers, speaker_hints
+        )
+        if return_embeddings:
+            return speakers, embeddings
+        return speakers
+
+    def _recognize_speakers(self, audio, progress_callback=None, known_speakers=None,
+                            speaker_hints=None):
+        """Выполняет диаризацию, возвращает (сегменты, эмбеддинги спикеров)"""
+        try:
+            if isinstance(audio, np.ndarray):
+                logger.info(f"Starting speaker recognition for {len(audio) / SAMPLE_RATE:.2f}s waveform")
+                if audio.size == 0:
+                    logger.error("Audio waveform is empty")
+                    return [], {}
+                # pyannote принимает уже декодированное аудио в виде тензора (каналы, отсчеты)
+                pipeline_input = {
+                    'waveform': torch.from_numpy(audio).unsqueeze(0),
+                    'sample_rate': SAMPLE_RATE
+                }
+            else:
+                logger.info(f"Starting speaker recognition for {audio}")
+
+                # Проверяем существование файла
+                if not os.path.exists(audio):
+                    logger.error(f"Audio file not found: {audio}")
+                    return [], {}
+
+                # Проверяем размер файла
+                file_size = os.path.getsize(audio)
+                logger.info(f"Audio file size: {file_size} bytes")
+
+                if file_size == 0:
+                    logger.error("Audio file is empty")
+                    return [], {}
+                pipeline_input = audio
             
             start_time = time.time()
             
@@ -129,59 +232,70 @@ class SpeakerRecognizer:
             pipeline_start = time.time()
             logger.info(f"Pipeline started at {pipeline_start}")
             
-            # Добавляем промежуточные логи каждые 30 секунд
-            def log_progress():
-                elapsed = time.time() - pipeline_start
-                logger.info(f"Pipeline running for {elapsed:.1f} seconds...")
-                if progress_callback:
-                    # Обновляем прогресс от 20% до 80% во время работы pipeline
-                    progress = 20 + min(60, int(elapsed / 30) * 10)  # +10% каждые 30 секунд
-                    progress_callback(progress)
-            
-            # Запускаем логирование прогресса в отдельном потоке
-            import threading
-            progress_thread = threading.Thread(target=lambda: self._log_progress_periodically(pipeline_start, progress_callback))
+            # Запускаем логирование прогресса в отдельном потоке до окончания pipeline
+            stop_progress = threading.Event()
+            progress_thread = threading.Thread(
+                target=self._log_progress_periodically,
+                args=(pipeline_start, progress_callback, stop_progress)
+            )
             progress_thread.daemon = True
             progress_thread.start()
             
             try:
                 # Добавляем таймаут для pipeline (максимум 30 минут) с использованием threading
-                import threading
-                import queue
-                
                 result_queue = queue.Queue()
-                exception_queue = queue.Queue()
+
+                pipeline_kwargs = dict(speaker_hints) if speaker_hints is not None \
+                    else self.build_speaker_hints()
+                if ('num_speakers' not in pipeline_kwargs and known_speakers
+                        and all(name in self.speaker_store.names() for name in known_speakers)):
+                    # Состав участников известен - не перебираем число кластеров
+                    pipeline_kwargs['num_speakers'] = len(known_speakers)
+                    pipeline_kwargs.pop('min_speakers', None)
+                    pipeline_kwargs.pop('max_speakers', None)
+                    logger.info(f"Known speaker set {known_speakers}, num_speakers={len(known_speakers)}")
+                logger.info(f"Speaker count hints: {pipeline_kwargs or 'none'}")
                 
+                lock_acquired = threading.Event()
+
                 def run_pipeline():
                     try:
-                        result = self.pipeline(audio_path)
-                        result_queue.put(result)
+                        # pipeline не рассчитан на одновременные вызовы из разных потоков
+                        with self._pipeline_lock:
+                            lock_acquired.set()
+                            if self.supports_embeddings:
+                                result = self.pipeline(pipeline_input, return_embeddings=True, **pipeline_kwargs)
+                            else:
+                                result = (self.pipeline(pipeline_input, **pipeline_kwargs), None)
+                        result_queue.put((result, None))
                     except Exception as e:
-                        exception_queue.put(e)
+                        result_queue.put((None, e))
                 
                 # Запускаем pipeline в отдельном потоке
                 pipeline_thread = threading.Thread(target=run_pipeline)
                 pipeline_thread.daemon = True
                 pipeline_thread.start()
+
+                # Таймаут отсчитывается с начала работы pipeline, а не с ожидания
+                # диаризации другой задачи
+                lock_acquired.wait()
                 
                 # Ждем результат с таймаутом
                 try:
-                    diarization = result_queue.get(timeout=1800)  # 30 минут таймаут
-                    logger.info("Diarization completed successfully")
+                    result, pipeline_exception = result_queue.get(timeout=1800)  # 30 минут таймаут
                 except queue.Empty:
                     logger.error("Pipeline timed out after 30 minutes")
                     raise TimeoutError("Pipeline timeout after 30 minutes")
-                except Exception as e:
-                    # Проверяем, есть ли исключение в очереди
-                    try:
-                        pipeline_exception = exception_queue.get_nowait()
-                        raise pipeline_exception
-                    except queue.Empty:
-                        raise e
+                if pipeline_exception is not None:
+                    raise pipeline_exception
+                diarization, embeddings = result
+                logger.info("Diarization completed successfully")
                     
             except Exception as e:
                 logger.error(f"Pipeline failed after {time.time() - pipeline_start:.1f} seconds: {str(e)}")
                 raise
+            finally:
+                stop_progress.set()
             
             pipeline_end = time.time()
             logger.info(f"Pipeline completed in {pipeline_end - pipeline_start:.2f} seconds")
@@ -191,13 +305,19 @@ class SpeakerRecognizer:
             
             # Преобразуем результаты в удобный формат
             logger.info("Step 3: Processing diarization results...")
+            labels = self._assign_labels(diarization, embeddings, known_speakers)
             speakers = []
             for turn, _, speaker in diarization.itertracks(yield_label=True):
                 speakers.append({
                     'start': turn.start,
                     'end': turn.end,
-                    'speaker': f"SPEAKER_{speaker[-1]}"  # Упрощаем имена спикеров
+                    'speaker': labels[speaker]
                 })
+
+            speaker_embeddings = {}
+            if embeddings is not None:
+                for i, speaker in enumerate(diarization.labels()):
+                    speaker_embeddings[labels[speaker]] = embeddings[i]
             
             unique_speakers = set(s['speaker'] for s in speakers)
             logger.info(f"Found {len(unique_speakers)} unique speakers: {list(unique_speakers)}")
@@ -207,18 +327,50 @@ class SpeakerRecognizer:
             if progress_callback:
                 progress_callback(100)
                 
-            return speakers
+            return speakers, speaker_embeddings
             
         except Exception as e:
             logger.error(f"Ошибка при распознавании спикеров: {str(e)}", exc_info=True)
             logger.warning("Returning empty speaker list due to error")
-            return []
+            return [], {}
+
+    def embed(self, waveform):
+        """
+        Вычисляет эмбеддинг спикера для фрагмента записи (моно float32,
+        SAMPLE_RATE) моделью эмбеддингов pipeline. Используется онлайн-
+        диаризацией, поэтому отдельная модель не загружается.
+        """
+        embedding_model = getattr(self.pipeline, '_embedding', None)
+        if embedding_model is None:
+            raise RuntimeError("Pipeline диаризации не содержит модели эмбеддингов")
+        batch = torch.from_numpy(np.ascontiguousarray(waveform, dtype=np.float32))[None, None]
+        with torch.inference_mode():
+            return np.asarray(embedding_model(batch))[0]
+
+    def _assign_labels(self, diarization, embeddings, known_speakers=None):
+        """
+        Сопоставляет метки pyannote с именами известных спикеров, остальным
+        присваивает SPEAKER_N по номеру из метки pyannote.
+        """
+        raw_labels = diarization.labels()
+        labels = {}
+        for speaker in raw_labels:
+            suffix = speaker.rsplit('_', 1)[-1]
+            labels[speaker] = f"SPEAKER_{int(suffix)}" if suffix.isdigit() else speaker
+
+        if embeddings is None or len(raw_labels) == 0:
+            return labels
+
+        matches = self.speaker_store.match(embeddings[:len(raw_labels)], candidates=known_speakers)
+        for speaker, (name, score) in zip(raw_labels, matches):
+            if name is not None:
+                logger.info(f"{speaker} identified as '{name}' (similarity {score:.2f})")
+                labels[speaker] = name
+        return labels
     
-    def _log_progress_periodically(self, start_time, progress_callback):
-        """Логирует прогресс каждые 30 секунд"""
-        import time
-        while True:
-            time.sleep(30)
+    def _log_progress_periodically(self, start_time, progress_callback, stop_event):
+        """Логирует прогресс каждые 30 секунд, пока не установлен stop_event"""
+        while not stop_event.wait(30):
             elapsed = time.time() - start_time
             logger.info(f"Pipeline still running... Elapsed time: {elapsed:.1f} seconds")
             if progress_callback:
@@ -0,0 +1,176 @@
+import os
+import logging
+import threading
+import tempfile
+import numpy as np
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(vectors):
+    """Нормирует строки матрицы на единичную длину"""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def save_job_embeddings(path, embeddings):
+    """Сохраняет эмбеддинги спикеров задачи {метка: вектор} для последующей регистрации"""
+    labels = list(embeddings.keys())
+    matrix = np.stack([np.asarray(embeddings[label], dtype=np.float32) for label in labels]) \
+        if labels else np.zeros((0, 0), dtype=np.float32)
+    np.savez(path, labels=np.array(labels), embeddings=matrix)
+
+
+def load_job_embeddings(path):
+    """Загружает эмбеддинги спикеров задачи, сохраненные save_job_embeddings"""
+    with np.load(path) as data:
+        return {str(label): data['embeddings'][i] for i, label in enumerate(data['labels'])}
+
+
+class SpeakerStore:
+    """
+    Хранилище центроидов эмбеддингов известных спикеров.
+
+    Центроиды лежат на диске в одном .npz файле и сопоставляются с
+    эмбеддингами из диаризации по косинусному сходству одной матричной
+    операцией.
+    """
+
+    def __init__(self, path=None, threshold=None):
+        self.path = path or Config.SPEAKER_STORE_PATH
+        self.threshold = Config.SPEAKER_MATCH_THRESHOLD if threshold is None else threshold
+        self._lock = threading.Lock()
+        self._names = []
+        self._centroids = None
+        self._counts = np.zeros(0, dtype=np.int64)
+        self._mtime = None
+        self._load()
+
+    def _load(self):
+        """Перечитывает хранилище, если файл изменился на диске"""
+        if not os.path.exists(self.path):
+            return
+        mtime = os.path.getmtime(self.path)
+        if mtime == self._mtime:
+            return
+        with np.load(self.path) as data:
+            self._names = [str(name) for name in data['names']]
+            self._centroids = data['centroids'].astype(np.float32)
+            self._counts = data['counts'].astype(np.int64)
+        self._mtime = mtime
+        logger.info(f"Loaded {len(self._names)} enrolled speakers from {self.path}")
+
+    def _save(self):
+        """Атомарно записывает хранилище на диск"""
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.npz')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(
+                    f,
+                    names=np.array(self._names),
+                    centroids=self._centroids if self._centroids is not None
+                    else np.zeros((0, 0), dtype=np.float32),
+                    counts=self._counts
+                )
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._mtime = os.path.getmtime(self.path)
+
+    def names(self):
+        """Возвращает список зарегистрированных спикеров"""
+        with self._lock:
+            self._load()
+            return list(self._names)
+
+    def enroll(self, name, embeddings):
+        """
+        Добавляет эмбеддинги спикера, обновляя его центроид как скользящее среднее
+        """
+        new = _normalize(embeddings)
+        with self._lock:
+            self._load()
+            if name in self._names:
+                index = self._names.index(name)
+                count = self._counts[index]
+                centroid = (self._centroids[index] * count + new.sum(axis=0)) / (count + len(new))
+                self._centroids[index] = _normalize(centroid)[0]
+                self._counts[index] = count + len(new)
+            else:
+                centroid = _normalize(new.mean(axis=0))
+                if self._centroids is None or self._centroids.size == 0:
+                    self._centroids = centroid
+                else:
+                    self._centroids = np.vstack([self._centroids, centroid])
+                self._names.append(name)
+                self._counts = np.append(self._counts, len(new))
+            self._save()
+        logger.info(f"Enrolled speaker '{name}' ({len(new)} embeddings)")
+
+    def remove(self, name):
+        """Удаляет спикера из хранилища"""
+        with self._lock:
+            self._load()
+            if name not in self._names:
+                return False
+            index = self._names.index(name)
+            del self._names[index]
+            self._centroids = np.delete(self._centroids, index, axis=0)
+            self._counts = np.delete(self._counts, index)
+            self._save()
+        logger.info(f"Removed speaker '{name}'")
+        return True
+
+    def match(self, embeddings, candidates=None):
+        """
+        Сопоставляет эмбеддинги с известными спикерами.
+
+        Args:
+            embeddings: матрица (N, D) эмбеддингов диаризованных спикеров
+            candidates: необязательный список имен, среди которых искать
+
+        Returns:
+            список длины N из пар (имя или None, косинусное сходство).
+            Каждое имя назначается не более чем одному спикеру.
+        """
+        with self._lock:
+            self._load()
+            names = list(self._names)
+            centroids = self._centroids
+
+        embeddings = _normalize(embeddings)
+        result = [(None, 0.0)] * len(embeddings)
+        if not names or centroids is None or centroids.size == 0 or len(embeddings) == 0:
+            return result
+
+        if candidates is not None:
+            indices = [i for i, name in enumerate(names) if name in candidates]
+            if not indices:
+                return result
+            names = [names[i] for i in indices]
+            centroids = centroids[indices]
+
+        scores = embeddings @ centroids.T
+        # NaN-эмбеддинги (спикер без достаточного количества речи) не сопоставляем
+        scores = np.nan_to_num(scores, nan=-1.0)
+
+        # Жадное назначение по убыванию сходства: одно имя - один спикер
+        order = np.dstack(np.unravel_index(np.argsort(-scores, axis=None), scores.shape))[0]
+        used_rows, used_cols = set(), set()
+        for row, col in order:
+            score = float(scores[row, col])
+            if score < self.threshold:
+                break
+            if row in used_rows or col in used_cols:
+                continue
+            result[row] = (names[col], score)
+            used_rows.add(row)
+            used_cols.add(col)
+        return result
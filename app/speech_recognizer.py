@@ -4,23 +4,95 @@ import os
 import logging
 import time
 from pathlib import Path
-import soundfile as sf
+import numpy as np
 import datetime
 import threading
-import inspect
+import copy
+import queue
+from contextlib import contextmanager
+from .config import Config
+from .audio_processor import AudioProcessor, SAMPLE_RATE
+from .mel_cache import MelCache
+from .model_manager import ModelManager
+from .hallucination_filter import screen_segment
 
 logger = logging.getLogger(__name__)
 
+# Температуры повторного декодирования whisper.transcribe по умолчанию
+DEFAULT_TEMPERATURES = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+
+# Профили декодирования Whisper (дополняют build_decode_options). Декодирование
+# и так жадное (без beam search); на CPU основную цену добавляют повторные
+# проходы с большей температурой, поэтому быстрые профили ограничивают их
+DECODE_PROFILES = {
+    # Параметры whisper.transcribe: до шести проходов на неуверенный сегмент
+    'accurate': {},
+    # Не больше двух повторных проходов
+    'balanced': {'temperature': (0.0, 0.4, 0.8)},
+    # Один повторный проход, более терпимые пороги, тишина отбрасывается
+    # раньше, контекст предыдущего текста не передается
+    'fast': {
+        'temperature': (0.0, 0.6),
+        'compression_ratio_threshold': 2.8,
+        'logprob_threshold': -1.5,
+        'no_speech_threshold': 0.5,
+        'condition_on_previous_text': False,
+    },
+}
+
+
+# Оценки Whisper, сохраняемые для каждого сегмента в структурированном результате
+SCORE_FIELDS = ('avg_logprob', 'no_speech_prob', 'compression_ratio', 'temperature')
+
+
+class DecodeStats:
+    """
+    Счетчики проходов декодирования задачи (сегменты могут декодироваться
+    параллельно) и язык, с которым задача распознана (после автоопределения)
+    """
+
+    def __init__(self):
+        self.segments = 0
+        self.passes = 0
+        self.language = None
+        self._lock = threading.Lock()
+
+    def record(self, passes):
+        """Учитывает окно Whisper, декодированное за passes проходов"""
+        with self._lock:
+            self.segments += 1
+            self.passes += passes
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'decoded_windows': self.segments,
+                'decode_passes': self.passes,
+                'fallback_passes': self.passes - self.segments
+            }
+
+
 class SpeechRecognizer:
     _instance = None
+    _init_lock = threading.RLock()
     _model = None
+    # Whisper хранит kv-cache через hooks на общих модулях декодера, поэтому
+    # одновременное декодирование на одной модели из разных потоков недопустимо:
+    # каждый поток берет модель из пула в монопольное пользование
+    _model_pool = None
     
     def __new__(cls):
-        if cls._instance is None:
-            cls._instance = super(SpeechRecognizer, cls).__new__(cls)
+        with cls._init_lock:
+            if cls._instance is None:
+                cls._instance = super(SpeechRecognizer, cls).__new__(cls)
         return cls._instance
     
     def __init__(self):
+        # Одновременное создание из нескольких потоков не должно загружать модель дважды
+        with self._init_lock:
+            self._initialize()
+
+    def _initialize(self):
         if hasattr(self, 'initialized'):
             return
             
@@ -28,6 +100,7 @@ class SpeechRecognizer:
         # Принудительно используем CPU для совместимости
         self.device = "cpu"
         logger.info("Using CPU for speech recognition")
+        self.audio_processor = AudioProcessor()
         
         try:
             if SpeechRecognizer._model is None:
@@ -37,8 +110,14 @@ class SpeechRecognizer:
                 
                 start_time = time.time()
                 
-                # Загружаем модель
-                SpeechRecognizer._model = whisper.load_model("medium")
+                # Загружаем модель из проверенного локального кэша (в офлайн-режиме без сети)
+                if Config.WHISPER_MMAP:
+                    SpeechRecognizer._model = self._load_mmap_model(ModelManager.ensure_whisper_mmap())
+                else:
+                    # Путь к файлу, а не имя модели: whisper не обращается к сети
+                    SpeechRecognizer._model = whisper.load_model(ModelManager.ensure('whisper'))
+                    if Config.WHISPER_MODEL in whisper._ALIGNMENT_HEADS:
+                        SpeechRecognizer._model.set_alignment_heads(whisper._ALIGNMENT_HEADS[Config.WHISPER_MODEL])
                 logger.info(f"Initial model device: {next(SpeechRecognizer._model.parameters()).device}")
                 
                 # Убеждаемся, что модель на CPU
@@ -48,39 +127,286 @@ class SpeechRecognizer:
                 logger.info(f"Model loaded in {time.time() - start_time:.2f} seconds")
                 
             self.model = SpeechRecognizer._model
+            if SpeechRecognizer._model_pool is None:
+                SpeechRecognizer._model_pool = queue.Queue()
+                SpeechRecognizer._model_pool.put(self.model)
+                # Реплики копируются сразу, пока на модели нет hooks от декодирования.
+                # При загрузке через mmap реплики используют те же страницы весов
+                for i in range(1, Config.ASR_PARALLEL_WORKERS):
+                    logger.info(f"Creating Whisper model replica #{i + 1}")
+                    if Config.WHISPER_MMAP:
+                        replica = self._load_mmap_model(ModelManager.ensure_whisper_mmap())
+                    else:
+                        replica = copy.deepcopy(self.model)
+                    SpeechRecognizer._model_pool.put(replica)
             logger.info(f"Speech recognizer initialized on {self.device}")
             
         except Exception as e:
             logger.error(f"Error loading models: {str(e)}")
             raise
 
+    @staticmethod
+    def _load_mmap_model(checkpoint_path):
+        """
+        Загружает модель Whisper с весами, отображенными в память из файла.
+
+        Модель создается без выделения памяти под веса (на устройстве meta),
+        затем параметры заменяются тензорами из файла. Страницы весов берутся
+        из page cache и общие для всех процессов, загрузивших тот же файл.
+        """
+        start_time = time.time()
+        checkpoint = torch.load(checkpoint_path, map_location='cpu', mmap=True, weights_only=True)
+        dims = whisper.model.ModelDimensions(**checkpoint['dims'])
+
+        # Whisper.__init__ строит разреженный буфер, недоступный на meta,
+        # поэтому кодировщик и декодер создаются напрямую
+        model = whisper.model.Whisper.__new__(whisper.model.Whisper)
+        torch.nn.Module.__init__(model)
+        model.dims = dims
+        with torch.device('meta'):
+            model.encoder = whisper.model.AudioEncoder(
+                dims.n_mels, dims.n_audio_ctx, dims.n_audio_state, dims.n_audio_head, dims.n_audio_layer
+            )
+            model.decoder = whisper.model.TextDecoder(
+                dims.n_vocab, dims.n_text_ctx, dims.n_text_state, dims.n_text_head, dims.n_text_layer
+            )
+        model.load_state_dict(checkpoint['model_state_dict'], assign=True)
+
+        # Непостоянные буферы не входят в чекпоинт - создаем их заново
+        mask = torch.empty(dims.n_text_ctx, dims.n_text_ctx).fill_(-np.inf).triu_(1)
+        model.decoder.register_buffer("mask", mask, persistent=False)
+        if Config.WHISPER_MODEL in whisper._ALIGNMENT_HEADS:
+            model.set_alignment_heads(whisper._ALIGNMENT_HEADS[Config.WHISPER_MODEL])
+        else:
+            all_heads = torch.zeros(dims.n_text_layer, dims.n_text_head, dtype=torch.bool)
+            all_heads[dims.n_text_layer // 2:] = True
+            model.register_buffer("alignment_heads", all_heads.to_sparse(), persistent=False)
+
+        if any(tensor.is_meta for tensor in list(model.parameters()) + list(model.buffers())):
+            raise RuntimeError("Чекпоинт Whisper не содержит всех весов модели")
+        model.eval()
+        logger.info(f"Memory-mapped Whisper model loaded in {time.time() - start_time:.2f} seconds")
+        return model
+
     def _format_timestamp(self, seconds):
         """Форматирует время в [HH:MM:SS]"""
         return datetime.datetime.utcfromtimestamp(seconds).strftime('[%H:%M:%S]')
     
-    def recognize(self, audio_path, progress_callback=None):
-        """Транскрибирует аудио файл"""
+    @contextmanager
+    def _checkout_model(self):
+        """Выдает модель из пула в монопольное пользование"""
+        model = SpeechRecognizer._model_pool.get()
+        try:
+            yield model
+        finally:
+            SpeechRecognizer._model_pool.put(model)
+
+    @staticmethod
+    def is_supported_language(language):
+        """Проверяет, что код языка поддерживается Whisper (или равен 'auto')"""
+        return language == 'auto' or language in whisper.tokenizer.LANGUAGES
+
+    def _load(self, audio):
+        """Возвращает массив аудио: путь декодируется, массив используется как есть"""
+        if isinstance(audio, np.ndarray):
+            return audio
+        return self.audio_processor.load_audio(audio)
+
+    def compute_mel(self, waveform):
+        """Вычисляет log-mel спектрограмму всей записи для MelCache.segment()"""
+        return MelCache(waveform, n_mels=self.model.dims.n_mels)
+
+    def detect_language(self, audio, mel=None):
+        """
+        Определяет язык по первым LANGUAGE_DETECTION_SECONDS секундам аудио
+        (путь к файлу или массив) либо по готовому окну mel из MelCache.
+
+        Whisper анализирует не более 30 секунд, поэтому одного прохода
+        достаточно для всей задачи.
+        """
+        start_time = time.time()
+        if mel is None:
+            audio = self._load(audio)
+            max_samples = int(Config.LANGUAGE_DETECTION_SECONDS * SAMPLE_RATE)
+            audio = whisper.pad_or_trim(audio[:max_samples])
+            mel = whisper.log_mel_spectrogram(audio, n_mels=self.model.dims.n_mels)
+        mel = mel.to(self.device)
+
+        with self._checkout_model() as model:
+            _, probs = model.detect_language(mel)
+        language = max(probs, key=probs.get)
+        logger.info(f"Detected language '{language}' (p={probs[language]:.2f}) "
+                    f"in {time.time() - start_time:.2f} seconds")
+        return language
+
+    def build_decode_options(self, language=None, profile=None):
+        """
+        Возвращает параметры декодирования Whisper.
+
+        Словарь создается один раз на задачу и переиспользуется для всех
+        сегментов, чтобы каждый сегмент декодировался с одинаковыми настройками.
+        Язык должен быть уже определен: 'auto' здесь не допускается, иначе
+        Whisper запускал бы определение языка для каждого сегмента.
+        profile - имя из DECODE_PROFILES (по умолчанию WHISPER_PROFILE).
+        """
+        language = language or Config.WHISPER_LANGUAGE
+        if language == 'auto':
+            raise ValueError("Язык должен быть определен до начала декодирования")
+        profile = profile or Config.WHISPER_PROFILE
+        if profile not in DECODE_PROFILES:
+            raise ValueError(f"Неизвестный профиль декодирования: {profile}")
+
+        options = {
+            'language': language,
+            'task': "transcribe",
+            'fp16': False  # Отключаем fp16 для CPU
+        }
+        options.update(DECODE_PROFILES[profile])
+        return options
+
+    def decode_segment(self, mel, initial_prompt=None, decode_options=None, stats=None, details=None):
+        """
+        Транскрибирует сегмент не длиннее 30 секунд по готовому окну mel
+        (MelCache.segment), не вычисляя спектрограмму заново.
+
+        Повторяет логику whisper.transcribe для одного окна: при слишком
+        высокой степени сжатия или низкой уверенности декодирование
+        повторяется с большей температурой, тишина не транскрибируется.
+        Число проходов учитывается в stats (DecodeStats), строки с оценками
+        Whisper добавляются в details (см. recognize()).
+        Возвращает текст в формате recognize().
+        """
+        options = dict(decode_options or self.build_decode_options())
+        temperatures = options.pop('temperature', DEFAULT_TEMPERATURES)
+        if isinstance(temperatures, (int, float)):
+            temperatures = (temperatures,)
+        compression_ratio_threshold = options.pop('compression_ratio_threshold', 2.4)
+        logprob_threshold = options.pop('logprob_threshold', -1.0)
+        no_speech_threshold = options.pop('no_speech_threshold', 0.6)
+        options.pop('condition_on_previous_text', None)
+        if initial_prompt:
+            options['prompt'] = initial_prompt
+
+        with self._checkout_model() as model:
+            mel = mel.to(model.device)
+            passes = 0
+            for temperature in temperatures:
+                passes += 1
+                kwargs = dict(options)
+                if temperature > 0:
+                    kwargs.pop('beam_size', None)
+                    kwargs.pop('patience', None)
+                else:
+                    kwargs.pop('best_of', None)
+                result = whisper.decode(model, mel, whisper.DecodingOptions(temperature=temperature, **kwargs))
+
+                needs_fallback = (
+                    (compression_ratio_threshold is not None
+                     and result.compression_ratio > compression_ratio_threshold)
+                    or (logprob_threshold is not None and result.avg_logprob < logprob_threshold)
+                )
+                if no_speech_threshold is not None and result.no_speech_prob > no_speech_threshold:
+                    needs_fallback = False
+                if not needs_fallback:
+                    break
+            if stats is not None:
+                stats.record(passes)
+
+            tokenizer = whisper.tokenizer.get_tokenizer(
+                model.is_multilingual,
+                num_languages=model.num_languages,
+                language=options.get('language'),
+                task=options.get('task', 'transcribe')
+            )
+
+        scores = {
+            'avg_logprob': result.avg_logprob,
+            'no_speech_prob': result.no_speech_prob,
+            'compression_ratio': result.compression_ratio,
+            'temperature': result.temperature
+        }
+
+        # Окно без речи пропускается, как в whisper.transcribe
+        if (no_speech_threshold is not None and result.no_speech_prob > no_speech_threshold
+                and (logprob_threshold is None or result.avg_logprob < logprob_threshold)):
+            if details is not None and result.text.strip():
+                details.append(dict(scores, start=0.0, end=None, text=result.text.strip(),
+                                    flags=['no_speech'], dropped=True))
+            return ""
+
+        # Разбиваем текст по временным меткам на строки [HH:MM:SS] текст;
+        # у последней строки без закрывающей метки конец неизвестен (None)
+        transcription = []
+        text_tokens, line_start = [], 0.0
+        for token in result.tokens + [None]:
+            if token is None or token >= tokenizer.timestamp_begin:
+                line_end = None if token is None else (token - tokenizer.timestamp_begin) * 0.02
+                text = tokenizer.decode(text_tokens).strip()
+                if text and self._screen(line_start, line_end, text, scores, details):
+                    transcription.append(f"{self._format_timestamp(line_start)} {text}")
+                text_tokens = []
+                line_start = line_end
+            else:
+                text_tokens.append(token)
+        return "\n".join(transcription)
+
+    @staticmethod
+    def _screen(start, end, text, scores, details):
+        """
+        Проверяет строку фильтром галлюцинаций и записывает ее с оценками в
+        details. Возвращает False, если строку нужно удалить из текста.
+        """
+        scores = {key: scores.get(key) for key in SCORE_FIELDS}
+        flags, drop = screen_segment(text, scores['avg_logprob'], scores['no_speech_prob'],
+                                     scores['compression_ratio'])
+        if drop:
+            logger.info(f"Dropping suspected hallucination {flags}: {text[:80]}")
+        if details is not None:
+            details.append(dict(scores, start=start, end=end, text=text, flags=flags, dropped=drop))
+        return not drop
+
+    @staticmethod
+    def _record_passes(result, decode_options, stats):
+        """
+        Учитывает проходы декодирования по результату transcribe: сегменты
+        одного окна (общий seek) получены при одной температуре, номер
+        которой в списке температур и есть число проходов окна.
+        """
+        temperatures = decode_options.get('temperature', DEFAULT_TEMPERATURES)
+        if isinstance(temperatures, (int, float)):
+            temperatures = (temperatures,)
+        windows = {segment['seek']: segment['temperature'] for segment in result['segments']}
+        for temperature in windows.values():
+            stats.record(list(temperatures).index(temperature) + 1 if temperature in temperatures else 1)
+
+    def recognize(self, audio, progress_callback=None, initial_prompt=None, decode_options=None, stats=None,
+                  details=None):
+        """
+        Транскрибирует аудио
+
+        Args:
+            audio: путь к аудио файлу или моно float32 массив с частотой SAMPLE_RATE
+            progress_callback: функция обратного вызова для прогресса
+            initial_prompt: текст предыдущего фрагмента, передаваемый Whisper как контекст
+            decode_options: параметры декодирования из build_decode_options()
+            stats: DecodeStats для учета проходов декодирования
+            details: список, в который добавляются сегменты Whisper с оценками
+                (start, end, text, avg_logprob, no_speech_prob, compression_ratio,
+                temperature, flags, dropped); удаленные фильтром галлюцинаций
+                сегменты остаются только здесь
+        """
         progress_thread = None
         stop_progress = threading.Event()  # Флаг для остановки потока
         
         try:
-            logger.info(f"Starting transcription of {audio_path}")
-            logger.info(f"Whisper version: {whisper.__version__}")
-            logger.info(f"Available Whisper methods: {dir(self.model)}")
-            logger.info(f"Transcribe method signature: {inspect.signature(self.model.transcribe)}")
-            
-            # Проверяем доступные параметры для transcribe
-            try:
-                source = inspect.getsource(self.model.transcribe)
-                logger.info(f"Transcribe method source: {source}")
-            except Exception as e:
-                logger.warning(f"Could not get transcribe source: {e}")
+            audio_name = f"{len(audio) / SAMPLE_RATE:.2f}s waveform" if isinstance(audio, np.ndarray) else audio
+            logger.info(f"Starting transcription of {audio_name}")
 
             start_time = time.time()
             
-            # Получаем длительность аудио
-            audio_info = sf.info(audio_path)
-            total_duration = audio_info.duration
+            # Декодируем аудио в процессе: Whisper не запускает ffmpeg повторно
+            audio = self._load(audio)
+            total_duration = max(len(audio) / SAMPLE_RATE, 0.01)
             
             if progress_callback:
                 progress_callback(5)
@@ -110,13 +436,18 @@ class SpeechRecognizer:
                 logger.info("Starting progress thread")
                 progress_thread.start()
 
+            if decode_options is None:
+                decode_options = self.build_decode_options()
+
             # Запускаем распознавание для CPU (fp16=False)
-            result = self.model.transcribe(
-                audio_path,
-                language="ru",
-                task="transcribe",
-                fp16=False  # Отключаем fp16 для CPU
-            )
+            with self._checkout_model() as model:
+                result = model.transcribe(
+                    audio,
+                    initial_prompt=initial_prompt or None,
+                    **decode_options
+                )
+            if stats is not None:
+                self._record_passes(result, decode_options, stats)
             
             # Форматируем результат с тайм-кодами
             transcription = []
@@ -124,7 +455,8 @@ class SpeechRecognizer:
             
             for i, segment in enumerate(result["segments"]):
                 timestamp = self._format_timestamp(segment["start"])
-                transcription.append(f"{timestamp} {segment['text'].strip()}")
+                if self._screen(segment["start"], segment["end"], segment['text'].strip(), segment, details):
+                    transcription.append(f"{timestamp} {segment['text'].strip()}")
                 
                 # Обновляем прогресс финальной обработки
                 if progress_callback:
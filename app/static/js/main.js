@@ -1,3 +1,139 @@
+// Статусы, после которых задача больше не меняется
+const TERMINAL_STATUSES = ['completed', 'error', 'cancelled'];
+// Ожидание изменения статуса на сервере при long-poll (секунды)
+const STATUS_LONG_POLL_SECONDS = 25;
+// Пауза между опросами скрытой вкладки, а также после долгого запроса,
+// вернувшегося сразу без изменений (сервер занят): от 2 до 30 секунд с
+// удвоением, пока статус не меняется
+const POLL_MIN_MS = 2000;
+const POLL_MAX_MS = 30000;
+// Долгий запрос короче этого считается вернувшимся сразу
+const LONG_POLL_MIN_MS = 1000;
+
+/**
+ * Подписка на изменения статуса задачи.
+ *
+ * Видимая вкладка получает изменения потоком SSE (/status/<id>/events), а
+ * если он недоступен - долгими запросами (?since=&wait=). Скрытая вкладка
+ * не держит соединение и опрашивает статус все реже. onUpdate вызывается
+ * только при изменении статуса; после завершения задачи подписка
+ * закрывается сама. Возвращает функцию отписки.
+ */
+function watchTaskStatus(taskId, onUpdate, onError) {
+    let stopped = false;
+    let source = null;
+    let timer = null;
+    let generation = 0;
+    let lastUpdate = null;
+    let lastPayload = null;
+    let useEvents = typeof EventSource !== 'undefined';
+    let delay = POLL_MIN_MS;
+
+    function fail(error) {
+        stop();
+        if (onError) onError(error);
+    }
+
+    function handle(status) {
+        lastUpdate = status.last_update;
+        const payload = JSON.stringify(status);
+        const changed = payload !== lastPayload;
+        if (changed) {
+            lastPayload = payload;
+            onUpdate(status);
+        }
+        if (TERMINAL_STATUSES.includes(status.status)) stop();
+        return changed;
+    }
+
+    function closeSource() {
+        if (source) {
+            source.close();
+            source = null;
+        }
+    }
+
+    function openEvents() {
+        source = new EventSource(`/status/${taskId}/events`);
+        source.onmessage = (event) => handle(JSON.parse(event.data));
+        source.addEventListener('gone', () => fail(new Error('Задача не найдена')));
+        source.onerror = () => {
+            // Закрытый сервером поток браузер переподключает сам; отказ
+            // в подписке (например, 503) - переходим на долгие запросы
+            if (source && source.readyState === EventSource.CLOSED) {
+                closeSource();
+                useEvents = false;
+                start();
+            }
+        };
+    }
+
+    async function poll(current) {
+        const hidden = document.hidden;
+        const query = !hidden && lastUpdate !== null
+            ? `?since=${lastUpdate}&wait=${STATUS_LONG_POLL_SECONDS}` : '';
+        const started = Date.now();
+        let next = 0;
+        try {
+            const response = await fetch(`/status/${taskId}${query}`);
+            if (current !== generation) return;
+            if (response.status === 404) return fail(new Error('Задача не найдена'));
+            if (!response.ok) throw new Error('Ошибка получения статуса');
+            const changed = handle(await response.json());
+            // Сервер без свободных слотов ожидания отвечает сразу и присылает Retry-After
+            const retryAfter = (Number(response.headers.get('Retry-After')) || 0) * 1000;
+            if (hidden || (!changed && Date.now() - started < LONG_POLL_MIN_MS)) {
+                delay = changed ? POLL_MIN_MS : Math.min(delay * 2, POLL_MAX_MS);
+                next = Math.max(delay, retryAfter);
+            } else {
+                delay = POLL_MIN_MS;
+            }
+        } catch (error) {
+            if (current !== generation) return;
+            console.error('Status check error:', error);
+            delay = Math.min(delay * 2, POLL_MAX_MS);
+            next = delay;
+        }
+        if (!stopped && current === generation) {
+            timer = setTimeout(() => poll(current), next);
+        }
+    }
+
+    function start() {
+        if (stopped) return;
+        const current = ++generation;
+        clearTimeout(timer);
+        closeSource();
+        if (document.hidden) {
+            timer = setTimeout(() => poll(current), delay);
+        } else if (useEvents) {
+            openEvents();
+        } else {
+            poll(current);
+        }
+    }
+
+    function onVisibilityChange() {
+        delay = POLL_MIN_MS;
+        start();
+    }
+
+    function stop() {
+        stopped = true;
+        generation++;
+        clearTimeout(timer);
+        closeSource();
+        document.removeEventListener('visibilitychange', onVisibilityChange);
+    }
+
+    document.addEventListener('visibilitychange', onVisibilityChange);
+    // Первый статус запрашиваем сразу, даже если вкладка скрыта
+    poll(generation).then(() => {
+        if (!stopped && !document.hidden && useEvents) start();
+    });
+    return stop;
+}
+
 class SpeechRecognitionApp {
     constructor() {
         this.dropZone = document.getElementById('dropZone');
@@ -10,7 +146,7 @@ class SpeechRecognitionApp {
         this.downloadButton = document.getElementById('downloadButton');
         
         this.currentTaskId = null;
-        this.progressCheckInterval = null;
+        this.stopProgressCheck = null;
         
         this.initializeEventListeners();
     }
@@ -90,40 +226,29 @@ class SpeechRecognitionApp {
     }
 
     startProgressCheck() {
-        if (this.progressCheckInterval) {
-            clearInterval(this.progressCheckInterval);
+        if (this.stopProgressCheck) {
+            this.stopProgressCheck();
         }
-        
-        this.progressCheckInterval = setInterval(async () => {
-            try {
-                const response = await fetch(`/status/${this.currentTaskId}`);
-                if (!response.ok) throw new Error('Ошибка получения статуса');
-                
-                const status = await response.json();
-                
-                // Обновляем прогресс
-                if (status.progress !== undefined) {
-                    this.updateProgress(status.progress);
-                    console.log(`Progress updated: ${status.progress}%`);
-                }
-                
-                // Проверяем завершение
-                if (status.status === 'completed') {
-                    clearInterval(this.progressCheckInterval);
-                    this.showResult(status.result_file);
-                    console.log('Processing completed');
-                } else if (status.status === 'error') {
-                    clearInterval(this.progressCheckInterval);
-                    this.showError(status.error);
-                    console.error('Processing error:', status.error);
-                }
-                
-            } catch (error) {
-                clearInterval(this.progressCheckInterval);
-                this.showError(error.message);
-                console.error('Progress check error:', error);
+
+        this.stopProgressCheck = watchTaskStatus(this.currentTaskId, (status) => {
+            // Обновляем прогресс
+            if (status.progress !== undefined) {
+                this.updateProgress(status.progress);
+                console.log(`Progress updated: ${status.progress}%`);
             }
-        }, 500);  // Проверяем каждые 500мс вместо 1000мс
+
+            // Проверяем завершение
+            if (status.status === 'completed') {
+                this.showResult(status.result_file);
+                console.log('Processing completed');
+            } else if (status.status === 'error' || status.status === 'cancelled') {
+                this.showError(status.error);
+                console.error('Processing error:', status.error);
+            }
+        }, (error) => {
+            this.showError(error.message);
+            console.error('Progress check error:', error);
+        });
     }
 
     updateProgress(progress) {
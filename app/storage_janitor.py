@@ -0,0 +1,147 @@
+import os
+import time
+import shutil
+import logging
+import threading
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def remove_tree(path):
+    """
+    Удаляет каталог атомарно для остальных: сначала переименовывает его,
+    затем удаляет содержимое, так что частично удаленный каталог никогда
+    не виден под исходным именем.
+    """
+    if not os.path.exists(path):
+        return
+    trash_path = f"{path}.trash-{os.getpid()}-{threading.get_ident()}"
+    try:
+        os.replace(path, trash_path)
+    except OSError:
+        trash_path = path
+    shutil.rmtree(trash_path, ignore_errors=True)
+
+
+class StorageJanitor:
+    """
+    Управление дисковым пространством для загрузок и результатов.
+
+    Периодически удаляет файлы старше TTL и самые старые файлы при
+    превышении квоты, пропуская файлы активных задач, а также сообщает,
+    достаточно ли места для приема новой загрузки.
+    """
+
+    def __init__(self, protected_files=None):
+        # Функция, возвращающая множество путей, которые удалять нельзя
+        self.protected_files = protected_files or (lambda: set())
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _folders(self):
+        """Каталоги под управлением: (путь, TTL, квота в байтах)"""
+        return [
+            (Config.UPLOAD_FOLDER, Config.UPLOAD_TTL, Config.UPLOAD_QUOTA_BYTES),
+            (Config.RESULT_FOLDER, Config.RESULT_TTL, Config.RESULT_QUOTA_BYTES),
+        ]
+
+    @staticmethod
+    def _entries(folder):
+        """Файлы и каталоги верхнего уровня (и сессий загрузки) с mtime и размером"""
+        entries = []
+        for root in (folder, os.path.join(folder, '.chunked')):
+            if not os.path.isdir(root):
+                continue
+            for name in os.listdir(root):
+                path = os.path.join(root, name)
+                if path == os.path.join(folder, '.chunked'):
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                size = stat.st_size
+                if os.path.isdir(path):
+                    size = sum(
+                        os.path.getsize(os.path.join(dirpath, f))
+                        for dirpath, _, files in os.walk(path) for f in files
+                    )
+                entries.append((path, stat.st_mtime, size))
+        return entries
+
+    @staticmethod
+    def _remove(path):
+        if os.path.isdir(path):
+            remove_tree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def sweep(self):
+        """Удаляет устаревшие файлы и файлы сверх квоты, возвращает число удаленных"""
+        with self._lock:
+            now = time.time()
+            protected = self.protected_files()
+            removed = 0
+
+            for folder, ttl, quota in self._folders():
+                entries = [e for e in self._entries(folder) if e[0] not in protected]
+
+                # Удаляем по возрасту
+                expired = [e for e in entries if ttl and now - e[1] > ttl]
+                for path, _, _ in expired:
+                    self._remove(path)
+                    removed += 1
+                entries = [e for e in entries if e not in expired]
+
+                # Удаляем самые старые файлы сверх квоты
+                if quota:
+                    total = sum(e[2] for e in self._entries(folder))
+                    for path, _, size in sorted(entries, key=lambda e: e[1]):
+                        if total <= quota:
+                            break
+                        self._remove(path)
+                        total -= size
+                        removed += 1
+
+            if removed:
+                logger.info(f'Storage janitor removed {removed} entries')
+            return removed
+
+    def has_capacity(self, incoming_bytes=0):
+        """
+        Проверяет, что после приема incoming_bytes на томе загрузок останется
+        не меньше MIN_FREE_DISK_BYTES и не будет превышена квота загрузок.
+        """
+        free = shutil.disk_usage(Config.UPLOAD_FOLDER).free
+        if free - incoming_bytes < Config.MIN_FREE_DISK_BYTES:
+            logger.warning(f'Disk pressure: {free} bytes free, {incoming_bytes} incoming')
+            return False
+
+        if Config.UPLOAD_QUOTA_BYTES:
+            used = sum(e[2] for e in self._entries(Config.UPLOAD_FOLDER))
+            if used + incoming_bytes > Config.UPLOAD_QUOTA_BYTES:
+                # Пытаемся освободить место перед отказом
+                self.sweep()
+                used = sum(e[2] for e in self._entries(Config.UPLOAD_FOLDER))
+                if used + incoming_bytes > Config.UPLOAD_QUOTA_BYTES:
+                    logger.warning(f'Upload quota exceeded: {used} bytes used, {incoming_bytes} incoming')
+                    return False
+        return True
+
+    def start(self, interval=None):
+        """Запускает периодическую очистку (однократно)"""
+        interval = interval or Config.STORAGE_CLEANUP_INTERVAL
+        if self._thread is not None:
+            return
+
+        def loop():
+            while True:
+                try:
+                    self.sweep()
+                except Exception as e:
+                    logger.error(f'Error in storage janitor: {str(e)}', exc_info=True)
+                time.sleep(interval)
+
+        self._thread = threading.Thread(target=loop, name='storage-janitor', daemon=True)
+        self._thread.start()
@@ -0,0 +1,199 @@
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from .config import Config
+from .model_manager import ModelManager
+from .online_diarizer import OnlineDiarizer, pcm16_to_float
+
+logger = logging.getLogger(__name__)
+
+# Частоты, с которыми работают модели Vosk (от телефонной до студийной)
+MIN_SAMPLE_RATE = 8000
+MAX_SAMPLE_RATE = 48000
+
+
+class StreamCapacityError(Exception):
+    """Все слоты потокового распознавания заняты"""
+
+
+class StreamConfigError(Exception):
+    """Клиент передал некорректные параметры потока"""
+
+
+def validate_sample_rate(sample_rate):
+    """Проверяет частоту кадров, заданную клиентом, и возвращает ее"""
+    if isinstance(sample_rate, bool) or not isinstance(sample_rate, int) \
+            or not MIN_SAMPLE_RATE <= sample_rate <= MAX_SAMPLE_RATE:
+        raise StreamConfigError(
+            f"sample_rate должен быть целым числом от {MIN_SAMPLE_RATE} до {MAX_SAMPLE_RATE}"
+        )
+    return sample_rate
+
+
+class StreamRecognizerPool:
+    """
+    Пул распознавателей Vosk для потокового распознавания.
+
+    Модель Vosk загружается один раз и общая для всех соединений, у каждого
+    соединения свой KaldiRecognizer. Число одновременных сессий ограничено
+    (по умолчанию числом ядер): декодирование идет в нативном коде без GIL,
+    и каждой сессии достается по ядру. Освободившиеся распознаватели
+    сбрасываются и переиспользуются следующими соединениями.
+    """
+
+    def __init__(self, size=None, recognizer_factory=None):
+        self.size = size or Config.STREAM_MAX_SESSIONS
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._model = None
+        self._factory = recognizer_factory or self._create_vosk_recognizer
+
+    def _create_vosk_recognizer(self, sample_rate):
+        """Создает KaldiRecognizer, при первом вызове загружая модель Vosk"""
+        from vosk import Model, KaldiRecognizer
+
+        with self._lock:
+            if self._model is None:
+                start_time = time.time()
+                self._model = Model(ModelManager.ensure('vosk'))
+                logger.info(f'Vosk model loaded in {time.time() - start_time:.2f} seconds')
+        recognizer = KaldiRecognizer(self._model, sample_rate)
+        recognizer.SetWords(True)
+        return recognizer
+
+    def acquire(self, sample_rate, timeout=0):
+        """Занимает слот и выдает распознаватель для заданной частоты"""
+        if not self._slots.acquire(timeout=timeout):
+            raise StreamCapacityError("Достигнут предел одновременных потоковых сессий")
+        try:
+            with self._lock:
+                idle = self._idle.get(sample_rate)
+                if idle:
+                    return idle.pop()
+            return self._factory(sample_rate)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, sample_rate, recognizer):
+        """Возвращает распознаватель в пул и освобождает слот"""
+        try:
+            recognizer.Reset()
+            with self._lock:
+                self._idle.setdefault(sample_rate, []).append(recognizer)
+        except Exception as e:
+            logger.warning(f'Dropping stream recognizer that failed to reset: {str(e)}')
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def session(self, sample_rate, timeout=0):
+        recognizer = self.acquire(sample_rate, timeout)
+        try:
+            yield recognizer
+        finally:
+            self.release(sample_rate, recognizer)
+
+
+def _annotate_speakers(result, diarizer):
+    """Добавляет в результат Vosk метки спикеров онлайн-диаризации"""
+    data = json.loads(result)
+    words = data.get('result') or []
+    for word in words:
+        word['speaker'] = diarizer.speaker_at(word['start'], word['end'])
+    if words:
+        data['speaker'] = diarizer.speaker_at(words[0]['start'], words[-1]['end'])
+    return json.dumps(data, ensure_ascii=False)
+
+
+def handle_stream(ws, pool, sample_rate=16000, diarize=False, diarizer_factory=None,
+                  allow_diarization=True):
+    """
+    Обслуживает одно потоковое соединение.
+
+    Протокол совместим с vosk-server: клиент присылает бинарные кадры PCM
+    16 бит моно, необязательное текстовое сообщение {"config": {"sample_rate": N}}
+    до первого кадра и {"eof": 1} в конце. В ответ отправляются JSON Vosk:
+    {"partial": "..."} по мере распознавания и {"text": "...", "result": [...]}
+    по завершении каждой фразы.
+
+    С диаризацией (diarize или {"config": {"diarize": 1}}) дополнительно
+    отправляются предварительные реплики {"turn": {"start", "end", "speaker"}},
+    а результаты фраз и слова в них получают поле "speaker".
+
+    Args:
+        ws: соединение с методами receive() и send()
+        pool: StreamRecognizerPool
+        sample_rate: частота кадров по умолчанию
+        diarize: включить онлайн-диаризацию
+        diarizer_factory: фабрика OnlineDiarizer (для тестов)
+        allow_diarization: False, если диаризация в этом процессе запрещена
+
+    Raises:
+        StreamConfigError: некорректная частота или сообщение config,
+            диаризация запрошена, но запрещена
+    """
+    validate_sample_rate(sample_rate)
+    recognizer = None
+    diarizer = None
+    last_partial = None
+    try:
+        while True:
+            message = ws.receive()
+            if message is None:
+                break
+
+            if isinstance(message, str):
+                try:
+                    data = json.loads(message)
+                except ValueError:
+                    data = {}
+                if not isinstance(data, dict):
+                    raise StreamConfigError("Текстовое сообщение должно быть JSON-объектом")
+                if data.get('eof'):
+                    break
+                if 'config' in data and recognizer is None:
+                    config = data['config']
+                    if not isinstance(config, dict):
+                        raise StreamConfigError("config должен быть JSON-объектом")
+                    sample_rate = validate_sample_rate(config.get('sample_rate', sample_rate))
+                    diarize = bool(config.get('diarize', diarize))
+                continue
+
+            if recognizer is None:
+                if diarize and not allow_diarization:
+                    raise StreamConfigError("Онлайн-диаризация доступна только при SERVING_MODE=inline")
+                recognizer = pool.acquire(sample_rate)
+                if diarize:
+                    diarizer = (diarizer_factory or OnlineDiarizer)()
+                logger.info(f'Stream session started ({sample_rate} Hz, diarization: {diarize})')
+
+            if diarizer is not None:
+                for turn in diarizer.accept(pcm16_to_float(message, sample_rate)):
+                    ws.send(json.dumps({'turn': turn}))
+
+            if recognizer.AcceptWaveform(message):
+                last_partial = None
+                result = recognizer.Result()
+                ws.send(_annotate_speakers(result, diarizer) if diarizer is not None else result)
+            else:
+                partial = recognizer.PartialResult()
+                # Отправляем промежуточный результат только при изменении
+                if partial != last_partial:
+                    last_partial = partial
+                    ws.send(partial)
+
+        if recognizer is not None:
+            result = recognizer.FinalResult()
+            if diarizer is not None:
+                for turn in diarizer.flush():
+                    ws.send(json.dumps({'turn': turn}))
+                result = _annotate_speakers(result, diarizer)
+            ws.send(result)
+    finally:
+        if recognizer is not None:
+            pool.release(sample_rate, recognizer)
+            logger.info('Stream session finished')
@@ -0,0 +1,207 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+# Статусы, после которых задача больше не меняется
+TERMINAL_STATUSES = ('completed', 'error', 'cancelled')
+
+
+def task_summary(task_id, task):
+    """Краткий статус задачи для списка задач"""
+    return {
+        'task_id': task_id,
+        'status': task.get('status', 'unknown'),
+        'progress': task.get('progress', 0),
+        'total_files': task.get('total_files', 0),
+        'current_file': task.get('current_file', 0),
+        'created_at': task.get('created_at'),
+        'last_update': task.get('last_update')
+    }
+
+
+class TaskRegistry:
+    """
+    Потокобезопасный реестр статусов задач.
+
+    Все изменения выполняются под блокировкой, наружу отдаются копии
+    статусов. Завершенные задачи удаляются по истечении TTL или при
+    превышении максимального размера реестра (сначала самые старые), а
+    задачи без обновлений дольше таймаута помечаются как зависшие.
+
+    Реестр живет в памяти одного процесса; общие для нескольких узлов
+    реализации - в модуле job_store.
+    """
+
+    # Состояние доступно всем узлам (см. job_store)
+    shared = False
+
+    def __init__(self, ttl=None, max_tasks=None, stuck_timeout=None):
+        self.ttl = Config.TASK_TTL if ttl is None else ttl
+        self.max_tasks = Config.MAX_TASKS if max_tasks is None else max_tasks
+        self.stuck_timeout = Config.TASK_STUCK_TIMEOUT if stuck_timeout is None else stuck_timeout
+        self._tasks = OrderedDict()
+        self._lock = threading.RLock()
+        # Уведомление ожидающих запросов статуса об изменениях
+        self._changed = threading.Condition(self._lock)
+        self._janitor = None
+
+    def __contains__(self, task_id):
+        with self._lock:
+            return task_id in self._tasks
+
+    def __len__(self):
+        with self._lock:
+            return len(self._tasks)
+
+    def create(self, task_id, fields):
+        """Регистрирует новую задачу"""
+        now = time.time()
+        status = dict(fields)
+        status.setdefault('created_at', now)
+        status['last_update'] = now
+        with self._lock:
+            self._tasks[task_id] = status
+            self._evict_overflow()
+            self._changed.notify_all()
+            return dict(status)
+
+    def get(self, task_id):
+        """Возвращает копию статуса задачи или None"""
+        with self._lock:
+            status = self._tasks.get(task_id)
+            return dict(status) if status is not None else None
+
+    def update(self, task_id, fields):
+        """
+        Обновляет статус задачи. Обновления для удаленных задач и для задач
+        в конечном статусе (например, отмененных) игнорируются.
+        """
+        with self._lock:
+            status = self._tasks.get(task_id)
+            if status is None or status.get('status') in TERMINAL_STATUSES:
+                return False
+            status.update(fields)
+            status['last_update'] = time.time()
+            if status.get('status') in TERMINAL_STATUSES:
+                status['finished_at'] = status['last_update']
+            self._changed.notify_all()
+            return True
+
+    def wait_for_change(self, task_id, last_update, timeout):
+        """
+        Ждет, пока статус задачи изменится после last_update, но не дольше
+        timeout секунд. Возвращает текущий статус (None - задачи нет).
+        """
+        deadline = time.time() + timeout
+        with self._lock:
+            while True:
+                status = self._tasks.get(task_id)
+                remaining = deadline - time.time()
+                if status is None or status.get('last_update') != last_update or remaining <= 0:
+                    return dict(status) if status is not None else None
+                self._changed.wait(remaining)
+
+    def cancel(self, task_id, message='Задача отменена пользователем'):
+        """
+        Отменяет задачу. Возвращает (статус до отмены, отменена ли задача);
+        статус None означает, что задача не найдена.
+        """
+        with self._lock:
+            status = self._tasks.get(task_id)
+            if status is None:
+                return None, False
+            previous = status.get('status')
+            if previous in TERMINAL_STATUSES:
+                return previous, False
+            self.update(task_id, {'status': 'cancelled', 'error': message})
+            return previous, True
+
+    def active_tasks(self):
+        """Возвращает копии статусов незавершенных задач {task_id: статус}"""
+        with self._lock:
+            return {
+                task_id: dict(task) for task_id, task in self._tasks.items()
+                if task.get('status') not in TERMINAL_STATUSES
+            }
+
+    def list(self, offset=0, limit=100, status=None):
+        """Возвращает страницу кратких статусов задач и общее число задач"""
+        with self._lock:
+            items = [
+                (task_id, task) for task_id, task in self._tasks.items()
+                if status is None or task.get('status') == status
+            ]
+            total = len(items)
+            page = [task_summary(task_id, task) for task_id, task in items[offset:offset + limit]]
+        return page, total
+
+    def cleanup(self):
+        """
+        Помечает зависшие задачи как ошибочные и удаляет устаревшие
+        завершенные задачи. Возвращает (число зависших, число удаленных).
+        """
+        now = time.time()
+        stuck = 0
+        with self._lock:
+            for task_id, task in self._tasks.items():
+                # Задачи в очереди не обновляются до начала обработки
+                if task.get('status') != 'processing' or not self.stuck_timeout:
+                    continue
+                if now - task.get('last_update', now) > self.stuck_timeout:
+                    logger.warning(f'Task {task_id} is stuck '
+                                   f'({(now - task["last_update"]) / 60:.1f} minutes without updates)')
+                    self.update(task_id, {
+                        'status': 'error',
+                        'error': 'Задача зависла и была остановлена'
+                    })
+                    stuck += 1
+
+            expired = [
+                task_id for task_id, task in self._tasks.items()
+                if task.get('status') in TERMINAL_STATUSES
+                and now - task.get('finished_at', task.get('last_update', now)) > self.ttl
+            ]
+            for task_id in expired:
+                del self._tasks[task_id]
+            removed = len(expired) + self._evict_overflow()
+            if removed:
+                self._changed.notify_all()
+
+        if stuck or removed:
+            logger.info(f'Task cleanup: {stuck} stuck, {removed} removed, {len(self)} remaining')
+        return stuck, removed
+
+    def _evict_overflow(self):
+        """Удаляет самые старые завершенные задачи сверх max_tasks"""
+        removed = 0
+        if len(self._tasks) <= self.max_tasks:
+            return removed
+        for task_id in list(self._tasks):
+            if len(self._tasks) <= self.max_tasks:
+                break
+            if self._tasks[task_id].get('status') in TERMINAL_STATUSES:
+                del self._tasks[task_id]
+                removed += 1
+        return removed
+
+    def start_janitor(self, interval=None):
+        """Запускает фоновую очистку реестра (однократно)"""
+        interval = interval or Config.TASK_CLEANUP_INTERVAL
+        with self._lock:
+            if self._janitor is not None:
+                return
+
+            def janitor():
+                while True:
+                    time.sleep(interval)
+                    try:
+                        self.cleanup()
+                    except Exception as e:
+                        logger.error(f'Error in task cleanup: {str(e)}', exc_info=True)
+
+            self._janitor = threading.Thread(target=janitor, name='task-janitor', daemon=True)
+            self._janitor.start()
@@ -0,0 +1,42 @@
+import logging
+from .config import Config
+from .job_runner import run_job
+from .job_store import create_task_registry, SharedJobQueue
+from .task_registry import TERMINAL_STATUSES
+
+logger = logging.getLogger(__name__)
+
+
+def serve(store, queue=None):
+    """
+    Цикл обработчика: забирает задачи из общей очереди и пишет статусы прямо
+    в хранилище. Таких процессов может быть сколько угодно на любых узлах.
+    """
+    queue = queue or SharedJobQueue(store)
+    while True:
+        task_id, job = queue.get()
+        status = store.get(task_id)
+        if status is None or status.get('status') in TERMINAL_STATUSES:
+            logger.info(f'Skipping task {task_id}: no longer active')
+            continue
+        try:
+            run_job(task_id, job, lambda fields: store.update(task_id, fields))
+        except Exception as e:
+            logger.error(f'Unexpected error in task {task_id}: {str(e)}', exc_info=True)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    store = create_task_registry()
+    if not store.shared:
+        raise SystemExit('app.worker requires a shared JOB_STORE_URL (sqlite:/// or redis://)')
+
+    # Модели загружаются до первой задачи
+    from .speaker_first_transcription_manager import SpeakerFirstTranscriptionManager
+    SpeakerFirstTranscriptionManager()
+    logger.info(f'Worker started, job store: {Config.JOB_STORE_URL.split("@")[-1]}')
+    serve(store)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк параллельной транскрибации сегментов спикеров
+
+Диаризация выполняется один раз, затем сегменты транскрибируются с разным
+числом потоков K и выводится кривая пропускной способности.
+
+Число реплик модели берется из ASR_PARALLEL_WORKERS, поэтому его нужно
+задать не меньше максимального K:
+
+    ASR_PARALLEL_WORKERS=8 python benchmark_asr.py audio.wav 1,2,4,8
+"""
+
+import os
+import sys
+import time
+import logging
+
+from app.speaker_first_transcription_manager import SpeakerFirstTranscriptionManager
+
+logging.basicConfig(level=logging.WARNING)
+
+
+def benchmark(audio_path, worker_counts):
+    manager = SpeakerFirstTranscriptionManager()
+
+    waveform = manager.audio_processor.load_audio(audio_path)
+    print(f"Диаризация {audio_path}...")
+    segments = manager.speaker_recognizer.recognize_speakers(waveform)
+    if not segments:
+        print("Сегменты спикеров не найдены")
+        return
+
+    audio_seconds = sum(segment['end'] - segment['start'] for segment in segments)
+    decode_options = manager.speech_recognizer.build_decode_options()
+    print(f"Сегментов: {len(segments)}, речи: {audio_seconds:.1f} с, ядер: {os.cpu_count()}")
+    print()
+    print(f"{'K':>3} {'время, с':>10} {'сегм/с':>8} {'аудио-с/с':>10} {'ускорение':>10}")
+
+    baseline = None
+    for workers in worker_counts:
+        start = time.time()
+        manager.transcribe_segments(waveform, segments, decode_options, workers=workers)
+        elapsed = time.time() - start
+
+        baseline = baseline or elapsed
+        print(f"{workers:>3} {elapsed:>10.1f} {len(segments) / elapsed:>8.2f} "
+              f"{audio_seconds / elapsed:>10.2f} {baseline / elapsed:>9.2f}x")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Использование: python benchmark_asr.py <audio.wav> [1,2,4]")
+        sys.exit(1)
+
+    counts = [int(k) for k in (sys.argv[2] if len(sys.argv) > 2 else "1,2,4").split(',')]
+    benchmark(sys.argv[1], counts)
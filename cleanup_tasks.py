@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 """
 Скрипт для очистки зависших задач
+
+Сервер сам помечает зависшие задачи (TASK_STUCK_TIMEOUT), скрипт нужен
+для ручной проверки и отмены задач с другим таймаутом.
 """
 
 import requests
@@ -8,16 +11,21 @@ import time
 import json
 import sys
 
-def get_all_tasks(base_url="http://localhost:5000"):
-    """Получает список всех задач (если есть такой endpoint)"""
+def get_all_tasks(base_url="http://localhost:5000", page_size=1000):
+    """Получает идентификаторы всех задач постранично"""
     try:
-        # Попробуем получить список задач
-        response = requests.get(f"{base_url}/tasks")
-        if response.status_code == 200:
-            return response.json()
-        else:
-            print("Endpoint /tasks не найден, попробуем другой способ")
-            return None
+        task_ids = []
+        offset = 0
+        while True:
+            response = requests.get(f"{base_url}/tasks", params={'offset': offset, 'limit': page_size})
+            if response.status_code != 200:
+                print("Endpoint /tasks не найден, попробуем другой способ")
+                return None
+            page = response.json()
+            task_ids.extend(task['task_id'] for task in page['tasks'])
+            offset += page_size
+            if offset >= page['total']:
+                return task_ids
     except:
         return None
 
@@ -0,0 +1,26 @@
+"""
+Конфигурация gunicorn для production-режима.
+
+Один процесс API (состояние задач хранится в памяти) с пулом потоков для
+лёгких запросов; распознавание выполняется в отдельных процессах
+(SERVING_MODE=process), поэтому опрос статуса и скачивание не ждут GIL.
+"""
+
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:5000')
+workers = 1
+worker_class = 'gthread'
+# Каждое потоковое WebSocket-соединение и каждое ожидание статуса (SSE,
+# long-poll) занимают поток на все время запроса
+threads = int(os.getenv('API_THREADS', '16')) + int(os.getenv('STREAM_MAX_SESSIONS') or os.cpu_count() or 1) \
+    + int(os.getenv('STATUS_MAX_WAITERS', '32'))
+# Загрузка больших файлов и долгие опросы не должны обрываться
+timeout = 0
+graceful_timeout = 30
+
+
+def post_worker_init(worker):
+    """Запускаем обработчики задач сразу, чтобы модели загрузились до первой задачи"""
+    from app.main import dispatcher
+    dispatcher.start()
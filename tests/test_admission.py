@@ -0,0 +1,95 @@
+import pytest
+from app.admission import AdmissionController, AdmissionRejected
+from app.job_queue import FairJobQueue
+
+class FakeDispatcher:
+    """Диспетчер без обработчиков: задачи только копятся в очереди"""
+
+    def __init__(self, workers=1):
+        self.workers = workers
+        self.queue = FairJobQueue(shortest_first=False, workers=workers)
+        self.queue.realtime_factor = 0.5
+
+    def submit(self, task_id, job):
+        self.queue.put(task_id, job)
+
+    def load(self, priority=None):
+        return self.queue.load(priority)
+
+    @property
+    def realtime_factor(self):
+        return self.queue.realtime_factor
+
+def job(seconds, priority='interactive'):
+    return {'client': 'alice', 'audio_seconds': seconds, 'priority': priority}
+
+def test_rejects_over_budget_with_retry_after():
+    dispatcher = FakeDispatcher(workers=2)
+    admission = AdmissionController(dispatcher, max_audio_seconds=1000, max_cpu_seconds=0,
+                                    max_bulk_audio_seconds=0, max_bulk_cpu_seconds=0)
+    admission.submit([('t1', job(800))])
+
+    with pytest.raises(AdmissionRejected) as rejected:
+        admission.submit([('t2', job(600))])
+    # Лишние 400 секунд аудио при скорости 0.5 на двух обработчиках
+    assert rejected.value.retry_after == 100
+    assert dispatcher.queue.qsize() == 1
+
+    admission.submit([('t3', job(200))])
+    assert dispatcher.queue.qsize() == 2
+
+def test_idle_node_accepts_oversized_job():
+    dispatcher = FakeDispatcher()
+    admission = AdmissionController(dispatcher, max_audio_seconds=100, max_cpu_seconds=10)
+    registered = []
+
+    admission.submit([('t1', job(5000))], on_accept=lambda accepted: registered.extend(task_id for task_id, _ in accepted))
+
+    assert registered == ['t1']
+    capacity = admission.capacity()
+    assert capacity['accepting'] is False
+    assert capacity['audio_seconds_in_flight'] == 5000
+    with pytest.raises(AdmissionRejected):
+        admission.check()
+
+def test_capacity_reports_budget_fraction():
+    dispatcher = FakeDispatcher()
+    admission = AdmissionController(dispatcher, max_audio_seconds=1000, max_cpu_seconds=1000)
+    admission.submit([('t1', job(400))])
+
+    capacity = admission.capacity()
+    assert capacity['cpu_seconds_in_flight'] == 200
+    assert capacity['available'] == 0.6
+    assert capacity['accepting'] is True
+
+def test_bulk_work_does_not_use_interactive_budget():
+    dispatcher = FakeDispatcher()
+    admission = AdmissionController(dispatcher, max_audio_seconds=1000, max_cpu_seconds=0,
+                                    max_bulk_audio_seconds=100000, max_bulk_cpu_seconds=0)
+    admission.submit([(f'b{i}', job(3600, 'bulk')) for i in range(20)])
+
+    admission.submit([('t1', job(600))])
+    capacity = admission.capacity()
+    assert capacity['audio_seconds_in_flight'] == 600
+    assert capacity['bulk']['audio_seconds_in_flight'] == 72000
+    assert capacity['total_queued_jobs'] == 21
+
+def test_oversized_batch_is_admitted_partially():
+    dispatcher = FakeDispatcher()
+    admission = AdmissionController(dispatcher, max_audio_seconds=1000, max_cpu_seconds=0,
+                                    max_bulk_audio_seconds=10000, max_bulk_cpu_seconds=0)
+    jobs = [(f'b{i}', job(3000, 'bulk')) for i in range(10)]
+
+    accepted = admission.submit(jobs, partial=True)
+    assert [task_id for task_id, _ in accepted] == ['b0', 'b1', 'b2']
+    # Бюджет исчерпан: следующий пакет отклоняется целиком с Retry-After
+    with pytest.raises(AdmissionRejected):
+        admission.submit(jobs[3:], partial=True)
+
+def test_idle_node_admits_only_first_oversized_batch_job():
+    dispatcher = FakeDispatcher()
+    admission = AdmissionController(dispatcher, max_audio_seconds=1000, max_cpu_seconds=0,
+                                    max_bulk_audio_seconds=1000, max_bulk_cpu_seconds=0)
+    accepted = admission.submit([(f'b{i}', job(5000, 'bulk')) for i in range(3)], partial=True)
+    assert [task_id for task_id, _ in accepted] == ['b0']
+    admission.submit([('t1', job(500))])
@@ -21,4 +21,52 @@ def test_convert_mp3_file(audio_processor, tmp_path):
     
     result = audio_processor.convert_to_wav(str(test_mp3))
     assert result.endswith('.wav')
-    assert os.path.exists(result) 
\ No newline at end of file
+    assert os.path.exists(result) 
+
+def _write_tone(path, seconds, channels=1, sample_rate=16000):
+    import numpy as np
+    import soundfile as sf
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    tone = (0.5 * np.sin(2 * np.pi * 440 * t)).astype('float32')
+    sf.write(str(path), np.stack([tone] * channels, axis=1), sample_rate)
+    return tone
+
+def test_load_audio_downmixes_to_mono(audio_processor, tmp_path):
+    test_wav = tmp_path / "stereo.wav"
+    _write_tone(test_wav, 1.0, channels=2)
+
+    audio = audio_processor.load_audio(str(test_wav))
+    assert audio.dtype.name == 'float32'
+    assert audio.ndim == 1
+    assert len(audio) == 16000
+
+def test_load_audio_resamples_without_reading_twice(audio_processor, tmp_path, monkeypatch):
+    import app.audio_processor as audio_module
+    test_wav = tmp_path / "44k.wav"
+    _write_tone(test_wav, 0.5, sample_rate=44100)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('file with another sample rate is read by soundfile')
+
+    decoded = []
+    monkeypatch.setattr(audio_module.sf, 'read', fail)
+    monkeypatch.setattr(audio_module, 'av', None)
+    monkeypatch.setattr(AudioProcessor, '_decode_with_ffmpeg',
+                        staticmethod(lambda path, rate: decoded.append((path, rate)) or 'pcm'))
+
+    assert audio_processor.load_audio(str(test_wav)) == 'pcm'
+    assert decoded == [(str(test_wav), 16000)]
+
+def test_merge_and_extract_segment(audio_processor, tmp_path):
+    import soundfile as sf
+    first, second = tmp_path / "first.wav", tmp_path / "second.wav"
+    _write_tone(first, 1.0)
+    _write_tone(second, 0.5)
+
+    merged = audio_processor.merge_wav_files([str(first), str(second)], str(tmp_path / "merged.wav"))
+    assert sf.info(merged).frames == 24000
+
+    segment = audio_processor.extract_segment(merged, str(tmp_path / "segment.wav"), 0.5, 0.75)
+    info = sf.info(segment)
+    assert info.frames == 12000
+    assert info.samplerate == 16000
@@ -0,0 +1,63 @@
+import io
+import zipfile
+import pytest
+from app.config import Config
+from app.task_registry import TaskRegistry
+from app.batch_registry import BatchRegistry, stream_zip
+
+@pytest.fixture
+def tasks():
+    return TaskRegistry(ttl=60, max_tasks=1, stuck_timeout=60)
+
+@pytest.fixture
+def batches(tasks):
+    registry = BatchRegistry(tasks, ttl=60)
+    for task_id in ('t1', 't2'):
+        tasks.create(task_id, {'status': 'queued', 'progress': 0})
+    registry.create('batch', ['t1', 't2'], ['uuid1_call.wav', 'uuid2_call.wav'])
+    return registry
+
+def update(tasks, batches, task_id, fields):
+    tasks.update(task_id, fields)
+    batches.task_updated(task_id, fields)
+
+def test_summary_aggregates_task_progress(tasks, batches):
+    assert batches.get('batch')['status'] == 'queued'
+
+    update(tasks, batches, 't1', {'status': 'processing', 'progress': 50})
+    summary = batches.get('batch')
+
+    assert summary['status'] == 'processing'
+    assert summary['progress'] == 25
+    assert summary['counts'] == {'processing': 1, 'queued': 1}
+    assert [task['file'] for task in summary['tasks']] == ['uuid1_call.wav', 'uuid2_call.wav']
+    assert batches.get('missing') is None
+
+def test_results_survive_task_eviction(tasks, batches, tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'RESULT_FOLDER', str(tmp_path))
+    (tmp_path / 'result_1.txt').write_text('первый', encoding='utf-8')
+    update(tasks, batches, 't1', {'status': 'completed', 'result_file': 'result_1.txt'})
+    update(tasks, batches, 't2', {'status': 'error', 'error': 'сбой'})
+    # Реестр на одну задачу вытесняет завершенные задачи пакета
+    tasks.create('other', {'status': 'queued'})
+    assert tasks.get('t1') is None
+
+    summary = batches.get('batch')
+    assert summary['status'] == 'completed'
+    assert summary['progress'] == 100
+    assert summary['counts'] == {'completed': 1, 'error': 1}
+    assert batches.results('batch') == [('00001_call.txt', str(tmp_path / 'result_1.txt'))]
+
+def test_stream_zip_yields_valid_archive(tmp_path):
+    entries = []
+    for i in range(3):
+        path = tmp_path / f'result_{i}.txt'
+        path.write_bytes(f'текст {i}\n'.encode('utf-8') * 1000)
+        entries.append((f'{i}.txt', str(path)))
+
+    chunks = list(stream_zip(entries, chunk_size=1024))
+
+    assert len(chunks) > 3
+    with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+        assert archive.namelist() == ['0.txt', '1.txt', '2.txt']
+        assert archive.read('2.txt') == 'текст 2\n'.encode('utf-8') * 1000
@@ -0,0 +1,62 @@
+import io
+import os
+import pytest
+from app.chunked_upload import ChunkedUploadManager, ChunkedUploadError
+
+@pytest.fixture
+def uploads(tmp_path):
+    return ChunkedUploadManager(str(tmp_path))
+
+def test_upload_in_chunks(uploads, tmp_path):
+    session = uploads.init("test.wav", 10)
+
+    uploads.append(session['upload_id'], 0, io.BytesIO(b'RIFF0'))
+    assert uploads.status(session['upload_id'])['offset'] == 5
+    uploads.append(session['upload_id'], 5, io.BytesIO(b'12345'))
+
+    filepath, filename = uploads.finalize(session['upload_id'])
+    assert filename.endswith('_test.wav')
+    assert os.path.dirname(filepath) == str(tmp_path)
+    with open(filepath, 'rb') as f:
+        assert f.read() == b'RIFF012345'
+
+def test_wrong_offset_returns_current(uploads):
+    session = uploads.init("test.wav", 10)
+    uploads.append(session['upload_id'], 0, io.BytesIO(b'RIFF'))
+
+    with pytest.raises(ChunkedUploadError) as error:
+        uploads.append(session['upload_id'], 0, io.BytesIO(b'RIFF'))
+    assert error.value.status_code == 409
+    assert error.value.offset == 4
+
+def test_finalize_incomplete_upload(uploads):
+    session = uploads.init("test.wav", 10)
+    uploads.append(session['upload_id'], 0, io.BytesIO(b'RIFF'))
+
+    with pytest.raises(ChunkedUploadError) as error:
+        uploads.finalize(session['upload_id'])
+    assert error.value.status_code == 409
+
+def test_unknown_upload(uploads):
+    with pytest.raises(ChunkedUploadError) as error:
+        uploads.status("missing")
+    assert error.value.status_code == 404
+    with pytest.raises(ChunkedUploadError) as error:
+        uploads.append("missing", 0, io.BytesIO(b'RIFF'))
+    assert error.value.status_code == 404
+    assert uploads._locks == {}
+
+def test_session_locks_are_released(uploads):
+    finished = uploads.init("test.wav", 4)
+    uploads.append(finished['upload_id'], 0, io.BytesIO(b'RIFF'))
+    uploads.finalize(finished['upload_id'])
+    aborted = uploads.init("test.wav", 4)
+    uploads.append(aborted['upload_id'], 0, io.BytesIO(b'RI'))
+    uploads.abort(aborted['upload_id'])
+    expired = uploads.init("test.wav", 4)
+    uploads.append(expired['upload_id'], 0, io.BytesIO(b'RI'))
+    for path in uploads._paths(expired['upload_id']):
+        os.remove(path)
+
+    uploads.init("test.wav", 4)
+    assert uploads._locks == {}
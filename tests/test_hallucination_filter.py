@@ -0,0 +1,43 @@
+import pytest
+from app.config import Config
+from app.hallucination_filter import screen_segment, has_repetition
+
+@pytest.fixture(autouse=True)
+def drop_mode(monkeypatch):
+    monkeypatch.setattr(Config, 'HALLUCINATION_FILTER', 'drop')
+    monkeypatch.setattr(Config, 'HALLUCINATION_PHRASES', '')
+
+def test_confident_speech_is_kept():
+    assert screen_segment('Добрый день, начинаем совещание.', -0.3, 0.05, 1.4) == ([], False)
+
+def test_low_confidence_is_only_flagged():
+    assert screen_segment('Кажется, он сказал завтра.', -1.4, 0.2, 1.3) == (['low_confidence'], False)
+
+def test_silence_and_loops_are_dropped():
+    assert screen_segment('Угу.', -1.5, 0.9, 0.8) == (['no_speech', 'low_confidence'], True)
+    assert screen_segment('да, да', -0.5, 0.1, 3.5) == (['compression'], True)
+    flags, drop = screen_segment('и вот и вот и вот и вот и вот', -1.3, 0.1, 2.0)
+    assert flags == ['low_confidence', 'repetition'] and drop
+
+def test_known_phrases(monkeypatch):
+    assert screen_segment('Продолжение следует...', -1.2, 0.3, 1.0) == (['low_confidence', 'known_phrase'], True)
+    # Фраза внутри длинной реплики - это речь
+    assert screen_segment('Спасибо за внимание, теперь перейдем к бюджету на следующий год', -0.4, 0.1, 1.2)[1] is False
+
+    monkeypatch.setattr(Config, 'HALLUCINATION_PHRASES', 'Редактор субтитров Иванов')
+    assert screen_segment('Редактор субтитров: Иванов', -1.2, 0.3, 1.0) == (['low_confidence', 'known_phrase'], True)
+
+def test_confident_repetition_and_phrases_are_only_flagged():
+    assert screen_segment('Спасибо за внимание.', -0.1, 0.01, 1.0) == (['known_phrase'], False)
+    assert screen_segment('да да да да нет', -0.2, 0.02, 1.5) == (['repetition'], False)
+
+def test_flag_mode_keeps_everything(monkeypatch):
+    monkeypatch.setattr(Config, 'HALLUCINATION_FILTER', 'flag')
+    assert screen_segment('Продолжение следует...', -0.4, 0.3, 1.0) == (['known_phrase'], False)
+    monkeypatch.setattr(Config, 'HALLUCINATION_FILTER', 'off')
+    assert screen_segment('Продолжение следует...', -0.4, 0.3, 1.0) == ([], False)
+
+def test_repetition_limit():
+    assert not has_repetition('да да да'.split(), max_repeats=3)
+    assert has_repetition('да да да да'.split(), max_repeats=3)
+    assert has_repetition('раз два раз два раз два раз два'.split(), max_repeats=3)
@@ -0,0 +1,31 @@
+import threading
+import pytest
+from app import job_dispatcher
+from app.job_dispatcher import JobDispatcher
+
+@pytest.fixture
+def fake_run_job(monkeypatch):
+    def run_job(task_id, job, update_status):
+        update_status({'progress': 50})
+        update_status({'status': 'completed', 'result_file': f"result_{job['files'][0]}"})
+    monkeypatch.setattr(job_dispatcher, 'run_job', run_job)
+
+def test_inline_dispatch(fake_run_job):
+    updates = {}
+    done = threading.Event()
+
+    def on_update(task_id, fields):
+        updates.setdefault(task_id, {}).update(fields)
+        if len(updates) == 3 and all(u.get('status') == 'completed' for u in updates.values()):
+            done.set()
+
+    dispatcher = JobDispatcher(on_update, mode='inline', workers=2)
+    for i in range(3):
+        dispatcher.submit(f'task-{i}', {'files': [f'{i}.wav']})
+
+    assert done.wait(timeout=5)
+    assert updates['task-2']['result_file'] == 'result_2.wav'
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        JobDispatcher(lambda task_id, fields: None, mode='asgi')
@@ -0,0 +1,70 @@
+import pytest
+from app.job_queue import FairJobQueue
+
+def job(client, seconds=60, priority='bulk'):
+    return {'client': client, 'audio_seconds': seconds, 'priority': priority}
+
+def drain(queue):
+    return [queue.get()[0] for _ in range(queue.qsize())]
+
+def test_clients_share_the_queue_fairly():
+    queue = FairJobQueue(shortest_first=False)
+    for i in range(3):
+        queue.put(f'a{i}', job('alice', seconds=3 * 3600))
+    queue.put('b0', job('bob'))
+    queue.put('b1', job('bob'))
+
+    # Пока у bob меньше обслуженного аудио, его задачи идут вперед длинных задач alice
+    assert drain(queue) == ['a0', 'b0', 'b1', 'a1', 'a2']
+
+def test_interactive_before_bulk():
+    queue = FairJobQueue(shortest_first=False)
+    queue.put('bulk', job('alice'))
+    queue.put('interactive', job('bob', priority='interactive'))
+
+    assert drain(queue) == ['interactive', 'bulk']
+
+def test_shortest_first_within_client():
+    queue = FairJobQueue(shortest_first=True)
+    queue.put('long', job('alice', seconds=600))
+    queue.put('short', job('alice', seconds=10))
+
+    assert drain(queue) == ['short', 'long']
+
+def test_position_and_estimated_start():
+    queue = FairJobQueue(shortest_first=False, workers=1)
+    queue.realtime_factor = 0.5
+    queue.put('first', job('alice', seconds=100))
+    queue.put('second', job('bob', seconds=100))
+    queue.put('third', job('alice', seconds=100))
+
+    position = queue.position('third')
+    assert position['queue_position'] == 3
+    first = queue.position('first')
+    assert position['estimated_start'] - first['estimated_start'] == pytest.approx(100, abs=1)
+
+    assert queue.discard('second')
+    assert queue.position('third')['queue_position'] == 2
+    assert queue.position('missing') is None
+
+def test_unknown_priority():
+    with pytest.raises(ValueError):
+        FairJobQueue.normalize_priority('urgent')
+
+def test_served_accounting_forgets_idle_clients():
+    queue = FairJobQueue(shortest_first=False)
+    for i in range(100):
+        queue.put(f'once-{i}', job(f'client-{i}', seconds=10))
+        queue.put(f'heavy-{i}', job('heavy', seconds=600))
+    drain(queue)
+    assert queue._served['bulk'] == {}
+
+    queue.put('a', job('small', seconds=10))
+    queue.put('b1', job('big', seconds=600))
+    queue.put('b2', job('big', seconds=600))
+    assert queue.get()[0] == 'a'
+    # small обслужен больше ожидающего big - учет сохраняется
+    assert queue._served['bulk'] == {'small': 10, 'big': 0}
+    assert queue.get()[0] == 'b1'
+    # Теперь small обслужен меньше big и при возвращении начнет с его уровня
+    assert queue._served['bulk'] == {'big': 600}
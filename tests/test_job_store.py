@@ -0,0 +1,125 @@
+import pytest
+from app.job_store import SQLiteTaskRegistry, RedisTaskRegistry, SharedJobQueue
+from app.job_dispatcher import JobDispatcher
+from app.batch_registry import BatchRegistry
+from app.task_registry import TaskRegistry
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def store(request, tmp_path):
+    if request.param == 'sqlite':
+        return SQLiteTaskRegistry(str(tmp_path / 'jobs.db'), ttl=60, stuck_timeout=60)
+    fakeredis = pytest.importorskip('fakeredis')
+    return RedisTaskRegistry(fakeredis.FakeRedis(decode_responses=True), ttl=60, stuck_timeout=60)
+
+def test_status_lifecycle(store):
+    store.create('task', {'status': 'queued', 'progress': 0})
+    assert store.update('task', {'status': 'processing', 'progress': 40})
+    assert store.get('task')['progress'] == 40
+    assert 'task' in store and len(store) == 1
+
+    assert store.cancel('task') == ('processing', True)
+    assert not store.update('task', {'status': 'completed'})
+    assert store.get('task')['status'] == 'cancelled'
+    assert store.cancel('task') == ('cancelled', False)
+    assert store.cancel('missing') == (None, False)
+    assert store.active_tasks() == {}
+
+def test_list_is_paginated(store):
+    for i in range(3):
+        store.create(f'task-{i}', {'status': 'queued'})
+    store.update('task-2', {'status': 'processing'})
+
+    page, total = store.list(offset=1, limit=1)
+    assert total == 3
+    assert [task['task_id'] for task in page] == ['task-1']
+    assert store.list(status='processing')[1] == 1
+
+def test_overflow_evicts_oldest_finished(store):
+    store.max_tasks = 3
+    store.create('done', {'status': 'processing'})
+    store.update('done', {'status': 'completed'})
+    store.create('active', {'status': 'processing'})
+    for i in range(3):
+        store.create(f'task-{i}', {'status': 'queued'})
+
+    assert 'done' not in store and 'active' in store
+    assert len(store) == 4
+    assert store.list()[1] == 4
+
+def test_redis_list_reads_only_requested_page():
+    fakeredis = pytest.importorskip('fakeredis')
+    store = RedisTaskRegistry(fakeredis.FakeRedis(decode_responses=True), ttl=60, stuck_timeout=60)
+    for i in range(5):
+        store.create(f'task-{i}', {'status': 'queued', 'created_at': float(i)})
+    store.update('task-3', {'status': 'completed'})
+    loaded = []
+    load = store._load
+    store._load = lambda task_ids: loaded.append(list(task_ids)) or load(task_ids)
+
+    page, total = store.list(offset=1, limit=2)
+    assert ([task['task_id'] for task in page], total) == (['task-1', 'task-2'], 5)
+    page, total = store.list(status='completed')
+    assert ([task['task_id'] for task in page], total) == (['task-3'], 1)
+    assert store.list(status='queued')[1] == 4
+    assert loaded == [['task-1', 'task-2'], ['task-3'], ['task-0', 'task-1', 'task-2', 'task-4']]
+
+def test_queue_orders_by_priority_then_arrival(store):
+    store.enqueue('bulk', {'priority': 'bulk', 'audio_seconds': 100})
+    store.enqueue('first', {'priority': 'interactive', 'audio_seconds': 30})
+    store.enqueue('second', {'priority': 'interactive', 'audio_seconds': 60})
+
+    assert store.queue_position('bulk') == (3, 90)
+    assert store.discard('second')
+    assert store.queue_position('bulk') == (2, 30)
+
+    assert store.claim(timeout=1) == ('first', {'priority': 'interactive', 'audio_seconds': 30})
+    assert store.claim(timeout=1)[0] == 'bulk'
+    assert store.queued_count() == 0
+
+def test_redis_queue_positions_are_cached_until_queue_changes():
+    fakeredis = pytest.importorskip('fakeredis')
+    store = RedisTaskRegistry(fakeredis.FakeRedis(decode_responses=True), ttl=60, stuck_timeout=60)
+    for i in range(3):
+        store.enqueue(f'task-{i}', {'audio_seconds': 10})
+    assert store.queue_position('task-2') == (3, 20)
+
+    reads = []
+    mget = store._redis.mget
+    store._redis.mget = lambda keys: reads.append(keys) or mget(keys)
+    assert store.queue_position('task-1') == (2, 10)
+    assert reads == []
+
+    assert store.claim(timeout=1)[0] == 'task-0'
+    assert store.queue_position('task-2') == (2, 10)
+    assert len(reads) == 1
+
+def test_shared_queue_reports_load(store):
+    queue = SharedJobQueue(store, workers=2)
+    queue.realtime_factor = 0.5
+    store.create('running', {'status': 'processing', 'progress': 50, 'audio_seconds': 100})
+    store.create('waiting', {'status': 'queued', 'audio_seconds': 40})
+    queue.put('waiting', {'audio_seconds': 40})
+
+    assert queue.load() == {'queued_jobs': 1, 'running_jobs': 1,
+                            'audio_seconds': 140, 'cpu_seconds': 45}
+    assert queue.position('waiting')['queue_position'] == 1
+
+def test_batch_visible_from_another_node(store):
+    store.create('t1', {'status': 'queued'})
+    BatchRegistry(store).create('batch', ['t1'], ['uuid_call.wav'])
+    store.update('t1', {'status': 'completed', 'result_file': 'result.txt'})
+
+    # Другой API-узел с пустой памятью видит пакет через общее хранилище
+    summary = BatchRegistry(store).get('batch')
+    assert summary['status'] == 'completed'
+    assert summary['tasks'][0]['result_file'] == 'result.txt'
+
+def test_queue_mode_requires_shared_store():
+    with pytest.raises(ValueError):
+        JobDispatcher(lambda task_id, fields: None, mode='queue', store=TaskRegistry())
+
+def test_wait_for_change_polls_store(store):
+    status = store.create('task', {'status': 'processing', 'progress': 10})
+    assert store.wait_for_change('task', status['last_update'], timeout=0.1)['progress'] == 10
+    store.update('task', {'progress': 30})
+    assert store.wait_for_change('task', status['last_update'], timeout=5)['progress'] == 30
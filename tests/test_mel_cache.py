@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+whisper = pytest.importorskip("whisper")
+
+from app.mel_cache import MelCache
+
+@pytest.fixture
+def waveform():
+    rng = np.random.default_rng(0)
+    t = np.arange(16000 * 70) / 16000
+    tone = 0.3 * np.sin(2 * np.pi * 220 * t) * (1 + np.sin(2 * np.pi * 0.5 * t))
+    return (tone + 0.05 * rng.standard_normal(len(t))).astype(np.float32)
+
+def test_blockwise_matches_single_pass(waveform):
+    single = MelCache(waveform, block_seconds=3600)
+    blocked = MelCache(waveform, block_seconds=7)
+
+    assert torch.allclose(single._log_spec, blocked._log_spec, atol=1e-4)
+
+def test_segment_matches_whisper(waveform):
+    cache = MelCache(waveform)
+    start, end = 12.0, 31.5
+    clip = waveform[int(start * 16000):int(end * 16000)]
+
+    # Так окно готовит whisper.transcribe: аудио дополняется 30 секундами тишины
+    expected = whisper.log_mel_spectrogram(clip, padding=whisper.audio.N_SAMPLES)[:, :whisper.audio.N_FRAMES]
+    actual = cache.segment(start, end)
+
+    assert actual.shape == expected.shape
+    # Отличаются только крайние кадры, где Whisper видит отражение/тишину вместо соседних отсчетов
+    content = int((end - start) * 100)
+    assert torch.allclose(actual[:, 2:content - 2], expected[:, 2:content - 2], atol=1e-3)
+    assert torch.allclose(actual[:, content + 2:], expected[:, content + 2:], atol=1e-3)
@@ -0,0 +1,146 @@
+import os
+import zipfile
+import pytest
+from app.config import Config
+from app.model_manager import ModelManager, ModelUnavailableError, COMPLETE_MARKER
+
+@pytest.fixture
+def models_dir(tmp_path, monkeypatch):
+    path = tmp_path / 'models'
+    monkeypatch.setattr(Config, 'MODELS_DIR', str(path))
+    monkeypatch.setattr(Config, 'MODEL_OFFLINE', False)
+    monkeypatch.setattr(Config, 'VOSK_MODEL_SHA256', None)
+    return path
+
+@pytest.fixture
+def vosk_archive(tmp_path, monkeypatch):
+    archive = tmp_path / 'vosk.zip'
+    with zipfile.ZipFile(archive, 'w') as zip_ref:
+        zip_ref.writestr(f'{ModelManager.MODEL_NAME}/am/final.mdl', b'model weights')
+        zip_ref.writestr(f'{ModelManager.MODEL_NAME}/conf/model.conf', b'config')
+    monkeypatch.setattr(Config, 'VOSK_MODEL_URL', archive.as_uri())
+    return archive
+
+def test_vosk_is_extracted_atomically_and_recorded(models_dir, vosk_archive):
+    path = ModelManager.ensure('vosk')
+
+    assert os.path.exists(os.path.join(path, COMPLETE_MARKER))
+    assert sorted(os.listdir(models_dir)) == ['manifest.json', 'manifest.lock', ModelManager.MODEL_NAME]
+    assert set(ModelManager.load_manifest()['vosk']['files']) == {
+        os.path.join('am', 'final.mdl'), os.path.join('conf', 'model.conf')
+    }
+    assert ModelManager.verify('vosk') == path
+
+def test_concurrent_ensure_fetches_once(models_dir, vosk_archive, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    fetches = []
+    fetch = ModelManager._fetch_vosk.__func__
+
+    def counting_fetch(cls):
+        fetches.append(1)
+        return fetch(cls)
+
+    monkeypatch.setattr(ModelManager, '_fetch_vosk', classmethod(counting_fetch))
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        paths = list(executor.map(lambda _: ModelManager.ensure('vosk'), range(4)))
+
+    assert len(set(paths)) == 1 and len(fetches) == 1
+    assert not [name for name in os.listdir(models_dir) if name.endswith('.part')]
+
+def test_corrupted_artifact_is_refetched(models_dir, vosk_archive):
+    path = ModelManager.ensure('vosk')
+    with open(os.path.join(path, 'am', 'final.mdl'), 'wb') as f:
+        f.write(b'truncated')
+
+    assert ModelManager.verify('vosk') is None
+    assert ModelManager.ensure('vosk') == path
+    with open(os.path.join(path, 'am', 'final.mdl'), 'rb') as f:
+        assert f.read() == b'model weights'
+
+def test_startup_check_does_not_hash_files(models_dir, vosk_archive, monkeypatch):
+    path = ModelManager.ensure('vosk')
+    # Содержимое изменено без изменения размера: заметно только по SHA256
+    with open(os.path.join(path, 'am', 'final.mdl'), 'wb') as f:
+        f.write(b'model weightz')
+
+    def fail(path):
+        raise AssertionError('SHA256 is computed at startup')
+
+    with monkeypatch.context() as m:
+        m.setattr('app.model_manager.sha256sum', fail)
+        assert ModelManager.verify('vosk') == path
+    assert ModelManager.verify('vosk', full=True) is None
+    ModelManager.prebake(['vosk'])
+    assert ModelManager.verify('vosk', full=True) == path
+
+def test_incomplete_extraction_is_not_trusted(models_dir, vosk_archive):
+    path = ModelManager.ensure('vosk')
+    os.remove(os.path.join(path, COMPLETE_MARKER))
+
+    assert ModelManager.verify('vosk') is None
+
+def test_offline_mode_never_downloads(models_dir, vosk_archive, monkeypatch):
+    monkeypatch.setattr(Config, 'MODEL_OFFLINE', True)
+
+    with pytest.raises(ModelUnavailableError):
+        ModelManager.ensure('vosk')
+    assert not models_dir.exists()
+
+def test_checksum_mismatch_rejects_download(models_dir, vosk_archive, monkeypatch):
+    monkeypatch.setattr(Config, 'VOSK_MODEL_SHA256', '0' * 64)
+
+    with pytest.raises(ModelUnavailableError):
+        ModelManager.ensure('vosk')
+    assert ModelManager.verify('vosk') is None
+    assert not os.path.exists(os.path.join(models_dir, ModelManager.MODEL_NAME))
+
+def test_artifact_from_other_source_is_not_trusted(models_dir, vosk_archive, tmp_path, monkeypatch):
+    ModelManager.ensure('vosk')
+    monkeypatch.setattr(Config, 'VOSK_MODEL_URL', (tmp_path / 'other.zip').as_uri())
+
+    assert ModelManager.verify('vosk') is None
+
+def test_whisper_artifact_is_tied_to_model_name(models_dir, monkeypatch):
+    whisper = pytest.importorskip("whisper")
+    checkpoint = models_dir / 'whisper' / 'small.pt'
+    checkpoint.parent.mkdir(parents=True)
+    checkpoint.write_bytes(b'weights')
+    monkeypatch.setattr(Config, 'WHISPER_MODEL', 'small')
+    ModelManager._record('whisper', str(checkpoint), whisper._MODELS['small'], {})
+
+    assert ModelManager.verify('whisper') == str(checkpoint)
+    monkeypatch.setattr(Config, 'WHISPER_MODEL', 'medium')
+    monkeypatch.setattr(Config, 'MODEL_OFFLINE', True)
+    assert ModelManager.verify('whisper') is None
+    with pytest.raises(ModelUnavailableError):
+        ModelManager.ensure('whisper')
+
+def test_whisper_mmap_checkpoint_matches_regular_load(tmp_path, monkeypatch):
+    torch = pytest.importorskip("torch")
+    whisper = pytest.importorskip("whisper")
+    from whisper.model import Whisper, ModelDimensions
+    from app.model_manager import convert_whisper_checkpoint
+    from app.speech_recognizer import SpeechRecognizer
+
+    monkeypatch.setattr(Config, 'WHISPER_MODEL', 'test-model')
+    torch.manual_seed(0)
+    dims = ModelDimensions(n_mels=80, n_audio_ctx=1500, n_audio_state=64, n_audio_head=2,
+                           n_audio_layer=1, n_vocab=51865, n_text_ctx=448, n_text_state=64,
+                           n_text_head=2, n_text_layer=2)
+    # Официальные чекпоинты хранят веса в float16
+    source = tmp_path / 'model.pt'
+    model = Whisper(dims)
+    for parameter in model.parameters():
+        torch.nn.init.normal_(parameter, std=0.02)
+    state_dict = {k: v.half() for k, v in model.state_dict().items()}
+    torch.save({'dims': dims.__dict__, 'model_state_dict': state_dict}, source)
+
+    target = convert_whisper_checkpoint(str(source), str(tmp_path / 'model-fp32.pt'))
+    mapped = SpeechRecognizer._load_mmap_model(target)
+    regular = whisper.load_model(str(source), device='cpu')
+
+    assert all(p.dtype == torch.float32 for p in mapped.parameters())
+    mel = torch.randn(1, 80, 3000)
+    tokens = torch.tensor([[50258, 50263, 50359]])
+    with torch.no_grad():
+        assert torch.equal(mapped(mel, tokens), regular(mel, tokens))
@@ -0,0 +1,131 @@
+import json
+import numpy as np
+import pytest
+from app.online_diarizer import OnlineDiarizer, diarize_incrementally, pcm16_to_float
+from app.speaker_store import SpeakerStore
+from app.stream_recognizer import StreamRecognizerPool, handle_stream
+
+SR = 16000
+
+def fake_embed(window):
+    """Голос спикера задается знаком постоянной составляющей"""
+    mean = float(np.mean(window))
+    return np.array([max(mean, 0.0), max(-mean, 0.0), 0.01])
+
+def speech(level, seconds):
+    return np.full(int(seconds * SR), level, dtype=np.float32)
+
+def make_diarizer(**kwargs):
+    return OnlineDiarizer(embed_fn=fake_embed, window_seconds=1.5, step_seconds=1.0,
+                          threshold=0.8, max_speakers=4, min_rms=0.01, **kwargs)
+
+def test_turns_follow_speaker_changes():
+    diarizer = make_diarizer()
+    audio = np.concatenate([speech(0.5, 3), speech(-0.5, 3), speech(0.5, 2)])
+
+    # Аудио приходит кадрами по 0.25 секунды, как из потока
+    emitted = []
+    for offset in range(0, len(audio), SR // 4):
+        emitted.extend(diarizer.accept(audio[offset:offset + SR // 4]))
+
+    assert len(emitted) == 8
+    assert diarizer.turns == [
+        {'start': 0.0, 'end': 3.0, 'speaker': 'SPEAKER_0'},
+        {'start': 3.0, 'end': 6.0, 'speaker': 'SPEAKER_1'},
+        {'start': 6.0, 'end': 8.0, 'speaker': 'SPEAKER_0'},
+    ]
+    assert diarizer.speaker_at(2.5, 4.5) == 'SPEAKER_1'
+
+def test_silence_is_not_labelled_and_tail_is_flushed():
+    diarizer = make_diarizer()
+    diarizer.accept(np.concatenate([speech(0.0, 2), speech(0.5, 1.5)]))
+
+    assert diarizer.turns == [{'start': 2.0, 'end': 3.0, 'speaker': 'SPEAKER_0'}]
+    assert diarizer.flush() == [{'start': 3.0, 'end': 3.5, 'speaker': 'SPEAKER_0'}]
+    assert diarizer.turns[-1]['end'] == 3.5
+
+def test_max_speakers_reuses_closest_centroid():
+    diarizer = OnlineDiarizer(embed_fn=fake_embed, window_seconds=1.0, step_seconds=1.0,
+                              threshold=0.99, max_speakers=1, min_rms=0.01)
+    diarizer.accept(np.concatenate([speech(0.5, 1), speech(-0.5, 1)]))
+
+    assert set(diarizer.centroids()) == {'SPEAKER_0'}
+
+def test_enrolled_speaker_gets_name(tmp_path):
+    store = SpeakerStore(path=str(tmp_path / "speakers.npz"), threshold=0.5)
+    store.enroll("Анна", fake_embed(speech(-0.5, 1)))
+    diarizer = make_diarizer(speaker_store=store)
+
+    diarizer.accept(np.concatenate([speech(0.5, 2), speech(-0.5, 2)]))
+
+    assert [turn['speaker'] for turn in diarizer.turns] == ['SPEAKER_0', 'Анна']
+
+def test_incremental_batch_preview_grows():
+    audio = np.concatenate([speech(0.5, 4), speech(-0.5, 4)])
+    snapshots = list(diarize_incrementally(audio, make_diarizer(), chunk_seconds=4))
+
+    assert [len(turns) for turns in snapshots] == [1, 2, 2]
+    assert snapshots[-1][-1] == {'start': 4.0, 'end': 8.0, 'speaker': 'SPEAKER_1'}
+
+def test_pcm16_resampled_to_16k():
+    pcm = (np.full(8000, 0.5) * 32767).astype('<i2').tobytes()
+    samples = pcm16_to_float(pcm, 8000)
+
+    assert samples.shape == (16000,)
+    assert samples.dtype == np.float32
+    assert np.allclose(samples, 0.5, atol=1e-3)
+
+class WordRecognizer:
+    """Каждый кадр - одна секунда и одно слово; фраза заканчивается каждые два кадра"""
+
+    def __init__(self, sample_rate):
+        self.seconds = 0
+        self.words = []
+
+    def AcceptWaveform(self, data):
+        self.words.append({'word': f'w{self.seconds}', 'start': self.seconds,
+                           'end': self.seconds + 1})
+        self.seconds += 1
+        return len(self.words) == 2
+
+    def Result(self):
+        words, self.words = self.words, []
+        return json.dumps({'text': ' '.join(w['word'] for w in words), 'result': words})
+
+    def PartialResult(self):
+        return json.dumps({'partial': ''})
+
+    def FinalResult(self):
+        return self.Result()
+
+    def Reset(self):
+        self.seconds = 0
+        self.words = []
+
+class FakeWebSocket:
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.sent = []
+
+    def receive(self):
+        return self.messages.pop(0) if self.messages else None
+
+    def send(self, data):
+        self.sent.append(json.loads(data))
+
+def pcm(level, seconds=1):
+    return (speech(level, seconds) * 32767).astype('<i2').tobytes()
+
+@pytest.mark.parametrize('config', [None, '{"config": {"diarize": 1}}'])
+def test_stream_results_carry_speakers(config):
+    pool = StreamRecognizerPool(size=1, recognizer_factory=WordRecognizer)
+    frames = [pcm(0.5), pcm(0.5), pcm(-0.5), pcm(-0.5), '{"eof": 1}']
+    ws = FakeWebSocket(([config] if config else []) + frames)
+
+    handle_stream(ws, pool, diarize=config is None, diarizer_factory=make_diarizer)
+
+    turns = [message['turn'] for message in ws.sent if 'turn' in message]
+    results = [message for message in ws.sent if message.get('result')]
+    assert [turn['speaker'] for turn in turns] == ['SPEAKER_0', 'SPEAKER_0', 'SPEAKER_1', 'SPEAKER_1']
+    assert [result['speaker'] for result in results] == ['SPEAKER_0', 'SPEAKER_1']
+    assert results[1]['result'][0]['speaker'] == 'SPEAKER_1'
@@ -0,0 +1,38 @@
+import os
+import gzip
+import pytest
+from werkzeug.http import parse_accept_header
+from app.config import Config
+from app import result_files
+from app.result_files import write_compressed_variants, select_variant
+
+@pytest.fixture
+def result(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'RESULT_COMPRESSION', True)
+    monkeypatch.setattr(Config, 'RESULT_COMPRESSION_MIN_BYTES', 100)
+    monkeypatch.setattr(result_files, 'zstandard', None)
+    path = tmp_path / 'result.txt'
+    path.write_text('SPEAKER_1: привет\n' * 100, encoding='utf-8')
+    return str(path)
+
+def test_gzip_variant_matches_original(result):
+    assert write_compressed_variants(result) == ['gzip']
+    with gzip.open(result + '.gz', 'rb') as f:
+        assert f.read() == open(result, 'rb').read()
+    assert os.path.getmtime(result + '.gz') == os.path.getmtime(result)
+
+def test_small_results_are_not_compressed(result, monkeypatch):
+    monkeypatch.setattr(Config, 'RESULT_COMPRESSION_MIN_BYTES', 10 ** 6)
+    assert write_compressed_variants(result) == []
+    assert not os.path.exists(result + '.gz')
+
+def test_select_variant_follows_accept_encoding(result):
+    write_compressed_variants(result)
+    assert select_variant(result, parse_accept_header('gzip, br')) == (result + '.gz', 'gzip')
+    assert select_variant(result, parse_accept_header('gzip;q=0')) == (result, None)
+    assert select_variant(result, parse_accept_header('')) == (result, None)
+
+    # Перезаписанный результат новее сжатого варианта - отдаем оригинал
+    mtime = os.path.getmtime(result) + 10
+    os.utime(result, (mtime, mtime))
+    assert select_variant(result, parse_accept_header('gzip')) == (result, None)
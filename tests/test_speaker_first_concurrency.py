@@ -0,0 +1,199 @@
+import time
+import numpy as np
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from app.speaker_first_transcription_manager import SpeakerFirstTranscriptionManager
+from app.audio_processor import SAMPLE_RATE
+from app.speech_recognizer import DECODE_PROFILES, DecodeStats
+
+# Несколько сегментов с одинаковыми таймингами (перекрывающаяся речь)
+SEGMENTS = [
+    {'start': 0.0, 'end': 1.0, 'speaker': 'SPEAKER_0'},
+    {'start': 0.0, 'end': 1.0, 'speaker': 'SPEAKER_1'},
+    {'start': 1.0, 'end': 2.5, 'speaker': 'SPEAKER_0'},
+    {'start': 2.5, 'end': 4.0, 'speaker': 'SPEAKER_1'},
+]
+
+class FakeSpeakerRecognizer:
+    def recognize_speakers(self, audio_path, progress_callback=None, known_speakers=None,
+                           return_embeddings=False, speaker_hints=None):
+        return [dict(segment) for segment in SEGMENTS], {}
+
+# Каждый байт исходного файла - 1/10 секунды аудио
+SAMPLES_PER_CHAR = SAMPLE_RATE // 10
+
+class FakeAudioProcessor:
+    def __init__(self):
+        self.loads = 0
+
+    def load_audio(self, input_path):
+        self.loads += 1
+        with open(input_path, 'rb') as f:
+            data = np.frombuffer(f.read(), dtype=np.uint8)
+        return np.repeat(data, SAMPLES_PER_CHAR).astype(np.float32)
+
+class FakeSpeechRecognizer:
+    def __init__(self):
+        self.prompts = []
+
+    def build_decode_options(self, language=None, profile=None):
+        return dict(DECODE_PROFILES[profile or 'accurate'], language=language)
+
+    def compute_mel(self, waveform):
+        return None
+
+    def recognize(self, audio, progress_callback=None, initial_prompt=None, decode_options=None, stats=None,
+                  details=None):
+        time.sleep(0.01)
+        self.prompts.append(initial_prompt)
+        if stats is not None:
+            stats.record(1)
+        text = bytes(audio[::SAMPLES_PER_CHAR].astype(np.uint8)).decode()
+        if details is not None:
+            details.append({'start': 0.0, 'end': None, 'text': text, 'avg_logprob': -0.2,
+                            'flags': [], 'dropped': False})
+        return f"[00:00:00] {text}"
+
+@pytest.fixture
+def manager():
+    manager = SpeakerFirstTranscriptionManager.__new__(SpeakerFirstTranscriptionManager)
+    manager.speaker_recognizer = FakeSpeakerRecognizer()
+    manager.audio_processor = FakeAudioProcessor()
+    manager.speech_recognizer = FakeSpeechRecognizer()
+    return manager
+
+def test_parallel_jobs_match_serial(manager, tmp_path):
+    audio_path = tmp_path / "audio.wav"
+    audio_path.write_bytes(b"abcdefghijklmnopqrstuvwxyz0123456789ABCD")
+
+    expected = manager.process_audio(str(audio_path), language='ru')
+    assert '[Ошибка транскрибации]' not in expected
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(
+            lambda _: manager.process_audio(str(audio_path), language='ru'),
+            range(16)
+        ))
+
+    assert results == [expected] * 16
+
+def test_parallel_jobs_do_not_share_scratch(manager, tmp_path):
+    paths = []
+    for i in range(8):
+        path = tmp_path / f"audio_{i}.wav"
+        path.write_bytes(bytes([ord('a') + i]) * 40)
+        paths.append(str(path))
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda p: manager.process_audio(p, language='ru'), paths))
+
+    for i, result in enumerate(results):
+        assert result == manager.process_audio(paths[i], language='ru')
+        assert chr(ord('a') + (i + 1) % 8) * 10 not in result
+
+def test_audio_is_decoded_once_per_job(manager, tmp_path):
+    audio_path = tmp_path / "audio.wav"
+    audio_path.write_bytes(b"abcdefghijklmnopqrstuvwxyz0123456789ABCD")
+
+    result = manager.process_audio(str(audio_path), language='ru')
+    assert manager.audio_processor.loads == 1
+    assert 'z0123456789ABCD' in result
+
+    waveform = manager.audio_processor.load_audio(str(audio_path))
+    assert manager.process_audio(waveform, language='ru') == result
+    assert manager.audio_processor.loads == 2
+
+def test_split_runs_are_contiguous_and_cover_all_segments():
+    segments = [{'start': float(i), 'end': float(i + 1), 'speaker': 'SPEAKER_0'} for i in range(10)]
+    runs = SpeakerFirstTranscriptionManager._split_runs(segments, 3)
+
+    assert len(runs) == 3
+    assert [i for run in runs for i, _ in run] == list(range(10))
+
+def test_parallel_segments_match_serial(manager, tmp_path):
+    pytest.importorskip("torch")
+    audio_path = tmp_path / "audio.wav"
+    audio_path.write_bytes(b"abcdefghijklmnopqrstuvwxyz0123456789ABCD")
+    segments = [
+        {'start': float(i), 'end': float(i + 1), 'speaker': f'SPEAKER_{i % 2}'} for i in range(4)
+    ]
+    options = manager.speech_recognizer.build_decode_options('ru')
+    waveform = manager.audio_processor.load_audio(str(audio_path))
+
+    serial = manager.transcribe_segments(waveform, segments, options, workers=1)
+    done = []
+    parallel = manager.transcribe_segments(waveform, segments, options,
+                                           workers=2, progress_callback=done.append)
+
+    assert parallel == serial
+    assert sorted(done) == [1, 2, 3, 4]
+
+def test_torch_threads_are_set_once_per_process(manager, tmp_path, monkeypatch):
+    torch = pytest.importorskip("torch")
+    import app.speaker_first_transcription_manager as module
+    audio_path = tmp_path / "audio.wav"
+    audio_path.write_bytes(b"abcdefghijklmnopqrstuvwxyz0123456789ABCD")
+    segments = [
+        {'start': float(i), 'end': float(i + 1), 'speaker': f'SPEAKER_{i % 2}'} for i in range(4)
+    ]
+    options = manager.speech_recognizer.build_decode_options('ru')
+    waveform = manager.audio_processor.load_audio(str(audio_path))
+    monkeypatch.setattr(module, '_torch_threads', None)
+    monkeypatch.setattr(module.Config, 'ASR_PARALLEL_WORKERS', 2)
+    monkeypatch.setattr(module.os, 'cpu_count', lambda: 8)
+    seen = []
+    transcribe_run = manager._transcribe_run
+
+    def recording_run(*args):
+        seen.append(torch.get_num_threads())
+        return transcribe_run(*args)
+
+    monkeypatch.setattr(manager, '_transcribe_run', recording_run)
+    previous = torch.get_num_threads()
+    try:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda workers: manager.transcribe_segments(waveform, segments, options,
+                                                                          workers=workers),
+                              [1, 2, 3, 1] * 4))
+        # Последовательные и параллельные задачи используют одну настройку процесса
+        assert module._torch_threads == 4
+        assert set(seen) == {4}
+    finally:
+        torch.set_num_threads(previous)
+
+def test_profile_controls_context_and_counts_passes(manager, tmp_path):
+    audio_path = tmp_path / "audio.wav"
+    audio_path.write_bytes(b"abcdefghijklmnopqrstuvwxyz0123456789ABCD")
+
+    stats = DecodeStats()
+    manager.process_audio(str(audio_path), language='ru', profile='fast', stats=stats)
+    assert manager.speech_recognizer.prompts == [None] * len(SEGMENTS)
+    assert stats.as_dict() == {'decoded_windows': 4, 'decode_passes': 4, 'fallback_passes': 0}
+
+    manager.speech_recognizer.prompts = []
+    manager.process_audio(str(audio_path), language='ru')
+    assert any(manager.speech_recognizer.prompts)
+
+def test_stats_record_detected_language(manager, tmp_path, monkeypatch):
+    audio_path = tmp_path / "audio.wav"
+    audio_path.write_bytes(b"abcdefghijklmnopqrstuvwxyz0123456789ABCD")
+    monkeypatch.setattr(manager.speech_recognizer, 'detect_language', lambda audio, mel=None: 'en',
+                        raising=False)
+
+    stats = DecodeStats()
+    manager.process_audio(str(audio_path), language='auto', stats=stats)
+    assert stats.language == 'en'
+
+    stats = DecodeStats()
+    manager.process_audio(str(audio_path), language='ru', stats=stats)
+    assert stats.language == 'ru'
+
+def test_details_keep_scores_with_recording_times(manager, tmp_path):
+    audio_path = tmp_path / "audio.wav"
+    audio_path.write_bytes(b"abcdefghijklmnopqrstuvwxyz0123456789ABCD")
+
+    details = []
+    manager.process_audio(str(audio_path), language='ru', details=details)
+    assert [(d['speaker'], d['start']) for d in details] == [(s['speaker'], s['start']) for s in SEGMENTS]
+    asr = details[2]['asr'][0]
+    assert (asr['start'], asr['end'], asr['avg_logprob']) == (1.0, 2.5, -0.2)
@@ -0,0 +1,42 @@
+import pytest
+import numpy as np
+from app.speaker_store import SpeakerStore, save_job_embeddings, load_job_embeddings
+
+@pytest.fixture
+def speaker_store(tmp_path):
+    return SpeakerStore(path=str(tmp_path / "speakers.npz"), threshold=0.5)
+
+def test_match_enrolled_speakers(speaker_store):
+    speaker_store.enroll("Анна", np.array([1.0, 0.0, 0.0]))
+    speaker_store.enroll("Иван", np.array([0.0, 1.0, 0.0]))
+
+    matches = speaker_store.match(np.array([
+        [0.1, 0.9, 0.0],
+        [0.0, 0.0, 1.0],
+        [0.9, 0.1, 0.0],
+    ]))
+
+    assert [name for name, _ in matches] == ["Иван", None, "Анна"]
+
+def test_name_assigned_once(speaker_store):
+    speaker_store.enroll("Анна", np.array([1.0, 0.0]))
+
+    matches = speaker_store.match(np.array([[0.9, 0.1], [1.0, 0.0]]))
+
+    assert [name for name, _ in matches] == [None, "Анна"]
+
+def test_store_persists_on_disk(speaker_store):
+    speaker_store.enroll("Анна", np.array([1.0, 0.0]))
+
+    reloaded = SpeakerStore(path=speaker_store.path)
+    assert reloaded.names() == ["Анна"]
+    assert reloaded.remove("Анна")
+    assert SpeakerStore(path=speaker_store.path).names() == []
+
+def test_job_embeddings_roundtrip(tmp_path):
+    path = str(tmp_path / "job.npz")
+    save_job_embeddings(path, {"SPEAKER_0": np.ones(4), "SPEAKER_11": np.zeros(4)})
+
+    embeddings = load_job_embeddings(path)
+    assert sorted(embeddings) == ["SPEAKER_0", "SPEAKER_11"]
+    assert np.allclose(embeddings["SPEAKER_0"], 1.0)
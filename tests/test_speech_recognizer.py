@@ -1,5 +1,5 @@
 import pytest
-from app.speech_recognizer import SpeechRecognizer
+from app.speech_recognizer import SpeechRecognizer, DecodeStats
 import wave
 import numpy as np
 
@@ -17,4 +17,32 @@ def test_recognize_empty_audio(speech_recognizer, tmp_path):
         wf.writeframes(np.zeros(16000, dtype=np.int16).tobytes())
     
     result = speech_recognizer.recognize(str(test_wav))
-    assert isinstance(result, str) 
\ No newline at end of file
+    assert isinstance(result, str) 
+
+def test_decode_profiles_limit_fallback():
+    recognizer = object.__new__(SpeechRecognizer)
+    fast = recognizer.build_decode_options('ru', 'fast')
+    assert fast['language'] == 'ru' and len(fast['temperature']) == 2
+    assert fast['condition_on_previous_text'] is False
+    assert 'temperature' not in recognizer.build_decode_options('ru', 'accurate')
+    with pytest.raises(ValueError):
+        recognizer.build_decode_options('ru', 'unknown')
+
+def test_fallback_passes_counted_per_window():
+    stats = DecodeStats()
+    result = {'segments': [
+        {'seek': 0, 'temperature': 0.0},
+        {'seek': 0, 'temperature': 0.0},
+        {'seek': 3000, 'temperature': 0.4},
+    ]}
+    SpeechRecognizer._record_passes(result, {'temperature': (0.0, 0.4, 0.8)}, stats)
+    assert stats.as_dict() == {'decoded_windows': 2, 'decode_passes': 3, 'fallback_passes': 1}
+
+def test_screen_records_scores_of_dropped_segments():
+    details = []
+    segment = {'id': 3, 'seek': 0, 'tokens': [1, 2], 'avg_logprob': -1.3,
+               'no_speech_prob': 0.1, 'compression_ratio': 1.1, 'temperature': 0.0}
+    assert not SpeechRecognizer._screen(4.0, 6.0, 'Продолжение следует...', segment, details)
+    assert details == [{'avg_logprob': -1.3, 'no_speech_prob': 0.1, 'compression_ratio': 1.1,
+                        'temperature': 0.0, 'start': 4.0, 'end': 6.0, 'text': 'Продолжение следует...',
+                        'flags': ['low_confidence', 'known_phrase'], 'dropped': True}]
@@ -0,0 +1,50 @@
+import os
+import time
+import pytest
+from app.config import Config
+from app.storage_janitor import StorageJanitor, remove_tree
+
+@pytest.fixture
+def folders(tmp_path, monkeypatch):
+    for name in ('UPLOAD_FOLDER', 'RESULT_FOLDER'):
+        path = tmp_path / name.lower()
+        path.mkdir()
+        monkeypatch.setattr(Config, name, str(path))
+    monkeypatch.setattr(Config, 'UPLOAD_TTL', 60)
+    monkeypatch.setattr(Config, 'UPLOAD_QUOTA_BYTES', 0)
+    monkeypatch.setattr(Config, 'MIN_FREE_DISK_BYTES', 0)
+    return tmp_path
+
+def _make_file(path, size=10, age=0):
+    path.write_bytes(b'\x00' * size)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return str(path)
+
+def test_sweep_removes_expired_unprotected_files(folders):
+    uploads = folders / 'upload_folder'
+    old = _make_file(uploads / 'old.wav', age=120)
+    fresh = _make_file(uploads / 'fresh.wav')
+    active = _make_file(uploads / 'active.wav', age=120)
+
+    janitor = StorageJanitor(lambda: {active})
+    assert janitor.sweep() == 1
+    assert not os.path.exists(old)
+    assert os.path.exists(fresh)
+    assert os.path.exists(active)
+
+def test_upload_quota_rejects_new_files(folders, monkeypatch):
+    monkeypatch.setattr(Config, 'UPLOAD_QUOTA_BYTES', 100)
+    _make_file(folders / 'upload_folder' / 'a.wav', size=80)
+
+    janitor = StorageJanitor()
+    assert janitor.has_capacity(10)
+    assert not janitor.has_capacity(50)
+
+def test_remove_tree(folders):
+    directory = folders / 'upload_folder' / 'task'
+    directory.mkdir()
+    _make_file(directory / 'merged.wav')
+
+    remove_tree(str(directory))
+    assert os.listdir(folders / 'upload_folder') == []
@@ -0,0 +1,99 @@
+import json
+import pytest
+from app.stream_recognizer import StreamRecognizerPool, StreamCapacityError, StreamConfigError, handle_stream
+
+class FakeRecognizer:
+    """Фраза заканчивается на кадре b'.', промежуточный текст - накопленные байты"""
+
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.buffer = b''
+        self.resets = 0
+
+    def AcceptWaveform(self, data):
+        self.buffer += data
+        return data == b'.'
+
+    def Result(self):
+        text, self.buffer = self.buffer.decode(), b''
+        return json.dumps({'text': text})
+
+    def PartialResult(self):
+        return json.dumps({'partial': self.buffer.decode()})
+
+    def FinalResult(self):
+        return self.Result()
+
+    def Reset(self):
+        self.buffer = b''
+        self.resets += 1
+
+class FakeWebSocket:
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.sent = []
+
+    def receive(self):
+        return self.messages.pop(0) if self.messages else None
+
+    def send(self, data):
+        self.sent.append(json.loads(data))
+
+@pytest.fixture
+def pool():
+    return StreamRecognizerPool(size=2, recognizer_factory=FakeRecognizer)
+
+def test_stream_sends_partial_and_final_results(pool):
+    ws = FakeWebSocket([b'ab', b'', b'c', b'.', b'de', '{"eof": 1}', b'ignored'])
+    handle_stream(ws, pool)
+
+    assert ws.sent == [
+        {'partial': 'ab'},
+        {'partial': 'abc'},
+        {'text': 'abc.'},
+        {'partial': 'de'},
+        {'text': 'de'},
+    ]
+
+def test_config_message_sets_sample_rate(pool):
+    ws = FakeWebSocket(['{"config": {"sample_rate": 8000}}', b'x'])
+    handle_stream(ws, pool)
+
+    recognizer = pool.acquire(8000)
+    assert recognizer.sample_rate == 8000
+    assert recognizer.resets == 1
+
+@pytest.mark.parametrize('message', [
+    '{"config": "16000"}',
+    '{"config": {"sample_rate": "8000"}}',
+    '{"config": {"sample_rate": -1}}',
+    '{"config": {"sample_rate": 16000.5}}',
+    '{"config": {"sample_rate": 10000000}}',
+    '[1, 2]',
+])
+def test_invalid_config_is_rejected(pool, message):
+    ws = FakeWebSocket([message, b'x'])
+    with pytest.raises(StreamConfigError):
+        handle_stream(ws, pool)
+
+    assert ws.messages == [b'x']
+    assert pool.acquire(16000) is not None
+
+def test_invalid_sample_rate_parameter_is_rejected(pool):
+    with pytest.raises(StreamConfigError):
+        handle_stream(FakeWebSocket([b'x']), pool, sample_rate=0)
+
+def test_diarization_can_be_disallowed(pool):
+    ws = FakeWebSocket(['{"config": {"diarize": 1}}', b'x'])
+    with pytest.raises(StreamConfigError):
+        handle_stream(ws, pool, diarizer_factory=lambda: pytest.fail('diarizer created'),
+                      allow_diarization=False)
+
+def test_pool_limits_concurrent_sessions(pool):
+    first = pool.acquire(16000)
+    pool.acquire(16000)
+    with pytest.raises(StreamCapacityError):
+        pool.acquire(16000)
+
+    pool.release(16000, first)
+    assert pool.acquire(16000) is first
@@ -0,0 +1,58 @@
+import time
+import threading
+import pytest
+from app.task_registry import TaskRegistry
+
+@pytest.fixture
+def registry():
+    return TaskRegistry(ttl=60, max_tasks=3, stuck_timeout=60)
+
+def test_update_after_cancel_is_ignored(registry):
+    registry.create('task', {'status': 'processing', 'progress': 10})
+    assert registry.cancel('task') == ('processing', True)
+
+    assert not registry.update('task', {'status': 'completed'})
+    assert registry.get('task')['status'] == 'cancelled'
+    assert registry.cancel('task') == ('cancelled', False)
+    assert registry.cancel('missing') == (None, False)
+
+def test_list_is_paginated(registry):
+    for i in range(3):
+        registry.create(f'task-{i}', {'status': 'queued'})
+
+    page, total = registry.list(offset=1, limit=1)
+    assert total == 3
+    assert [task['task_id'] for task in page] == ['task-1']
+
+def test_overflow_evicts_oldest_finished(registry):
+    registry.create('done', {'status': 'processing'})
+    registry.update('done', {'status': 'completed'})
+    for i in range(3):
+        registry.create(f'task-{i}', {'status': 'queued'})
+
+    assert 'done' not in registry
+    assert len(registry) == 3
+
+def test_cleanup_marks_stuck_and_expires_finished(registry):
+    registry.create('stuck', {'status': 'processing'})
+    registry.create('old', {'status': 'processing'})
+    registry.update('old', {'status': 'error'})
+    registry._tasks['stuck']['last_update'] = time.time() - 120
+    registry._tasks['old']['finished_at'] = time.time() - 120
+
+    assert registry.cleanup() == (1, 1)
+    assert registry.get('stuck')['status'] == 'error'
+    assert 'old' not in registry
+
+def test_wait_for_change_wakes_on_update(registry):
+    status = registry.create('task', {'status': 'processing', 'progress': 10})
+    threading.Timer(0.1, registry.update, ('task', {'progress': 20})).start()
+
+    started = time.time()
+    assert registry.wait_for_change('task', status['last_update'], timeout=5)['progress'] == 20
+    assert time.time() - started < 5
+
+def test_wait_for_change_times_out(registry):
+    status = registry.create('task', {'status': 'processing', 'progress': 10})
+    assert registry.wait_for_change('task', status['last_update'], timeout=0.1) == status
+    assert registry.wait_for_change('missing', None, timeout=0.1) is None